@@ -0,0 +1,118 @@
+# Admission control
+# admission.py
+#
+# Every request must get a slot before its view runs. Writes share a small
+# per-warehouse budget (SQLite serialises them on one lock anyway) and reads a
+# larger global one, so a write burst cannot starve the dashboards. A request that
+# finds the wait queue full, or waits longer than its deadline, is turned away at
+# once with 503 + Retry-After instead of timing out after the server did the work.
+import os
+import threading
+from flask import request, g, Response
+import warehouses
+
+WRITE_CONCURRENCY = int(os.environ.get('ADMISSION_WRITE_CONCURRENCY', 2))
+WRITE_QUEUE = int(os.environ.get('ADMISSION_WRITE_QUEUE', 16))
+WRITE_WAIT_SECONDS = float(os.environ.get('ADMISSION_WRITE_WAIT', 2))
+READ_CONCURRENCY = int(os.environ.get('ADMISSION_READ_CONCURRENCY', 16))
+READ_QUEUE = int(os.environ.get('ADMISSION_READ_QUEUE', 64))
+READ_WAIT_SECONDS = float(os.environ.get('ADMISSION_READ_WAIT', 1))
+RETRY_AFTER_SECONDS = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))
+
+
+class Gate:
+    # At most `concurrency` requests inside, at most `queue_limit` waiting for a slot
+    def __init__(self, name, concurrency, queue_limit, wait_seconds):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.wait_seconds = wait_seconds
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def enter(self):
+        if self.slots.acquire(blocking=False):
+            return self._admit()
+        with self.lock:
+            if self.waiting >= self.queue_limit:
+                self.shed += 1
+                return False
+            self.waiting += 1
+        acquired = self.slots.acquire(timeout=self.wait_seconds)
+        with self.lock:
+            self.waiting -= 1
+            if not acquired:
+                self.shed += 1
+                return False
+        return self._admit()
+
+    def _admit(self):
+        with self.lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {'concurrency': self.concurrency, 'in_flight': self.in_flight, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'shed': self.shed}
+
+
+read_gate = Gate('read', READ_CONCURRENCY, READ_QUEUE, READ_WAIT_SECONDS)
+write_gates = {name: Gate('write:' + name, WRITE_CONCURRENCY, WRITE_QUEUE, WRITE_WAIT_SECONDS)
+               for name in warehouses.names()}
+
+
+def write(view):
+    # Mark a GET route that changes data (delete links, process_return) as a write
+    view.admission = 'write'
+    return view
+
+
+def exempt(view):
+    # Long-lived or probe routes (SSE, health checks) that must not take a slot
+    view.admission = 'exempt'
+    return view
+
+
+def classify(app):
+    view = app.view_functions.get(request.endpoint)
+    if view is None or request.endpoint == 'static':
+        return 'exempt'
+    kind = getattr(view, 'admission', None)
+    if kind:
+        return kind
+    return 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+
+def stats():
+    return {'read': read_gate.stats(), 'write': {name: gate.stats() for name, gate in write_gates.items()}}
+
+
+def init_app(app):
+    @app.before_request
+    def admit():
+        kind = classify(app)
+        if kind == 'exempt':
+            return None
+        gate = write_gates[warehouses.current()] if kind == 'write' else read_gate
+        if not gate.enter():
+            return Response(f'Server busy ({gate.name}), please retry shortly', status=503,
+                            headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+        g.admission_gate = gate
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        gate = g.pop('admission_gate', None)
+        if gate is not None:
+            gate.leave()
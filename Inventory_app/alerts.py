@@ -0,0 +1,140 @@
+# Low-stock alerts
+# alerts.py
+import os
+import json
+import time
+import threading
+import urllib.request
+import logging
+import database
+import warehouses
+
+log = logging.getLogger('inventory.alerts')
+
+DEFAULT_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 5))
+WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL', '')
+ALERT_LOG_PATH = os.environ.get('ALERT_LOG_PATH', 'alerts.log')
+POLL_SECONDS = float(os.environ.get('ALERT_POLL_SECONDS', 5))
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+
+_dispatcher = None
+
+
+def stock_level(units_available, threshold):
+    if units_available <= 0:
+        return 'out_of_stock'
+    if units_available <= threshold:
+        return 'low_stock'
+    return 'ok'
+
+
+def evaluate(conn, serials):
+    # Check only the items touched by the current write. Runs inside the caller's
+    # transaction so the outbox row commits (or rolls back) together with the stock change.
+    serials = [s for s in set(serials) if s]
+    if not serials:
+        return 0
+
+    placeholders = ','.join('?' * len(serials))
+    rows = conn.execute(f'''
+        SELECT i.serial, COALESCE(i.units_available, 0) AS units_available,
+               COALESCE(t.low_stock_units, ?) AS threshold, s.level AS previous_level
+        FROM items i
+        LEFT JOIN stock_thresholds t ON t.item_serial = i.serial
+        LEFT JOIN stock_alert_state s ON s.item_serial = i.serial
+        WHERE i.serial IN ({placeholders})
+    ''', [DEFAULT_THRESHOLD] + serials).fetchall()
+
+    queued = 0
+    for row in rows:
+        level = stock_level(row['units_available'], row['threshold'])
+        previous = row['previous_level'] or 'ok'
+        if level == previous:
+            continue
+        conn.execute('''
+            INSERT INTO stock_alert_state (item_serial, level) VALUES (?, ?)
+            ON CONFLICT(item_serial) DO UPDATE SET level = excluded.level
+        ''', (row['serial'], level))
+        conn.execute('''
+            INSERT INTO alert_outbox (created_at, item_serial, level, units_available, threshold)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (database.utc_now(), row['serial'], 'restocked' if level == 'ok' else level, row['units_available'], row['threshold']))
+        queued += 1
+    return queued
+
+
+def get_thresholds(conn):
+    rows = conn.execute('SELECT item_serial, low_stock_units FROM stock_thresholds').fetchall()
+    return {row['item_serial']: row['low_stock_units'] for row in rows}
+
+
+def set_threshold(conn, serial, low_stock_units):
+    conn.execute('''
+        INSERT INTO stock_thresholds (item_serial, low_stock_units) VALUES (?, ?)
+        ON CONFLICT(item_serial) DO UPDATE SET low_stock_units = excluded.low_stock_units
+    ''', (serial, low_stock_units))
+    evaluate(conn, [serial])
+
+
+def deliver(alert, warehouse):
+    payload = {
+        'id': alert['id'],
+        'warehouse': warehouse,
+        'created_at': alert['created_at'],
+        'item_serial': alert['item_serial'],
+        'item_name': alert['item_name'],
+        'level': alert['level'],
+        'units_available': alert['units_available'],
+        'threshold': alert['threshold'],
+    }
+    if WEBHOOK_URL:
+        req = urllib.request.Request(WEBHOOK_URL, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=10).close()
+    else:
+        # Local stand-in for the webhook/email channel
+        with open(ALERT_LOG_PATH, 'a') as f:
+            f.write(json.dumps(payload) + '\n')
+
+
+def drain_outbox(warehouse):
+    conn = database.get_db_connection(warehouse)
+    alerts = conn.execute('''
+        SELECT o.*, i.item_name FROM alert_outbox o
+        LEFT JOIN items i ON i.serial = o.item_serial
+        WHERE o.delivered_at IS NULL AND o.attempts < ?
+        ORDER BY o.id LIMIT ?
+    ''', (MAX_ATTEMPTS, BATCH_SIZE)).fetchall()
+
+    for alert in alerts:
+        try:
+            deliver(alert, warehouse)
+            conn.execute('UPDATE alert_outbox SET delivered_at = ?, attempts = attempts + 1 WHERE id = ?',
+                         (database.utc_now(), alert['id']))
+        except Exception as e:
+            conn.execute('UPDATE alert_outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                         (str(e), alert['id']))
+        conn.commit()
+
+    conn.close()
+    return len(alerts)
+
+
+def _run_dispatcher():
+    while True:
+        try:
+            for name in warehouses.names():
+                # Keep draining while full batches come back
+                while drain_outbox(name) == BATCH_SIZE:
+                    pass
+        except Exception as e:
+            log.warning('alert dispatcher failed', extra={'error': str(e)})
+        time.sleep(POLL_SECONDS)
+
+
+def start_dispatcher():
+    global _dispatcher
+    if _dispatcher is None and os.environ.get('ALERT_DISPATCHER', '1') == '1':
+        _dispatcher = threading.Thread(target=_run_dispatcher, name='alert-dispatcher', daemon=True)
+        _dispatcher.start()
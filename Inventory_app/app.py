@@ -1,386 +1,624 @@
-# Main application
-# app.py
-import os
-from flask import Flask, render_template, request, redirect, url_for
-import database
-import sqlite3
-
-app = Flask(__name__)
-
-# Database will be initialized when first accessed
-
-@app.route('/')
-def dashboard():
-    conn = database.get_db_connection()
-    
-    # Get all data
-    conversion_kits = conn.execute("SELECT * FROM items WHERE item_type = 'conversion_kit'").fetchall()
-    spare_parts = conn.execute("SELECT * FROM items WHERE item_type = 'spare_part'").fetchall()
-    
-    # Get recent returns (latest 5)
-    returns = conn.execute('SELECT * FROM returns ORDER BY date DESC LIMIT 5').fetchall()
-    
-    # Get recent allocations - separate conversion kits from spare part replacements
-    kit_allocations = conn.execute('''
-        SELECT a.* FROM allocations a
-        INNER JOIN items i ON a.new_item_serial = i.serial
-        WHERE i.item_type = 'conversion_kit'
-        ORDER BY a.date DESC LIMIT 5
-    ''').fetchall()
-    
-    spare_replacements = conn.execute('''
-        SELECT a.* FROM allocations a
-        LEFT JOIN items i ON a.new_item_serial = i.serial
-        WHERE (i.item_type = 'spare_part' OR i.item_type IS NULL)
-        AND a.old_item_serial IS NOT NULL
-        ORDER BY a.date DESC LIMIT 5
-    ''').fetchall()
-    
-    # Calculate accurate totals from database
-    totals_query = conn.execute('''
-        SELECT 
-            COALESCE(SUM(CASE WHEN units_imported IS NOT NULL THEN units_imported ELSE 0 END), 0) as total_imported,
-            COALESCE(SUM(CASE WHEN units_installed IS NOT NULL THEN units_installed ELSE 0 END), 0) as total_installed,
-            COALESCE(SUM(CASE WHEN units_available IS NOT NULL THEN units_available ELSE 0 END), 0) as total_available,
-            COUNT(CASE WHEN item_name IS NOT NULL AND item_name != '' THEN 1 END) as total_items
-        FROM items 
-        WHERE item_type IN ('conversion_kit', 'spare_part')
-    ''').fetchone()
-    
-    # Get additional statistics
-    stats_query = conn.execute('''
-        SELECT 
-            COUNT(CASE WHEN item_type = 'conversion_kit' AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as conversion_kits_count,
-            COUNT(CASE WHEN item_type = 'spare_part' AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as spare_parts_count,
-            COUNT(CASE WHEN (units_available IS NULL OR units_available = 0) AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as out_of_stock_count,
-            COUNT(CASE WHEN units_available > 0 AND units_available <= 5 AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as low_stock_count
-        FROM items 
-        WHERE item_type IN ('conversion_kit', 'spare_part')
-    ''').fetchone()
-    
-    # Get return and allocation counts
-    return_count = conn.execute('SELECT COUNT(*) as count FROM returns').fetchone()['count']
-    allocation_count = conn.execute('SELECT COUNT(*) as count FROM allocations').fetchone()['count']
-    pending_returns = conn.execute("SELECT COUNT(*) as count FROM returns WHERE status = 'pending' OR status IS NULL").fetchone()['count']
-    
-    conn.close()
-    
-    # Calculate stock availability percentage
-    stock_availability = 0
-    if totals_query['total_imported'] > 0:
-        stock_availability = round((totals_query['total_available'] / totals_query['total_imported']) * 100, 1)
-    
-    return render_template('dashboard.html', 
-                           conversion_kits=conversion_kits, 
-                           spare_parts=spare_parts, 
-                           returns=returns, 
-                           kit_allocations=kit_allocations,
-                           spare_replacements=spare_replacements,
-                           total_imported=totals_query['total_imported'],
-                           total_installed=totals_query['total_installed'],
-                           total_available=totals_query['total_available'],
-                           total_items=totals_query['total_items'],
-                           conversion_kits_count=stats_query['conversion_kits_count'],
-                           spare_parts_count=stats_query['spare_parts_count'],
-                           out_of_stock_count=stats_query['out_of_stock_count'],
-                           low_stock_count=stats_query['low_stock_count'],
-                           return_count=return_count,
-                           allocation_count=allocation_count,
-                           pending_returns=pending_returns,
-                           stock_availability=stock_availability)
-
-@app.route('/conversion_kits')
-def conversion_kits():
-    try:
-        conn = database.get_db_connection()
-        kits = conn.execute("SELECT * FROM items WHERE item_type = 'conversion_kit' ORDER BY serial").fetchall()
-        
-        # Get allocations for conversion kits only
-        allocations = conn.execute('''
-            SELECT a.* FROM allocations a
-            INNER JOIN items i ON a.new_item_serial = i.serial
-            WHERE i.item_type = 'conversion_kit'
-            ORDER BY a.date DESC
-        ''').fetchall()
-        
-        conn.close()
-        return render_template('conversion_kits.html', kits=kits, allocations=allocations)
-    except Exception as e:
-        # Initialize database if tables don't exist
-        database.init_db()
-        return redirect(url_for('conversion_kits'))
-
-@app.route('/spare_parts')
-def spare_parts():
-    try:
-        conn = database.get_db_connection()
-        parts = conn.execute("SELECT * FROM items WHERE item_type = 'spare_part'").fetchall()
-        replacements = conn.execute('SELECT * FROM allocations WHERE old_item_serial IS NOT NULL').fetchall()
-        conn.close()
-        return render_template('spare_parts.html', parts=parts, replacements=replacements)
-    except Exception as e:
-        # Initialize database if tables don't exist
-        database.init_db()
-        return redirect(url_for('spare_parts'))
-
-@app.route('/returns')
-def returns():
-    try:
-        conn = database.get_db_connection()
-        returns_list = conn.execute('SELECT * FROM returns ORDER BY date DESC').fetchall()
-        conn.close()
-        return render_template('returns.html', returns=returns_list)
-    except Exception as e:
-        # Initialize database if tables don't exist
-        database.init_db()
-        return redirect(url_for('returns'))
-
-@app.route('/add_item', methods=['POST'])
-def add_item():
-    conn = database.get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
-            VALUES (?, ?, ?, ?, date('now'), ?, ?, ?)
-        ''', (request.form['serial'], request.form['item_name'], request.form['item_type'], 
-              request.form.get('admin', ''), int(request.form.get('units_imported', 0)), 
-              int(request.form.get('units_installed', 0)), int(request.form.get('units_available', 0))))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        # Serial number already exists, ignore and continue
-        pass
-    conn.close()
-    return redirect(url_for('dashboard'))
-
-@app.route('/add_conversion_kit', methods=['POST'])
-def add_conversion_kit():
-    conn = database.get_db_connection()
-    
-    units_imported = int(request.form['units_imported'] or 0)
-    units_available = int(request.form['units_available'] or units_imported)
-    
-    conn.execute('''
-        INSERT INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
-        VALUES (?, ?, ?, ?, date('now'), ?, 0, ?)
-    ''', (request.form['serial'], request.form['item_name'], 'conversion_kit', 
-          request.form['admin'], units_imported, units_available))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('conversion_kits'))
-
-@app.route('/add_allocation', methods=['POST'])
-def add_allocation():
-    conn = database.get_db_connection()
-    
-    # Add allocation record
-    conn.execute('''
-        INSERT INTO allocations (date, old_item_serial, new_item_serial, rider_number, rider_name, station)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (request.form['date'], request.form['old_item_serial'], request.form['new_item_serial'],
-          request.form['rider_number'], request.form['rider_name'], request.form['station']))
-    
-    # Update units_installed and units_available for the allocated item
-    new_serial = request.form['new_item_serial']
-    
-    # Check if item exists and has available units
-    item_check = conn.execute('SELECT units_available FROM items WHERE serial = ?', (new_serial,)).fetchone()
-    
-    if item_check and item_check['units_available'] > 0:
-        conn.execute('''
-            UPDATE items 
-            SET units_installed = COALESCE(units_installed, 0) + 1,
-                units_available = CASE 
-                    WHEN COALESCE(units_available, 0) > 0 THEN COALESCE(units_available, 0) - 1 
-                    ELSE 0 
-                END
-            WHERE serial = ?
-        ''', (new_serial,))
-    
-    conn.commit()
-    conn.close()
-    return redirect(url_for('conversion_kits'))
-
-@app.route('/add_replacement', methods=['POST'])
-def add_replacement():
-    conn = database.get_db_connection()
-    conn.execute('''
-        INSERT INTO allocations (date, old_item_serial, new_item_serial, rider_number, rider_name, released_to, link, station)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (request.form['date'], request.form['old_item_serial'], request.form['new_item_serial'],
-          request.form['rider_number'], request.form['rider_name'], request.form['released_to'],
-          request.form.get('link', ''), request.form.get('station', '')))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('spare_parts'))
-
-@app.route('/add_return', methods=['POST'])
-def add_return():
-    conn = database.get_db_connection()
-    conn.execute('''
-        INSERT INTO returns (date, item_serial, personnel, status, notes, condition_rating)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (request.form['date'], request.form['item_serial'], request.form['personnel'], 
-          request.form.get('status', 'pending'), request.form.get('notes', ''), 
-          request.form.get('condition_rating', 5)))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('returns'))
-
-@app.route('/update_item/<int:item_id>', methods=['POST'])
-def update_item(item_id):
-    conn = database.get_db_connection()
-    
-    # Get the item type to determine redirect
-    item = conn.execute('SELECT item_type FROM items WHERE id = ?', (item_id,)).fetchone()
-    item_type = item['item_type'] if item else 'conversion_kit'
-    
-    # Validate and calculate proper values
-    units_imported = int(request.form['units_imported'] or 0)
-    units_installed = int(request.form['units_installed'] or 0)
-    units_available = int(request.form['units_available'] or 0)
-    
-    # Ensure data integrity: available + installed should not exceed imported
-    if units_installed + units_available > units_imported:
-        units_available = max(0, units_imported - units_installed)
-    
-    conn.execute('''
-        UPDATE items SET serial=?, item_name=?, item_type=?, admin=?, created_at=?, 
-        units_imported=?, units_installed=?, units_available=? WHERE id=?
-    ''', (request.form['serial'], request.form['item_name'], request.form['item_type'],
-          request.form['admin'], request.form.get('created_at', ''), units_imported,
-          units_installed, units_available, item_id))
-    conn.commit()
-    conn.close()
-    
-    # Redirect based on item type
-    if item_type == 'conversion_kit':
-        return redirect(url_for('conversion_kits'))
-    elif item_type == 'spare_part':
-        return redirect(url_for('spare_parts'))
-    else:
-        return redirect(url_for('dashboard'))
-
-@app.route('/delete_item/<int:item_id>')
-def delete_item(item_id):
-    conn = database.get_db_connection()
-    
-    # Get the item type to determine redirect
-    item = conn.execute('SELECT item_type FROM items WHERE id = ?', (item_id,)).fetchone()
-    item_type = item['item_type'] if item else 'conversion_kit'
-    
-    conn.execute('DELETE FROM items WHERE id = ?', (item_id,))
-    conn.commit()
-    conn.close()
-    
-    # Redirect based on item type
-    if item_type == 'conversion_kit':
-        return redirect(url_for('conversion_kits'))
-    elif item_type == 'spare_part':
-        return redirect(url_for('spare_parts'))
-    else:
-        return redirect(url_for('dashboard'))
-
-@app.route('/delete_allocation/<int:alloc_id>')
-def delete_allocation(alloc_id):
-    conn = database.get_db_connection()
-    conn.execute('DELETE FROM allocations WHERE id = ?', (alloc_id,))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('conversion_kits'))
-
-@app.route('/delete_return/<int:return_id>')
-def delete_return(return_id):
-    conn = database.get_db_connection()
-    conn.execute('DELETE FROM returns WHERE id = ?', (return_id,))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('returns'))
-
-@app.route('/delete_replacement/<int:replacement_id>')
-def delete_replacement(replacement_id):
-    conn = database.get_db_connection()
-    conn.execute('DELETE FROM allocations WHERE id = ?', (replacement_id,))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('spare_parts'))
-
-@app.route('/update_replacement/<int:replacement_id>', methods=['POST'])
-def update_replacement(replacement_id):
-    conn = database.get_db_connection()
-    conn.execute('''
-        UPDATE allocations SET date = ?, old_item_serial = ?, new_item_serial = ?, 
-        rider_name = ?, rider_number = ?, station = ? WHERE id = ?
-    ''', (request.form['date'], request.form['old_item_serial'], request.form['new_item_serial'],
-          request.form['rider_name'], request.form['rider_number'], request.form['station'], replacement_id))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('spare_parts'))
-
-@app.route('/update_return_status/<int:return_id>', methods=['POST'])
-def update_return_status(return_id):
-    conn = database.get_db_connection()
-    conn.execute('''
-        UPDATE returns SET status = ?, notes = ? WHERE id = ?
-    ''', (request.form['status'], request.form['notes'], return_id))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('returns'))
-
-@app.route('/update_return/<int:return_id>', methods=['POST'])
-def update_return(return_id):
-    conn = database.get_db_connection()
-    conn.execute('''
-        UPDATE returns SET date = ?, item_serial = ?, personnel = ?, status = ?, notes = ? WHERE id = ?
-    ''', (request.form['date'], request.form['item_serial'], request.form['personnel'], 
-          request.form['status'], request.form['notes'], return_id))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('returns'))
-
-@app.route('/process_return/<int:return_id>')
-def process_return(return_id):
-    conn = database.get_db_connection()
-    
-    # Get return details
-    return_item = conn.execute('SELECT * FROM returns WHERE id = ?', (return_id,)).fetchone()
-    
-    if return_item:
-        # Update return status
-        conn.execute('''
-            UPDATE returns SET status = 'processed', processed_date = date('now') WHERE id = ?
-        ''', (return_id,))
-        
-        # Update inventory - add returned item back to available stock
-        item_exists = conn.execute('SELECT id FROM items WHERE serial = ?', (return_item['item_serial'],)).fetchone()
-        
-        if item_exists:
-            conn.execute('''
-                UPDATE items 
-                SET units_available = COALESCE(units_available, 0) + 1,
-                    units_installed = CASE 
-                        WHEN COALESCE(units_installed, 0) > 0 THEN COALESCE(units_installed, 0) - 1 
-                        ELSE 0 
-                    END
-                WHERE serial = ?
-            ''', (return_item['item_serial'],))
-        else:
-            # If item doesn't exist in inventory, just mark return as processed
-            pass
-    
-    conn.commit()
-    conn.close()
-    return redirect(url_for('returns'))
-
-# Initialize database when app starts
-try:
-    database.init_db()
-except Exception as e:
-    print(f"Database initialization warning: {e}")
-
-# ⚠️ CRITICAL: Railway-specific changes below
-if __name__ == '__main__':
-    # Get port from Railway environment variable or default to 5000
-    port = int(os.environ.get('PORT', 5000))
-    
-    # Run the app - debug=False for production
+# Main application
+# app.py
+import os
+import logging
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, abort, g, send_file, stream_with_context
+import database
+import logs
+import coherence
+import forecast
+import reliability
+import alerts
+import history
+import httpcache
+import panels
+import events
+import warehouses
+import repository
+import archive
+import backup
+import metrics
+import scheduler
+import maintenance
+import idempotency
+import admission
+import jobs
+import sync
+import snapshot
+import health
+import units
+import time
+import multiprocessing
+
+app = Flask(__name__)
+log = logging.getLogger('inventory.app')
+
+# JSON logs written off the request thread, with request IDs (first, so every other hook is covered)
+logs.init_app(app)
+httpcache.init_app(app)
+
+# Listing pages stream their rows (STREAM_PAGES=0 renders them in one piece instead)
+STREAM_PAGES = os.environ.get('STREAM_PAGES', '1') != '0'
+STREAM_BUFFER = 64  # template chunks per write
+
+def render_listing(template_name, **context):
+    # Row iterators in the context are consumed while the page is sent, so the
+    # header flushes at once and memory stays flat however long the tables get
+    if not STREAM_PAGES:
+        return render_template(template_name, **context)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+# Database will be initialized when first accessed
+
+@app.before_request
+def select_warehouse():
+    # ?warehouse= switches depots (and is remembered in a cookie); API clients can send X-Warehouse
+    name = request.args.get('warehouse') or request.headers.get('X-Warehouse') or request.cookies.get('warehouse')
+    warehouses.use(name)
+
+@app.before_request
+def check_coherence():
+    # Drop in-process caches that another worker's writes have made stale
+    coherence.check()
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # Latency samples let background jobs report their effect on p99
+    if 'request_started' in g:
+        metrics.record(time.perf_counter() - g.request_started)
+    return response
+
+# Read/write budgets with fast 503s when saturated (after the warehouse is known)
+admission.init_app(app)
+
+@app.after_request
+def remember_warehouse(response):
+    name = request.args.get('warehouse')
+    if name and warehouses.exists(name):
+        response.set_cookie('warehouse', name, max_age=365 * 24 * 3600, samesite='Lax')
+    return response
+
+@app.route('/')
+@httpcache.conditional
+def dashboard():
+    conn = snapshot.get_read_connection()
+    
+    # Get all data
+    conversion_kits = conn.execute("SELECT * FROM items WHERE item_type = 'conversion_kit'").fetchall()
+    spare_parts = conn.execute("SELECT * FROM items WHERE item_type = 'spare_part'").fetchall()
+    
+    # Get recent returns (latest 5)
+    returns = panels.recent_returns(conn)
+    
+    # Get recent allocations - separate conversion kits from spare part replacements
+    kit_allocations = panels.recent_kit_allocations(conn)
+    spare_replacements = panels.recent_replacements(conn)
+    
+    # Totals and statistics
+    stats = panels.stats(conn)
+    
+    # Cursors for incremental refresh from script.js
+    returns_cursor = panels.cursor(conn, 'returns')
+    allocations_cursor = panels.cursor(conn, 'allocations')
+    
+    conn.close()
+    
+    return render_template('dashboard.html', 
+                           conversion_kits=conversion_kits, 
+                           spare_parts=spare_parts, 
+                           returns=returns, 
+                           kit_allocations=kit_allocations,
+                           spare_replacements=spare_replacements,
+                           returns_cursor=returns_cursor,
+                           allocations_cursor=allocations_cursor,
+                           **stats)
+
+@app.route('/api/dashboard/stats')
+@httpcache.conditional
+def api_dashboard_stats():
+    conn = snapshot.get_read_connection()
+    stats = panels.stats(conn)
+    conn.close()
+    return jsonify(stats)
+
+@app.route('/api/dashboard/<panel>')
+@httpcache.conditional
+def api_dashboard_panel(panel):
+    queries = {
+        'returns': (panels.recent_returns, 'returns'),
+        'kit_allocations': (panels.recent_kit_allocations, 'allocations'),
+        'replacements': (panels.recent_replacements, 'allocations'),
+    }
+    if panel not in queries:
+        abort(404)
+    query, table = queries[panel]
+    
+    conn = snapshot.get_read_connection()
+    rows = query(conn, since=request.args.get('since', 0, type=int))
+    next_cursor = panels.cursor(conn, table)
+    conn.close()
+    return jsonify(rows=[dict(row) for row in rows], cursor=next_cursor)
+
+@app.route('/warehouses')
+@httpcache.conditional
+def warehouse_overview():
+    # Fan the summary query out to every warehouse in parallel and merge the results
+    summaries = warehouses.fan_out(panels.warehouse_summary)
+    totals, items = panels.merge_warehouse_summaries(summaries)
+    return render_template('warehouses.html', summaries=summaries, totals=totals, items=items,
+                           warehouse_names=warehouses.names(), current_warehouse=warehouses.current())
+
+@app.route('/healthz')
+@admission.exempt
+def healthz():
+    # Liveness: the process is up and serving; no database work
+    return jsonify(health.liveness())
+
+@app.route('/readyz')
+@admission.exempt
+def readyz():
+    # Readiness: every warehouse answers within its budgets (503 otherwise)
+    result = health.readiness()
+    return jsonify(result), 503 if result['status'] == 'fail' else 200
+
+@app.route('/api/backups')
+def backup_status():
+    # Backups on disk and the report of the last run, per warehouse
+    return jsonify({name: {'files': backup.backup_files(name), 'last_run': backup.last_results.get(name)}
+                    for name in warehouses.names()})
+
+@app.route('/jobs', methods=['GET'])
+def job_list():
+    return jsonify(jobs=jobs.recent())
+
+@app.route('/jobs', methods=['POST'])
+def start_job():
+    # JSON {"kind": "export", "params": {"table": "allocations"}} or a form with kind + params fields
+    payload = request.get_json(silent=True) or {}
+    kind = payload.get('kind') or request.form.get('kind')
+    params = payload.get('params') or {k: v for k, v in request.form.items() if k not in ('kind', 'idempotency_key')}
+    if kind not in jobs.TASKS:
+        return jsonify(error=f'Unknown job kind {kind!r}', kinds=list(jobs.TASKS)), 400
+    job_id = jobs.submit(kind, params)
+    return jsonify(jobs.get(job_id)), 202, {'Location': url_for('job_status', job_id=job_id)}
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    jobs.cancel(job_id)
+    return jsonify(jobs.get(job_id) or abort(404))
+
+@app.route('/jobs/<int:job_id>/download')
+def download_job_result(job_id):
+    job = jobs.get(job_id)
+    if not job or job['status'] != 'done' or not (job['result'] or {}).get('file'):
+        abort(404)
+    return send_file(job['result']['file'], as_attachment=True)
+
+@app.route('/sync', methods=['GET'])
+def sync_changes():
+    # Changes since a version the device already has (0 = everything); follow "version" while "more"
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', sync.PAGE_SIZE, type=int), sync.MAX_PAGE_SIZE)
+    conn = database.get_db_connection()
+    try:
+        return jsonify(sync.changes(conn, since, max(limit, 1)))
+    finally:
+        conn.close()
+
+@app.route('/sync', methods=['POST'])
+def sync_upload():
+    # Batched offline writes: {"operations": [{"key": "...", "op": "allocation", "data": {...}}, ...]}
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        return jsonify(error='Expected {"operations": [...]}', operations=list(sync.OPERATIONS)), 400
+    if len(operations) > sync.MAX_BATCH:
+        return jsonify(error=f'At most {sync.MAX_BATCH} operations per batch'), 413
+    return jsonify(results=sync.upload(operations))
+
+@app.route('/events')
+@admission.exempt
+def event_stream():
+    # Server-Sent Events feed; resumes from Last-Event-ID after a reconnect
+    if events.full():
+        # Every stream holds a server thread; the dashboard polls instead
+        return Response('Too many live event subscribers, please retry later', status=503,
+                        headers={'Retry-After': str(events.RETRY_AFTER_SECONDS)})
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(events.stream(last_event_id, warehouses.current()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/conversion_kits')
+@httpcache.conditional
+def conversion_kits():
+    repo = repository.get_repository()
+    try:
+        kits = repo.list_items('conversion_kit', order_by_serial=True)
+        
+        # Allocations for conversion kits only, streamed into the page
+        return render_listing('conversion_kits.html', kits=kits, kit_definitions=repo.list_kit_definitions(),
+                              allocations=repo.stream_kit_allocations(),
+                              allocation_count=repo.count_kit_allocations())
+    except Exception as e:
+        # Initialize database if tables don't exist
+        repo.init_schema()
+        return redirect(url_for('conversion_kits'))
+
+@app.route('/spare_parts')
+@httpcache.conditional
+def spare_parts():
+    repo = repository.get_repository()
+    try:
+        parts = repo.list_items('spare_part')
+        return render_listing('spare_parts.html', parts=parts,
+                              replacements=repo.stream_replacements(),
+                              replacement_count=repo.count_replacements())
+    except Exception as e:
+        # Initialize database if tables don't exist
+        repo.init_schema()
+        return redirect(url_for('spare_parts'))
+
+@app.route('/returns')
+@httpcache.conditional
+def returns():
+    repo = repository.get_repository()
+    try:
+        return render_listing('returns.html', returns=repo.stream_returns(), stats=repo.return_stats())
+    except Exception as e:
+        # Initialize database if tables don't exist
+        repo.init_schema()
+        return redirect(url_for('returns'))
+
+@app.route('/reorder')
+@httpcache.conditional(daily=True)
+def reorder():
+    conn = snapshot.get_read_connection()
+    items, lead_time_days, window_days = forecast.reorder_report(conn)
+    thresholds = alerts.get_thresholds(conn)
+    conn.close()
+    reorder_count = sum(1 for item in items if item['needs_reorder'])
+    return render_template('reorder.html', items=items, reorder_count=reorder_count,
+                           lead_time_days=lead_time_days, window_days=window_days,
+                           thresholds=thresholds, default_threshold=alerts.DEFAULT_THRESHOLD)
+
+@app.route('/reliability')
+@httpcache.conditional
+def reliability_report():
+    conn = database.get_db_connection()
+    try:
+        report = reliability.report(conn)
+    finally:
+        conn.close()
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(report)
+    return render_template('reliability.html', report=report)
+
+@app.route('/set_threshold/<serial>', methods=['POST'])
+def set_threshold(serial):
+    conn = database.get_db_connection()
+    alerts.set_threshold(conn, serial, int(request.form['low_stock_units'] or 0))
+    conn.commit()
+    conn.close()
+    return redirect(url_for('reorder'))
+
+@app.route('/rider/<rider_number>')
+@httpcache.conditional
+def rider_history(rider_number):
+    conn = database.get_db_connection()
+    allocations, next_alloc = history.rider_allocations(conn, rider_number, request.args.get('alloc_before', type=int))
+    conn.close()
+    return render_template('history.html', title='Rider ' + rider_number, kind='rider', key=rider_number,
+                           allocations=allocations, next_alloc=next_alloc)
+
+@app.route('/item/<serial>')
+@httpcache.conditional
+def item_history(serial):
+    conn = database.get_db_connection()
+    allocations, next_alloc = history.item_allocations(conn, serial, request.args.get('alloc_before', type=int))
+    returns_list, next_return = history.item_returns(conn, serial, request.args.get('return_before', type=int))
+    item = conn.execute('SELECT * FROM items WHERE serial = ?', (serial,)).fetchone()
+    conn.close()
+    return render_template('history.html', title='Item ' + serial, kind='item', key=serial, item=item,
+                           allocations=allocations, next_alloc=next_alloc,
+                           returns=returns_list, next_return=next_return)
+
+@app.route('/add_item', methods=['POST'])
+@idempotency.idempotent
+def add_item():
+    # Serial numbers that already exist are ignored
+    repository.get_repository().add_item(
+        request.form['serial'], request.form['item_name'], request.form['item_type'],
+        request.form.get('admin', ''), int(request.form.get('units_imported', 0)),
+        int(request.form.get('units_installed', 0)), int(request.form.get('units_available', 0)))
+    return redirect(url_for('dashboard'))
+
+@app.route('/add_conversion_kit', methods=['POST'])
+@idempotency.idempotent
+def add_conversion_kit():
+    units_imported = int(request.form['units_imported'] or 0)
+    units_available = int(request.form['units_available'] or units_imported)
+    
+    repository.get_repository().add_item(
+        request.form['serial'], request.form['item_name'], 'conversion_kit',
+        request.form['admin'], units_imported, 0, units_available)
+    return redirect(url_for('conversion_kits'))
+
+@app.route('/add_allocation', methods=['POST'])
+@idempotency.idempotent
+def add_allocation():
+    repo = repository.get_repository()
+    new_serial = request.form['new_item_serial']
+    
+    # Add allocation record and take the unit out of available stock
+    allocation_id = repo.record_allocation(
+        request.form['date'], request.form['old_item_serial'], new_serial,
+        request.form['rider_number'], request.form['rider_name'], request.form['station'])
+    
+    events.publish('allocation', {'id': allocation_id, 'kind': 'allocation', 'new_item_serial': new_serial,
+                                  'rider_name': request.form['rider_name'], 'station': request.form['station']})
+    events.publish_item(repo.get_item(new_serial))
+    return redirect(url_for('conversion_kits'))
+
+@app.route('/allocate_kit', methods=['POST'])
+@idempotency.idempotent
+def allocate_kit():
+    # Every component of a kit at once: the form allocates one bike, JSON
+    # {"kit_id": 1, "bikes": [{"date", "old_item_serial", "rider_name", ...}, ...]} many
+    repo = repository.get_repository()
+    payload = request.get_json(silent=True)
+    if payload is not None:
+        kit_id, bikes = payload.get('kit_id'), payload.get('bikes')
+    else:
+        kit_id = request.form.get('kit_id', type=int)
+        bikes = [{name: request.form.get(name, '') for name in
+                  ('date', 'old_item_serial', 'rider_number', 'rider_name', 'station')}]
+    if not isinstance(bikes, list) or not bikes or len(bikes) > repo.MAX_KIT_BIKES:
+        return jsonify(error=f'Send between 1 and {repo.MAX_KIT_BIKES} bikes'), 400
+    
+    try:
+        taken = repo.allocate_kit(kit_id, bikes)
+    except repository.InsufficientStock as e:
+        if payload is not None:
+            return jsonify(error=str(e), shortages=e.shortages), 409
+        return Response(str(e), status=409)
+    except (KeyError, TypeError, AttributeError):
+        return jsonify(error='Every bike needs at least a rider_name'), 400
+    except LookupError as e:
+        return jsonify(error=str(e)), 404
+    
+    events.publish('allocation', {'kind': 'kit', 'kit_id': kit_id, 'bikes': len(bikes),
+                                  'station': bikes[0].get('station', '')})
+    for serial in taken:
+        events.publish_item(repo.get_item(serial))
+    if payload is not None:
+        return jsonify(kit_id=kit_id, bikes=len(bikes), components=taken)
+    return redirect(url_for('conversion_kits'))
+
+@app.route('/units/<serial>')
+def unit_summary(serial):
+    # Free unit ranges of a batch and the next unit an allocation would take
+    conn = database.get_db_connection()
+    try:
+        summary = units.summary(conn, serial)
+    finally:
+        conn.close()
+    return jsonify(summary) if summary else (jsonify(error=f'No unit tracking for {serial}'), 404)
+
+@app.route('/units/<serial>/<int:unit>')
+def unit_holder(serial, unit):
+    # Who has one physical unit
+    conn = database.get_db_connection()
+    try:
+        holder = units.holder(conn, serial, unit)
+    finally:
+        conn.close()
+    return jsonify(holder) if holder else (jsonify(error=f'No unit {unit} in batch {serial}'), 404)
+
+@app.route('/kit_definitions', methods=['GET'])
+def kit_definitions():
+    return jsonify(kits=repository.get_repository().list_kit_definitions())
+
+@app.route('/kit_definitions', methods=['POST'])
+def save_kit_definition():
+    # {"name": "...", "description": "...", "components": {"15092501": 1, ...}}
+    payload = request.get_json(silent=True) or {}
+    components = payload.get('components')
+    if not payload.get('name') or not isinstance(components, dict) or not components:
+        return jsonify(error='Expected {"name": ..., "components": {serial: quantity}}'), 400
+    kit_id = repository.get_repository().save_kit_definition(payload['name'], components, payload.get('description', ''))
+    return jsonify(id=kit_id), 201
+
+@app.route('/add_replacement', methods=['POST'])
+@idempotency.idempotent
+def add_replacement():
+    repo = repository.get_repository()
+    replacement_id = repo.record_replacement(
+        request.form['date'], request.form['old_item_serial'], request.form['new_item_serial'],
+        request.form['rider_number'], request.form['rider_name'], request.form['released_to'],
+        request.form.get('link', ''), request.form.get('station', ''))
+    
+    events.publish('allocation', {'id': replacement_id, 'kind': 'replacement',
+                                  'old_item_serial': request.form['old_item_serial'],
+                                  'new_item_serial': request.form['new_item_serial'],
+                                  'rider_name': request.form['rider_name'], 'station': request.form.get('station', '')})
+    events.publish_item(repo.get_item(request.form['new_item_serial']))
+    return redirect(url_for('spare_parts'))
+
+@app.route('/add_return', methods=['POST'])
+@idempotency.idempotent
+def add_return():
+    return_id = repository.get_repository().add_return(
+        request.form['date'], request.form['item_serial'], request.form['personnel'],
+        request.form.get('status', 'pending'), request.form.get('notes', ''),
+        request.form.get('condition_rating', 5), request.form.get('unit_number', type=int))
+    
+    events.publish('return', {'id': return_id, 'item_serial': request.form['item_serial'],
+                              'personnel': request.form['personnel'], 'status': request.form.get('status', 'pending')})
+    return redirect(url_for('returns'))
+
+def redirect_for_item_type(item_type):
+    # Back to the page that lists this kind of item
+    if item_type == 'conversion_kit':
+        return redirect(url_for('conversion_kits'))
+    elif item_type == 'spare_part':
+        return redirect(url_for('spare_parts'))
+    else:
+        return redirect(url_for('dashboard'))
+
+@app.route('/update_item/<int:item_id>', methods=['POST'])
+def update_item(item_id):
+    repo = repository.get_repository()
+    
+    # Validate and calculate proper values
+    units_imported = int(request.form['units_imported'] or 0)
+    units_installed = int(request.form['units_installed'] or 0)
+    units_available = int(request.form['units_available'] or 0)
+    
+    # Ensure data integrity: available + installed should not exceed imported
+    if units_installed + units_available > units_imported:
+        units_available = max(0, units_imported - units_installed)
+    
+    item_type = repo.update_item(item_id, request.form['serial'], request.form['item_name'],
+                                 request.form['item_type'], request.form['admin'],
+                                 request.form.get('created_at', ''), units_imported,
+                                 units_installed, units_available)
+    events.publish_item(repo.get_item(request.form['serial']))
+    
+    # Redirect based on item type
+    return redirect_for_item_type(item_type or 'conversion_kit')
+
+@app.route('/delete_item/<int:item_id>')
+@admission.write
+def delete_item(item_id):
+    item_type = repository.get_repository().delete_item(item_id)
+    
+    # Redirect based on item type
+    return redirect_for_item_type(item_type or 'conversion_kit')
+
+@app.route('/delete_allocation/<int:alloc_id>')
+@admission.write
+def delete_allocation(alloc_id):
+    repository.get_repository().delete_allocation(alloc_id)
+    return redirect(url_for('conversion_kits'))
+
+@app.route('/delete_return/<int:return_id>')
+@admission.write
+def delete_return(return_id):
+    repository.get_repository().delete_return(return_id)
+    return redirect(url_for('returns'))
+
+@app.route('/delete_replacement/<int:replacement_id>')
+@admission.write
+def delete_replacement(replacement_id):
+    repository.get_repository().delete_allocation(replacement_id)
+    return redirect(url_for('spare_parts'))
+
+@app.route('/update_replacement/<int:replacement_id>', methods=['POST'])
+def update_replacement(replacement_id):
+    repository.get_repository().update_replacement(
+        replacement_id, request.form['date'], request.form['old_item_serial'], request.form['new_item_serial'],
+        request.form['rider_name'], request.form['rider_number'], request.form['station'])
+    return redirect(url_for('spare_parts'))
+
+@app.route('/update_return_status/<int:return_id>', methods=['POST'])
+def update_return_status(return_id):
+    repository.get_repository().update_return_status(return_id, request.form['status'], request.form['notes'])
+    return redirect(url_for('returns'))
+
+@app.route('/update_return/<int:return_id>', methods=['POST'])
+def update_return(return_id):
+    repository.get_repository().update_return(
+        return_id, request.form['date'], request.form['item_serial'], request.form['personnel'],
+        request.form['status'], request.form['notes'])
+    return redirect(url_for('returns'))
+
+@app.route('/process_return/<int:return_id>')
+@admission.write
+def process_return(return_id):
+    repo = repository.get_repository()
+    return_item = repo.process_return(return_id)
+    
+    if return_item:
+        events.publish('return', {'id': return_id, 'item_serial': return_item['item_serial'], 'status': 'processed'})
+        events.publish_item(repo.get_item(return_item['item_serial']))
+    return redirect(url_for('returns'))
+
+@app.route('/process_returns', methods=['POST'])
+@idempotency.idempotent
+def process_returns():
+    # Bulk processing: the ticked return_id boxes, or (scope=filter) every pending
+    # return matching the filter fields. Returns already processed are left alone.
+    repo = repository.get_repository()
+    if request.form.get('scope') == 'filter':
+        restored = repo.process_returns(filters={name: request.form.get(name, '').strip()
+                                                 for name in repo.RETURN_FILTERS})
+    else:
+        restored = repo.process_returns(request.form.getlist('return_id', type=int))
+    
+    if restored:
+        events.publish('return', {'status': 'processed', 'count': sum(restored.values())})
+        for serial in restored:
+            events.publish_item(repo.get_item(serial))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(processed=sum(restored.values()), items=restored)
+    return redirect(url_for('returns'))
+
+def start_background_work():
+    # Initialize every warehouse database when app starts
+    for warehouse_name in warehouses.names():
+        try:
+            repository.get_repository(warehouse_name).init_schema()
+            jobs.recover(warehouse_name)
+        except Exception as e:
+            log.warning('database initialization failed', extra={'warehouse': warehouse_name, 'error': str(e)})
+
+    # Every web process keeps its jobs' heartbeat fresh and fails jobs whose process stopped
+    scheduler.every('job-heartbeat', jobs.HEARTBEAT_SECONDS, jobs.beat_all, initial_delay=jobs.HEARTBEAT_SECONDS)
+
+    # In-memory copies for the dashboards (READ_SNAPSHOT=1), kept by each process
+    snapshot.start()
+
+    # The rest runs in one web process only (see scheduler.py)
+    scheduler.when_leader(start_shared_work)
+
+def start_shared_work():
+    # Deliver queued low-stock alerts in the background
+    alerts.start_dispatcher()
+
+    # Move year-old allocations and processed returns into the archive file nightly
+    scheduler.every('archiver', archive.INTERVAL_HOURS * 3600, archive.run_all, env='ARCHIVER', initial_delay=60)
+
+    # Online backups with retention (BACKUPS=0 turns them off)
+    scheduler.every('backups', backup.INTERVAL_HOURS * 3600, backup.run_all, env='BACKUPS', initial_delay=60)
+
+    # ANALYZE, PRAGMA optimize and incremental vacuum once a day in the off-peak window
+    scheduler.every('maintenance', maintenance.CHECK_MINUTES * 60, maintenance.run_due, env='MAINTENANCE')
+
+    # Forget idempotency keys once they are older than IDEMPOTENCY_TTL_HOURS
+    scheduler.every('idempotency-prune', 3600, idempotency.prune_all)
+
+# Job worker processes re-import the main module when they start; only the web
+# process initialises the databases and runs the background schedules
+if multiprocessing.parent_process() is None:
+    start_background_work()
+
+# ⚠️ CRITICAL: Railway-specific changes below
+if __name__ == '__main__':
+    # Get port from Railway environment variable or default to 5000
+    port = int(os.environ.get('PORT', 5000))
+    
+    # Run the app - debug=False for production
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
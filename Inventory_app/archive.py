@@ -0,0 +1,187 @@
+# Hot/cold archival
+# archive.py
+#
+# Allocations and processed returns older than ARCHIVE_AFTER_DAYS are never edited,
+# so they are moved in small batches into a per-warehouse archive file that pooled
+# connections ATTACH as "archive". Listings and dashboard counts only read the hot
+# tables; history views read both (see history.py). Freed pages in the hot file
+# are returned to the OS with incremental vacuum. SQLite warehouses only.
+import os
+import sys
+import time
+import sqlite3
+from datetime import datetime, timedelta, timezone
+import logging
+import database
+import maintenance
+import warehouses
+
+log = logging.getLogger('inventory.archive')
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 24))
+
+# Explicit column lists: ALTERed hot tables may not have the CREATE TABLE column order
+COLUMNS = {
+    'allocations': 'id, date, item_id, old_item_serial, new_item_serial, rider_number, rider_name, released_to, link, station, unit_number',
+    'returns': 'id, date, item_serial, personnel, status, notes, processed_date, condition_rating, unit_number',
+}
+
+# Rows that may move: everything old enough, but returns only once processed
+ARCHIVABLE = {
+    'allocations': 'date < ?',
+    'returns': "date < ? AND status = 'processed'",
+}
+
+
+def archive_path(path):
+    root, ext = os.path.splitext(path)
+    return f'{root}_archive{ext or ".db"}'
+
+
+def attach(conn):
+    # Attach this warehouse's archive to a pooled connection (once per connection).
+    # Returns False for connections that cannot have one (PostgreSQL warehouses).
+    if getattr(conn, 'dialect', None) != 'sqlite' or conn.pool is None:
+        return False
+    if getattr(conn, 'archive_attached', False):
+        return True
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path(conn.pool.path),))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.allocations (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            item_id INTEGER,
+            old_item_serial TEXT,
+            new_item_serial TEXT,
+            rider_number TEXT,
+            rider_name TEXT,
+            released_to TEXT,
+            link TEXT,
+            station TEXT,
+            unit_number INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.returns (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            item_serial TEXT,
+            personnel TEXT,
+            status TEXT,
+            notes TEXT,
+            processed_date TEXT,
+            condition_rating INTEGER,
+            unit_number INTEGER
+        )
+    ''')
+    # Archives created before per-unit tracking
+    for table in ('allocations', 'returns'):
+        try:
+            conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN unit_number INTEGER')
+        except sqlite3.OperationalError:
+            pass
+    # Same covering indexes as the hot tables, so history pages stay index-only
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_allocations_rider
+        ON allocations (rider_number, id, date, old_item_serial, new_item_serial, rider_name, station)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_allocations_new_serial
+        ON allocations (new_item_serial, id, date, old_item_serial, rider_number, rider_name, station)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_allocations_old_serial
+        ON allocations (old_item_serial, id, date, new_item_serial, rider_number, rider_name, station)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_returns_serial
+        ON returns (item_serial, id, date, personnel, status, processed_date, condition_rating)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_allocations_unit ON allocations (new_item_serial, unit_number)')
+    conn.commit()
+    conn.archive_attached = True
+    return True
+
+
+def sources(conn, table):
+    # Tables to read for history: the hot table, plus its archive copy when there is one
+    if attach(conn):
+        return [table, 'archive.' + table]
+    return [table]
+
+
+def cutoff_date(days=None):
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    return (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+
+
+def archive_batch(conn, table, cutoff, batch_size=BATCH_SIZE):
+    # Move up to batch_size aged rows. Each batch is its own short transaction so
+    # app writers get the lock between batches. SQLite does not make a commit that
+    # spans two WAL databases atomic, so rows are copied with INSERT OR IGNORE before
+    # they are deleted: a crash in between leaves a duplicate the next run clears up.
+    ids = [row[0] for row in conn.execute(
+        f'SELECT id FROM main.{table} WHERE {ARCHIVABLE[table]} ORDER BY id LIMIT ?',
+        (cutoff, batch_size)).fetchall()]
+    if not ids:
+        return 0
+    placeholders = ','.join('?' * len(ids))
+    columns = COLUMNS[table]
+    conn.execute(f'''
+        INSERT OR IGNORE INTO archive.{table} ({columns})
+        SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})
+    ''', ids)
+    conn.execute(f'DELETE FROM main.{table} WHERE id IN ({placeholders})', ids)
+    conn.commit()
+    return len(ids)
+
+
+def vacuum(conn):
+    # Hand free pages in the hot file back to the OS.
+    # Files created before auto_vacuum=INCREMENTAL need one full VACUUM to switch over.
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM main')
+        return 'compacted'
+    return f'{maintenance.incremental_vacuum(conn)} pages freed'
+
+
+def run(warehouse, days=None):
+    # One archival pass over a warehouse; returns what was done
+    if warehouses.is_postgres(warehouses.db_path(warehouse)):
+        return {'skipped': 'PostgreSQL warehouse'}
+    started = time.monotonic()
+    cutoff = cutoff_date(days)
+    result = {'cutoff': cutoff}
+    conn = database.get_db_connection(warehouse)
+    try:
+        attach(conn)
+        for table in COLUMNS:
+            moved = 0
+            while True:
+                count = archive_batch(conn, table, cutoff)
+                moved += count
+                if count < BATCH_SIZE:
+                    break
+            result[table] = moved
+        result['vacuum'] = vacuum(conn)
+    finally:
+        conn.close()
+    result['seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+
+def run_all():
+    for name in warehouses.names():
+        try:
+            log.info('archive finished', extra={'warehouse': name, 'result': run(name)})
+        except Exception as e:
+            log.warning('archive failed', extra={'warehouse': name, 'error': str(e)})
+
+
+if __name__ == '__main__':
+    # python archive.py [days]  - run one pass over every warehouse now
+    for name in warehouses.names():
+        print(name, run(name, int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,183 @@
+# Online backups
+# backup.py
+#
+# Copies each SQLite warehouse with the backup API a few pages at a time, pausing
+# between steps so live writers keep getting the lock. The copy is written to a
+# .partial file, checked with PRAGMA integrity_check and only then renamed into
+# place; the newest BACKUP_RETENTION backups per warehouse are kept. A warehouse's
+# archive file (see archive.py) is backed up, checked, rotated and restored with
+# it, as <name>-<stamp>_archive.db next to <name>-<stamp>.db.
+import os
+import re
+import sys
+import time
+import sqlite3
+from datetime import datetime, timezone
+import logging
+import archive
+import metrics
+import warehouses
+
+log = logging.getLogger('inventory.backup')
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+STEP_SLEEP_SECONDS = float(os.environ.get('BACKUP_STEP_SLEEP', 0.05))
+RETENTION = int(os.environ.get('BACKUP_RETENTION', 7))
+INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 24))
+MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+
+last_results = {}
+
+
+def backup_files(warehouse):
+    # Finished backups of a warehouse, oldest first. Matched on the full name with its
+    # stamp, so "lagos" does not pick up the backups of a "lagos-island" warehouse.
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    pattern = re.compile(re.escape(warehouse) + r'-\d{8}-\d{6}\.db')
+    return sorted(os.path.join(BACKUP_DIR, name) for name in os.listdir(BACKUP_DIR) if pattern.fullmatch(name))
+
+
+def verify(path):
+    # Returns 'ok' or the first integrity problem SQLite reports
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy(source_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP_SECONDS):
+    # Stepwise copy; returns (steps, restarts). A write to the source from another
+    # connection makes SQLite restart the copy (remaining goes back up). Under steady
+    # writes that could go on forever, so after MAX_RESTARTS the rest is copied in a
+    # single step: in WAL mode that is one read snapshot, which writers don't wait on.
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def step(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress['steps'] += 1
+        progress['remaining'] = remaining
+        time.sleep(sleep)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=step)
+        except _TooManyRestarts:
+            source.backup(target)
+            progress['steps'] += 1
+    finally:
+        target.close()
+        source.close()
+    return progress['steps'], progress['restarts']
+
+
+def _copy_checked(label, source_path, path):
+    # Copy into path.partial and integrity check it; returns (partial, steps, restarts)
+    partial = path + '.partial'
+    steps, restarts = copy(source_path, partial)
+    integrity = verify(partial)
+    if integrity != 'ok':
+        os.remove(partial)
+        raise RuntimeError(f'Backup of {label} failed integrity check: {integrity}')
+    return partial, steps, restarts
+
+
+def prune(warehouse, keep=RETENTION):
+    removed = []
+    for path in backup_files(warehouse)[:-keep or None]:
+        for file in (path, archive.archive_path(path)):
+            if os.path.exists(file):
+                os.remove(file)
+                removed.append(file)
+    return removed
+
+
+def run(warehouse):
+    # One backup of a warehouse; returns a report of what it did and what it cost
+    source_path = warehouses.db_path(warehouse)
+    if warehouses.is_postgres(source_path):
+        return {'skipped': 'PostgreSQL warehouse (use pg_dump)'}
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(BACKUP_DIR, f'{warehouse}-{stamp}.db')
+    archive_source = archive.archive_path(source_path)
+
+    started = time.time()
+    partial, steps, restarts = _copy_checked(warehouse, source_path, path)
+    copies = [(partial, path)]
+    if os.path.exists(archive_source):
+        # Copied after the hot file: rows archived in between land in both copies,
+        # the same duplicate a crashed archive batch leaves and the next pass clears
+        try:
+            archive_partial, archive_steps, archive_restarts = _copy_checked(
+                f'{warehouse} archive', archive_source, archive.archive_path(path))
+        except Exception:
+            os.remove(partial)
+            raise
+        steps, restarts = steps + archive_steps, restarts + archive_restarts
+        copies.insert(0, (archive_partial, archive.archive_path(path)))
+    finished = time.time()
+    # Archive first, so a listed backup always has its archive beside it
+    for partial, final in copies:
+        os.replace(partial, final)
+
+    result = {
+        'file': path,
+        'bytes': sum(os.path.getsize(final) for _, final in copies),
+        'archive_file': archive.archive_path(path) if len(copies) > 1 else None,
+        'seconds': round(finished - started, 2),
+        'steps': steps,
+        'restarts': restarts,
+        'integrity': 'ok',
+        'pruned': len(prune(warehouse)),
+    }
+    result.update(metrics.impact(started, finished))
+    last_results[warehouse] = dict(result, finished_at=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+    return result
+
+
+def restore(warehouse, path):
+    # Copy a verified backup, and its archive when it has one, over a warehouse's
+    # live files (stop writers first). Both are checked before either is written.
+    live_path = warehouses.db_path(warehouse)
+    files = [(path, live_path)]
+    if os.path.exists(archive.archive_path(path)):
+        files.append((archive.archive_path(path), archive.archive_path(live_path)))
+    for source, _ in files:
+        integrity = verify(source)
+        if integrity != 'ok':
+            raise RuntimeError(f'Refusing to restore {source}: {integrity}')
+    for source, target in files:
+        copy(source, target, pages=-1, sleep=0)
+
+
+def run_all():
+    for name in warehouses.names():
+        try:
+            log.info('backup finished', extra={'warehouse': name, 'result': run(name)})
+        except Exception as e:
+            log.warning('backup failed', extra={'warehouse': name, 'error': str(e)})
+
+
+if __name__ == '__main__':
+    # python backup.py               - back up every warehouse now
+    # python backup.py verify FILE   - integrity check a backup
+    # python backup.py restore NAME FILE
+    if len(sys.argv) > 2 and sys.argv[1] == 'verify':
+        print(verify(sys.argv[2]))
+    elif len(sys.argv) > 3 and sys.argv[1] == 'restore':
+        restore(sys.argv[2], sys.argv[3])
+    else:
+        run_all()
@@ -0,0 +1,117 @@
+# Cross-process cache coherence
+# coherence.py
+#
+# Several processes share each warehouse database (web workers, job workers,
+# archive runs), and each keeps state derived from it in memory: reliability
+# reports, the change counter behind HTTP validators. Triggers bump a per-table
+# generation in table_generations on every write (database.init_db), so it is
+# shared by every process. Before each request a worker asks a sentinel
+# connection for PRAGMA data_version, which only moves when some other
+# connection has committed; only then does it read the generations and tell the
+# caches registered for the tables that actually changed.
+import os
+import sqlite3
+import threading
+import time
+import logging
+import database
+import warehouses
+
+log = logging.getLogger('inventory.coherence')
+
+# Seconds between generation reads for PostgreSQL warehouses, which have no data_version
+PG_INTERVAL = float(os.environ.get('COHERENCE_PG_INTERVAL', 1))
+
+_listeners = []
+_states = {}
+_states_lock = threading.Lock()
+
+
+class _State:
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.path = warehouses.db_path(warehouse)
+        self.lock = threading.Lock()
+        self.sentinel = None
+        self.data_version = None
+        self.checked = 0.0
+        self.generations = None
+
+
+def on_change(tables, callback):
+    # callback(warehouse) runs when another connection has written to any of `tables`
+    _listeners.append((frozenset(tables), callback))
+
+
+def _state(warehouse):
+    with _states_lock:
+        if warehouse not in _states:
+            _states[warehouse] = _State(warehouse)
+        return _states[warehouse]
+
+
+def _read_generations(conn):
+    return {row[0]: row[1] for row in conn.execute('SELECT table_name, generation FROM table_generations')}
+
+
+def _poll(state):
+    # The current generations, or None when nothing can have changed since the last poll
+    if warehouses.is_postgres(state.path):
+        now = time.monotonic()
+        if now - state.checked < PG_INTERVAL:
+            return None
+        state.checked = now
+        conn = database.get_db_connection(state.warehouse)
+        try:
+            generations = _read_generations(conn)
+            conn.commit()
+            return generations
+        finally:
+            conn.close()
+
+    if state.sentinel is None:
+        # Autocommit, so the sentinel never pins an old WAL snapshot
+        state.sentinel = sqlite3.connect(state.path, isolation_level=None, check_same_thread=False,
+                                         timeout=database.BUSY_TIMEOUT_SECONDS)
+    data_version = state.sentinel.execute('PRAGMA data_version').fetchone()[0]
+    if data_version == state.data_version:
+        return None
+    state.data_version = data_version
+    return _read_generations(state.sentinel)
+
+
+def check(warehouse=None):
+    # Cheap per-request check; drops only the caches whose tables changed
+    warehouse = warehouse or warehouses.current()
+    state = _state(warehouse)
+    if not state.lock.acquire(blocking=False):
+        return  # another thread is already checking this warehouse
+    try:
+        try:
+            generations = _poll(state)
+        except Exception as e:
+            # Tables not created yet, or the database is briefly unavailable
+            log.warning('coherence check failed', extra={'warehouse': warehouse, 'error': str(e)})
+            return
+        if generations is None:
+            return
+        previous, state.generations = state.generations, generations
+        if previous is None:
+            return  # first look: nothing cached from before it to drop
+        changed = {table for table, generation in generations.items() if previous.get(table) != generation}
+    finally:
+        state.lock.release()
+
+    if not changed:
+        return
+    # Other workers' writes must also move this worker's ETags and Last-Modified
+    database.record_change()
+    for tables, callback in _listeners:
+        if tables & changed:
+            callback(warehouse)
+
+
+def generation(table, warehouse=None):
+    # This worker's last seen generation of `table`, for keying cache entries
+    state = _state(warehouse or warehouses.current())
+    return (state.generations or {}).get(table, 0)
@@ -1,185 +1,532 @@
-# Database operations
-# database.py
-import sqlite3
-import os
-from datetime import datetime
-
-def get_db_connection():
-    # Use Railway's persistent volume or fallback to local file
-    db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create Items table (central table for all item types)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            serial TEXT UNIQUE,
-            item_name TEXT NOT NULL,
-            item_type TEXT NOT NULL,  -- e.g., 'conversion_kit', 'spare_part', 'return'
-            admin TEXT,
-            created_at TEXT,
-            units_imported INTEGER DEFAULT 0,
-            units_installed INTEGER DEFAULT 0,
-            units_available INTEGER DEFAULT 0
-        )
-    ''')
-    
-    # Create Allocations table (for conversion kit details and spare parts replacements)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS allocations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            item_id INTEGER,
-            old_item_serial TEXT,
-            new_item_serial TEXT,
-            rider_number TEXT,
-            rider_name TEXT,
-            released_to TEXT,
-            link TEXT,
-            station TEXT,
-            FOREIGN KEY (item_id) REFERENCES items(id)
-        )
-    ''')
-    
-    # Create Returns table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS returns (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            item_serial TEXT,
-            personnel TEXT,
-            status TEXT DEFAULT 'pending',
-            notes TEXT,
-            processed_date TEXT,
-            condition_rating INTEGER DEFAULT 5,
-            FOREIGN KEY (item_serial) REFERENCES items(serial)
-        )
-    ''')
-    
-    # Insert initial data from Excel
-    # Conversion Kit overview (Sheet 0)
-    conversion_kits = [
-        ('15092501', 'Electrical component box', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
-        ('15092502', 'Shaft cups', 'conversion_kit', 'Inventory', '45915', 130, 6, 124),
-        ('15092503', 'Motor', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
-        ('15092504', 'Controller', 'conversion_kit', 'Inventory', '45915', 120, 6, 114),
-        ('15092505', 'Gear', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
-        ('15092506', 'Engine mount (front)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0),
-        ('15092507', 'Engine mount fittings (back)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0),
-        ('15092508', 'Engine mount fitting (sides)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0)
-    ]
-    for serial, name, item_type, admin, created_at, imported, installed, available in conversion_kits:
-        cursor.execute('''
-            INSERT OR IGNORE INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (serial, name, item_type, admin, created_at, imported, installed, available))
-    
-    # Conversion Kit allocations - using actual kit serials
-    kit_allocations = [
-        ('2024-01-15', '15092501', 'APP 181 QY', 'Adeleke Sikiru', '08012345678', 'Lagos Island'),
-        ('2024-01-16', '15092502', 'AGL 874 QD', 'Ayomide Olorunlana', '08023456789', 'Victoria Island'),
-        ('2024-01-17', '15092503', 'KSF 199 QM', 'Adekoya Ebenezer', '08034567890', 'Ikeja'),
-        ('2024-01-18', '15092504', 'SMK 743 QL', 'Hilary Maanpar', '08045678901', 'Surulere'),
-        ('2024-01-19', '15092505', 'XYZ 456 AB', 'Ibrahim Musa', '08056789012', 'Yaba'),
-        ('2024-01-20', '15092501', 'DEF 789 CD', 'Chidi Okwu', '08067890123', 'Apapa')
-    ]
-    
-    for date, kit_serial, plate_number, rider_name, rider_phone, station in kit_allocations:
-        cursor.execute('''
-            INSERT OR IGNORE INTO allocations (date, new_item_serial, old_item_serial, rider_name, rider_number, station)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (date, kit_serial, plate_number, rider_name, rider_phone, station))
-    
-    # Sample spare parts with proper inventory data
-    spare_parts_inventory = [
-        ('SP001', 'Motor', 'spare_part', 'Inventory', '2024-01-01', 50, 12, 38),
-        ('SP002', 'Battery', 'spare_part', 'Inventory', '2024-01-01', 75, 20, 55),
-        ('SP003', 'Controller', 'spare_part', 'Inventory', '2024-01-01', 40, 8, 32),
-        ('SP004', 'Throttle', 'spare_part', 'Inventory', '2024-01-01', 60, 15, 45)
-    ]
-    
-    for serial, name, item_type, admin, created_at, imported, installed, available in spare_parts_inventory:
-        cursor.execute('''
-            INSERT OR IGNORE INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (serial, name, item_type, admin, created_at, imported, installed, available))
-    
-    # Ensure all required columns exist
-    try:
-        cursor.execute('ALTER TABLE returns ADD COLUMN status TEXT DEFAULT "pending"')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE returns ADD COLUMN notes TEXT')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE returns ADD COLUMN processed_date TEXT')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE returns ADD COLUMN condition_rating INTEGER DEFAULT 5')
-    except:
-        pass
-    
-    # Update conversion kit inventory based on allocations
-    cursor.execute('''
-        UPDATE items SET 
-            units_installed = (SELECT COUNT(*) FROM allocations WHERE new_item_serial = items.serial),
-            units_available = units_imported - (SELECT COUNT(*) FROM allocations WHERE new_item_serial = items.serial)
-        WHERE item_type = 'conversion_kit' AND serial IN (SELECT DISTINCT new_item_serial FROM allocations)
-    ''')
-    
-    # Additional spare parts without inventory data (for options)
-    spare_parts_options = [
-        ('SP005', 'Charger', 'spare_part'),
-        ('SP006', 'Screen', 'spare_part'),
-        ('SP007', 'Gear', 'spare_part'),
-        ('SP008', 'PSU', 'spare_part'),
-        ('SP009', 'Relays', 'spare_part'),
-        ('SP010', 'Breakers', 'spare_part'),
-        ('SP011', 'Wiper switch', 'spare_part'),
-        ('SP012', 'Battery switch', 'spare_part'),
-        ('SP013', 'Ignition and key', 'spare_part'),
-        ('SP014', 'Connecting wires', 'spare_part'),
-        ('SP015', 'Wire holder', 'spare_part')
-    ]
-    for serial, name, item_type in spare_parts_options:
-        cursor.execute('''
-            INSERT OR IGNORE INTO items (serial, item_name, item_type, units_imported, units_installed, units_available)
-            VALUES (?, ?, ?, 0, 0, 0)
-        ''', (serial, name, item_type))
-    
-    # Sample replacement records for spare parts
-    spare_part_replacements = [
-        ('2024-01-22', 'SP001-OLD', 'SP001', 'Ahmed Bello', '08011111111', 'Ikeja'),
-        ('2024-01-23', 'SP002-OLD', 'SP002', 'Fatima Yusuf', '08022222222', 'Victoria Island'),
-        ('2024-01-24', 'SP003-OLD', 'SP003', 'Emeka Okafor', '08033333333', 'Surulere')
-    ]
-    
-    for date, old_serial, new_serial, rider_name, rider_phone, station in spare_part_replacements:
-        cursor.execute('''
-            INSERT OR IGNORE INTO allocations (date, old_item_serial, new_item_serial, rider_name, rider_number, station)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (date, old_serial, new_serial, rider_name, rider_phone, station))
-    
-    # Sample return records
-    sample_returns = [
-        ('2024-01-25', '15092501', 'John Doe', 'pending', 'Kit returned for maintenance'),
-        ('2024-01-26', 'SP001', 'Jane Smith', 'processed', 'Motor replacement completed')
-    ]
-    
-    for date, item_serial, personnel, status, notes in sample_returns:
-        cursor.execute('''
-            INSERT OR IGNORE INTO returns (date, item_serial, personnel, status, notes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (date, item_serial, personnel, status, notes))
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+# Database operations
+# database.py
+import sqlite3
+import os
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+import logs
+import warehouses
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+BUSY_TIMEOUT_SECONDS = float(os.environ.get('DB_BUSY_TIMEOUT', 5))
+
+# Tables with change tracking for delta sync, and the column a tombstone records as the row's key
+SYNC_TABLES = {'items': 'OLD.serial', 'allocations': 'NULL', 'returns': 'NULL'}
+
+# Tables whose writes bump a shared generation number, for cache coherence across processes (coherence.py)
+GENERATION_TABLES = ('items', 'allocations', 'returns', 'stock_thresholds', 'kit_definitions', 'kit_components')
+
+# Change counter for this process, bumped on every commit that changed rows.
+# HTTP caching uses it to answer conditional GETs without querying the database.
+_change_lock = threading.Lock()
+change_version = 0
+last_change_time = time.time()
+
+def record_change():
+    global change_version, last_change_time
+    with _change_lock:
+        change_version += 1
+        last_change_time = time.time()
+
+def utc_now():
+    # Same format as SQLite's datetime('now'), but usable with any backend
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def utc_today():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+class TrackedConnection(sqlite3.Connection):
+    dialect = 'sqlite'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.committed_changes = 0
+        self.pool = None
+        self.checked_out = False
+    
+    def commit(self):
+        super().commit()
+        if self.total_changes != self.committed_changes:
+            self.committed_changes = self.total_changes
+            record_change()
+    
+    def close(self):
+        # Pooled connections go back to their warehouse pool instead of closing
+        if self.pool is not None:
+            if not self.checked_out:
+                return
+            self.checked_out = False
+            if self.pool.release(self):
+                return
+        super().close()
+
+class ConnectionPool:
+    # Keeps up to `size` idle connections to one database file
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.opened = 0
+    
+    def acquire(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, factory=TrackedConnection, timeout=BUSY_TIMEOUT_SECONDS,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.pool = self
+            logs.trace(conn)
+            with self.lock:
+                self.opened += 1
+        with self.lock:
+            self.in_use += 1
+        conn.checked_out = True
+        return conn
+    
+    def release(self, conn):
+        with self.lock:
+            self.in_use -= 1
+        if conn.in_transaction:
+            # Never hand out a connection with a half-finished transaction
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.opened -= 1
+            return False
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(warehouse=None):
+    path = warehouses.db_path(warehouse)
+    with _pools_lock:
+        if path not in _pools:
+            if warehouses.is_postgres(path):
+                import postgres
+                _pools[path] = postgres.PostgresPool(path, POOL_SIZE)
+            else:
+                _pools[path] = ConnectionPool(path, POOL_SIZE)
+        return _pools[path]
+
+def get_db_connection(warehouse=None):
+    # Connection to the current request's warehouse (DATABASE_PATH when there is only one)
+    return get_pool(warehouse).acquire()
+
+def init_db(warehouse=None):
+    conn = get_db_connection(warehouse)
+    cursor = conn.cursor()
+    
+    # New files free pages incrementally (see archive.vacuum); no effect once tables exist
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    # WAL lets readers keep going while a writer holds the lock
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
+    # Create Items table (central table for all item types)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            serial TEXT UNIQUE,
+            item_name TEXT NOT NULL,
+            item_type TEXT NOT NULL,  -- e.g., 'conversion_kit', 'spare_part', 'return'
+            admin TEXT,
+            created_at TEXT,
+            units_imported INTEGER DEFAULT 0,
+            units_installed INTEGER DEFAULT 0,
+            units_available INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Create Allocations table (for conversion kit details and spare parts replacements)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS allocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            item_id INTEGER,
+            old_item_serial TEXT,
+            new_item_serial TEXT,
+            rider_number TEXT,
+            rider_name TEXT,
+            released_to TEXT,
+            link TEXT,
+            station TEXT,
+            FOREIGN KEY (item_id) REFERENCES items(id)
+        )
+    ''')
+    
+    # Create Returns table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS returns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            item_serial TEXT,
+            personnel TEXT,
+            status TEXT DEFAULT 'pending',
+            notes TEXT,
+            processed_date TEXT,
+            condition_rating INTEGER DEFAULT 5,
+            FOREIGN KEY (item_serial) REFERENCES items(serial)
+        )
+    ''')
+    
+    # Ensure all required columns exist
+    try:
+        cursor.execute('ALTER TABLE returns ADD COLUMN status TEXT DEFAULT "pending"')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE returns ADD COLUMN notes TEXT')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE returns ADD COLUMN processed_date TEXT')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE returns ADD COLUMN condition_rating INTEGER DEFAULT 5')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE allocations ADD COLUMN unit_number INTEGER')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE returns ADD COLUMN unit_number INTEGER')
+    except:
+        pass
+    
+    # Per-item low-stock thresholds (items without a row use LOW_STOCK_THRESHOLD)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_thresholds (
+            item_serial TEXT PRIMARY KEY,
+            low_stock_units INTEGER NOT NULL
+        )
+    ''')
+    
+    # Last alerted stock level per item, so only level changes raise alerts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_alert_state (
+            item_serial TEXT PRIMARY KEY,
+            level TEXT NOT NULL
+        )
+    ''')
+    
+    # Alert outbox, drained asynchronously by the alert dispatcher
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            item_serial TEXT,
+            level TEXT,  -- 'low_stock', 'out_of_stock' or 'restocked'
+            units_available INTEGER,
+            threshold INTEGER,
+            delivered_at TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_outbox_pending ON alert_outbox (id) WHERE delivered_at IS NULL')
+    
+    # Idempotency keys of recent writes and the response each one produced
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            route TEXT NOT NULL,
+            status TEXT NOT NULL,  -- 'pending' while the first request runs, then 'done'
+            created_at TEXT NOT NULL,
+            response_status INTEGER,
+            location TEXT,
+            content_type TEXT,
+            body TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+    
+    # Background jobs (jobs.py): progress and result written by the worker process
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,  -- 'queued', 'running', 'done', 'failed' or 'cancelled'
+            progress REAL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            owner TEXT,  -- the web process that submitted it (jobs.OWNER)
+            heartbeat_at TEXT  -- refreshed by that process while the job is queued or running
+        )
+    ''')
+    for column in ('owner TEXT', 'heartbeat_at TEXT'):
+        try:
+            cursor.execute(f'ALTER TABLE jobs ADD COLUMN {column}')
+        except sqlite3.OperationalError:
+            pass
+    
+    # Kit definitions (bills of materials): the components one conversion installs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kit_definitions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kit_components (
+            kit_id INTEGER NOT NULL,
+            item_serial TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (kit_id, item_serial),
+            FOREIGN KEY (kit_id) REFERENCES kit_definitions(id)
+        )
+    ''')
+    
+    # Per-unit tracking (units.py): units of each batch are numbered 1..unit_count,
+    # and the available ones are kept as run-length ranges
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS unit_batches (
+            item_serial TEXT PRIMARY KEY,
+            unit_count INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS unit_ranges (
+            item_serial TEXT NOT NULL,
+            first_unit INTEGER NOT NULL,
+            last_unit INTEGER NOT NULL,
+            PRIMARY KEY (item_serial, first_unit)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_unit_ranges_last ON unit_ranges (item_serial, last_unit)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_allocations_unit ON allocations (new_item_serial, unit_number)')
+    
+    # Change tracking for delta sync (sync.py): every insert or update stamps the row
+    # with the next value of the sync clock, every delete leaves a tombstone.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_clock (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO sync_clock (id, version) VALUES (1, 0)')
+    for table in SYNC_TABLES:
+        try:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER')
+        except:
+            continue
+        # Rows from before tracking get versions of their own, so sync pages never split a tie
+        cursor.execute(f'UPDATE {table} SET row_version = (SELECT version FROM sync_clock WHERE id = 1) + id')
+        cursor.execute(f'UPDATE sync_clock SET version = version + COALESCE((SELECT MAX(id) FROM {table}), 0)')
+    for table in SYNC_TABLES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table} (row_version)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_tombstones (
+            version INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            row_key TEXT  -- the serial number, for deleted items
+        )
+    ''')
+    for table, key in SYNC_TABLES.items():
+        # The stamping UPDATE changes row_version, which keeps the update trigger from firing for it
+        stamp = f'''
+            UPDATE sync_clock SET version = version + 1 WHERE id = 1;
+            UPDATE {table} SET row_version = (SELECT version FROM sync_clock WHERE id = 1) WHERE id = NEW.id;
+        '''
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS sync_{table}_insert AFTER INSERT ON {table} BEGIN {stamp} END')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sync_{table}_update AFTER UPDATE ON {table}
+            WHEN NEW.row_version IS OLD.row_version BEGIN {stamp} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sync_{table}_delete AFTER DELETE ON {table} BEGIN
+                UPDATE sync_clock SET version = version + 1 WHERE id = 1;
+                INSERT INTO sync_tombstones (version, table_name, row_id, row_key)
+                VALUES ((SELECT version FROM sync_clock WHERE id = 1), '{table}', OLD.id, {key});
+            END
+        ''')
+    
+    # Per-table write generations, shared by every process using this file (coherence.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_generations (
+            table_name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in GENERATION_TABLES:
+        cursor.execute('INSERT OR IGNORE INTO table_generations (table_name) VALUES (?)', (table,))
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            # The sync stamp's own UPDATE (it only changes row_version) needs no second bump
+            when = 'WHEN NEW.row_version IS OLD.row_version' if operation == 'UPDATE' and table in SYNC_TABLES else ''
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS generation_{table}_{operation.lower()} AFTER {operation} ON {table} {when} BEGIN
+                    UPDATE table_generations SET generation = generation + 1 WHERE table_name = '{table}';
+                END
+            ''')
+    
+    # Covering indexes for rider and item history (id second, for keyset pagination)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_allocations_rider
+        ON allocations (rider_number, id, date, old_item_serial, new_item_serial, rider_name, station)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_allocations_new_serial
+        ON allocations (new_item_serial, id, date, old_item_serial, rider_number, rider_name, station)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_allocations_old_serial
+        ON allocations (old_item_serial, id, date, new_item_serial, rider_number, rider_name, station)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_returns_serial
+        ON returns (item_serial, id, date, personnel, status, processed_date, condition_rating)
+    ''')
+    
+    # Index for per-day consumption lookups (stock forecasting)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_allocations_date_serial ON allocations (date, new_item_serial)')
+    
+    # Sample data from the original spreadsheet only goes into the default warehouse,
+    # and only while it is still empty: seeding on every start would add the sample
+    # allocations again and recount the kits from the hot table alone, putting the
+    # units of archived allocations back into stock
+    if (warehouse or warehouses.current()) == warehouses.DEFAULT_WAREHOUSE and \
+            cursor.execute('SELECT 1 FROM items LIMIT 1').fetchone() is None:
+        seed_sample_data(cursor)
+    
+    # Start unit tracking for batches that have none yet: the top units_available
+    # unit numbers are free, the ones below went out before tracking began
+    cursor.execute('''
+        INSERT INTO unit_ranges (item_serial, first_unit, last_unit)
+        SELECT serial, units_imported - MIN(units_available, units_imported) + 1, units_imported FROM items
+        WHERE serial IS NOT NULL AND units_available > 0 AND units_imported > 0
+          AND serial NOT IN (SELECT item_serial FROM unit_batches)
+    ''')
+    cursor.execute('''
+        INSERT INTO unit_batches (item_serial, unit_count)
+        SELECT serial, MAX(COALESCE(units_imported, 0), 0) FROM items
+        WHERE serial IS NOT NULL AND serial NOT IN (SELECT item_serial FROM unit_batches)
+    ''')
+    
+    conn.commit()
+    conn.close()
+
+def seed_sample_data(cursor):
+    # Insert initial data from Excel
+    # Conversion Kit overview (Sheet 0)
+    conversion_kits = [
+        ('15092501', 'Electrical component box', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
+        ('15092502', 'Shaft cups', 'conversion_kit', 'Inventory', '45915', 130, 6, 124),
+        ('15092503', 'Motor', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
+        ('15092504', 'Controller', 'conversion_kit', 'Inventory', '45915', 120, 6, 114),
+        ('15092505', 'Gear', 'conversion_kit', 'Inventory', '45915', 125, 6, 119),
+        ('15092506', 'Engine mount (front)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0),
+        ('15092507', 'Engine mount fittings (back)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0),
+        ('15092508', 'Engine mount fitting (sides)', 'conversion_kit', 'Inventory', '45915', 0, 0, 0)
+    ]
+    for serial, name, item_type, admin, created_at, imported, installed, available in conversion_kits:
+        cursor.execute('''
+            INSERT OR IGNORE INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (serial, name, item_type, admin, created_at, imported, installed, available))
+    
+    # The full conversion kit: one of each component above
+    cursor.execute('''
+        INSERT OR IGNORE INTO kit_definitions (id, name, description)
+        VALUES (1, 'Full conversion kit', 'Every component of one bike conversion')
+    ''')
+    for serial, *_ in conversion_kits:
+        cursor.execute('INSERT OR IGNORE INTO kit_components (kit_id, item_serial, quantity) VALUES (1, ?, 1)', (serial,))
+    
+    # Conversion Kit allocations - using actual kit serials
+    kit_allocations = [
+        ('2024-01-15', '15092501', 'APP 181 QY', 'Adeleke Sikiru', '08012345678', 'Lagos Island'),
+        ('2024-01-16', '15092502', 'AGL 874 QD', 'Ayomide Olorunlana', '08023456789', 'Victoria Island'),
+        ('2024-01-17', '15092503', 'KSF 199 QM', 'Adekoya Ebenezer', '08034567890', 'Ikeja'),
+        ('2024-01-18', '15092504', 'SMK 743 QL', 'Hilary Maanpar', '08045678901', 'Surulere'),
+        ('2024-01-19', '15092505', 'XYZ 456 AB', 'Ibrahim Musa', '08056789012', 'Yaba'),
+        ('2024-01-20', '15092501', 'DEF 789 CD', 'Chidi Okwu', '08067890123', 'Apapa')
+    ]
+    
+    for date, kit_serial, plate_number, rider_name, rider_phone, station in kit_allocations:
+        cursor.execute('''
+            INSERT OR IGNORE INTO allocations (date, new_item_serial, old_item_serial, rider_name, rider_number, station)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (date, kit_serial, plate_number, rider_name, rider_phone, station))
+    
+    # Sample spare parts with proper inventory data
+    spare_parts_inventory = [
+        ('SP001', 'Motor', 'spare_part', 'Inventory', '2024-01-01', 50, 12, 38),
+        ('SP002', 'Battery', 'spare_part', 'Inventory', '2024-01-01', 75, 20, 55),
+        ('SP003', 'Controller', 'spare_part', 'Inventory', '2024-01-01', 40, 8, 32),
+        ('SP004', 'Throttle', 'spare_part', 'Inventory', '2024-01-01', 60, 15, 45)
+    ]
+    
+    for serial, name, item_type, admin, created_at, imported, installed, available in spare_parts_inventory:
+        cursor.execute('''
+            INSERT OR IGNORE INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (serial, name, item_type, admin, created_at, imported, installed, available))
+    
+    # Update conversion kit inventory based on allocations
+    cursor.execute('''
+        UPDATE items SET 
+            units_installed = (SELECT COUNT(*) FROM allocations WHERE new_item_serial = items.serial),
+            units_available = units_imported - (SELECT COUNT(*) FROM allocations WHERE new_item_serial = items.serial)
+        WHERE item_type = 'conversion_kit' AND serial IN (SELECT DISTINCT new_item_serial FROM allocations)
+    ''')
+    
+    # Additional spare parts without inventory data (for options)
+    spare_parts_options = [
+        ('SP005', 'Charger', 'spare_part'),
+        ('SP006', 'Screen', 'spare_part'),
+        ('SP007', 'Gear', 'spare_part'),
+        ('SP008', 'PSU', 'spare_part'),
+        ('SP009', 'Relays', 'spare_part'),
+        ('SP010', 'Breakers', 'spare_part'),
+        ('SP011', 'Wiper switch', 'spare_part'),
+        ('SP012', 'Battery switch', 'spare_part'),
+        ('SP013', 'Ignition and key', 'spare_part'),
+        ('SP014', 'Connecting wires', 'spare_part'),
+        ('SP015', 'Wire holder', 'spare_part')
+    ]
+    for serial, name, item_type in spare_parts_options:
+        cursor.execute('''
+            INSERT OR IGNORE INTO items (serial, item_name, item_type, units_imported, units_installed, units_available)
+            VALUES (?, ?, ?, 0, 0, 0)
+        ''', (serial, name, item_type))
+    
+    # Sample replacement records for spare parts
+    spare_part_replacements = [
+        ('2024-01-22', 'SP001-OLD', 'SP001', 'Ahmed Bello', '08011111111', 'Ikeja'),
+        ('2024-01-23', 'SP002-OLD', 'SP002', 'Fatima Yusuf', '08022222222', 'Victoria Island'),
+        ('2024-01-24', 'SP003-OLD', 'SP003', 'Emeka Okafor', '08033333333', 'Surulere')
+    ]
+    
+    for date, old_serial, new_serial, rider_name, rider_phone, station in spare_part_replacements:
+        cursor.execute('''
+            INSERT OR IGNORE INTO allocations (date, old_item_serial, new_item_serial, rider_name, rider_number, station)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (date, old_serial, new_serial, rider_name, rider_phone, station))
+    
+    # Sample return records
+    sample_returns = [
+        ('2024-01-25', '15092501', 'John Doe', 'pending', 'Kit returned for maintenance'),
+        ('2024-01-26', 'SP001', 'Jane Smith', 'processed', 'Motor replacement completed')
+    ]
+    
+    for date, item_serial, personnel, status, notes in sample_returns:
+        cursor.execute('''
+            INSERT OR IGNORE INTO returns (date, item_serial, personnel, status, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (date, item_serial, personnel, status, notes))
\ No newline at end of file
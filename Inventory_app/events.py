@@ -0,0 +1,88 @@
+# In-process pub/sub for live stock events
+# events.py
+#
+# Write routes publish after they commit; /events streams the log to browsers as
+# Server-Sent Events. Events go into one shared ring buffer with increasing ids
+# instead of a queue per subscriber, so publishing costs the same however many
+# listeners there are.
+#
+# The app runs on werkzeug's threaded server (python main.py), where an open
+# stream keeps a server thread for as long as the browser stays connected, idle
+# or not. So at most EVENT_MAX_SUBSCRIBERS streams are served at once; past that
+# /events answers 503 and the dashboard falls back to polling. Raising the cap
+# costs one thread (and its stack) per extra subscriber.
+import os
+import json
+import threading
+from collections import deque
+import warehouses
+
+BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 1000))
+HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', 15))
+MAX_SUBSCRIBERS = int(os.environ.get('EVENT_MAX_SUBSCRIBERS', 100))  # 0 = no cap
+RETRY_AFTER_SECONDS = 30
+
+_condition = threading.Condition()
+_buffer = deque(maxlen=BUFFER_SIZE)
+_last_id = 0
+subscriber_count = 0
+
+ITEM_FIELDS = ('serial', 'item_name', 'item_type', 'units_imported', 'units_installed', 'units_available')
+
+
+def publish(event_type, data, warehouse=None):
+    global _last_id
+    data = dict(data, warehouse=warehouse or warehouses.current())
+    with _condition:
+        _last_id += 1
+        _buffer.append((_last_id, event_type, data))
+        _condition.notify_all()
+
+
+def publish_item(item):
+    # Push the current counters for an item that just changed
+    if item:
+        publish('item', {key: item[key] for key in ITEM_FIELDS})
+
+
+def events_after(last_seen):
+    # Events newer than last_seen, plus the id to resume from
+    with _condition:
+        if last_seen > _last_id:
+            # Ids restart with the process; a client resuming from before a restart must reload
+            return [(_last_id, 'resync', {})], _last_id
+        if _buffer and last_seen < _buffer[0][0] - 1:
+            # Subscriber fell further behind than the buffer holds; tell it to reload
+            return [(_buffer[0][0] - 1, 'resync', {})], _last_id
+        return [e for e in _buffer if e[0] > last_seen], _last_id
+
+
+def full():
+    # A soft cap: streams count themselves once they start, so a burst may overshoot slightly
+    return bool(MAX_SUBSCRIBERS) and subscriber_count >= MAX_SUBSCRIBERS
+
+
+def format_event(event_id, event_type, data):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream(last_event_id=None, warehouse=None):
+    global subscriber_count
+    with _condition:
+        subscriber_count += 1
+        last_seen = _last_id if last_event_id is None else last_event_id
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            with _condition:
+                if _last_id == last_seen:
+                    _condition.wait(HEARTBEAT_SECONDS)
+            pending, last_seen = events_after(last_seen)
+            # Only this subscriber's warehouse (resync events carry no warehouse)
+            chunk = ''.join(format_event(*event) for event in pending
+                            if event[2].get('warehouse', warehouse) == warehouse)
+            # Comment line keeps proxies from closing an idle connection
+            yield chunk or ': heartbeat\n\n'
+    finally:
+        with _condition:
+            subscriber_count -= 1
@@ -0,0 +1,125 @@
+# Stock forecasting and reorder points
+# forecast.py
+import os
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Forecast settings (override through environment variables on Railway)
+LEAD_TIME_DAYS = int(os.environ.get('REORDER_LEAD_TIME_DAYS', 7))
+WINDOW_DAYS = int(os.environ.get('REORDER_WINDOW_DAYS', 30))
+SHORT_WINDOW_DAYS = int(os.environ.get('REORDER_SHORT_WINDOW_DAYS', 7))
+SERVICE_LEVEL_Z = float(os.environ.get('REORDER_SERVICE_Z', 1.65))  # ~95% service level
+
+# Days between today (the parameter) and an allocation's date, per SQL dialect
+AGE_IN_DAYS = {
+    'sqlite': 'CAST(julianday(?) - julianday(date) AS INTEGER)',
+    'postgresql': 'CAST(? AS DATE) - CAST(date AS DATE)',
+}
+
+
+def load_items(conn):
+    # Sorted here, not with ORDER BY: demand_matrix looks serials up with searchsorted,
+    # which needs Python's string order, and a database's collation can differ from
+    # it (PostgreSQL's en_US puts 'a1' before 'B2', and ignores '_' and '-')
+    rows = conn.execute('''
+        SELECT serial, item_name, item_type, COALESCE(units_available, 0)
+        FROM items
+        WHERE serial IS NOT NULL AND item_type IN ('conversion_kit', 'spare_part')
+    ''').fetchall()
+    rows.sort(key=lambda r: r[0])
+    serials = np.array([r[0] for r in rows], dtype=object)
+    names = [r[1] for r in rows]
+    types = [r[2] for r in rows]
+    available = np.fromiter((r[3] for r in rows), dtype=np.int64, count=len(rows))
+    return serials, names, types, available
+
+
+def load_consumption(conn, window_days):
+    # One bulk query: units allocated per item per day, as (serial, age in days, count)
+    today = datetime.now(timezone.utc).date()
+    start = today - timedelta(days=window_days - 1)
+    rows = conn.execute(f'''
+        SELECT new_item_serial, {AGE_IN_DAYS[getattr(conn, 'dialect', 'sqlite')]} AS age, COUNT(*)
+        FROM allocations
+        WHERE date >= ? AND new_item_serial IS NOT NULL
+        GROUP BY new_item_serial, age
+    ''', (today.isoformat(), start.isoformat())).fetchall()
+    serials = np.array([r[0] for r in rows], dtype=object)
+    ages = np.fromiter((r[1] if r[1] is not None else -1 for r in rows), dtype=np.int64, count=len(rows))
+    counts = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+    return serials, ages, counts
+
+
+def demand_matrix(item_serials, serials, ages, counts, window_days):
+    # items x days matrix, column 0 is today and column window_days-1 the oldest day
+    matrix = np.zeros((len(item_serials), window_days), dtype=np.float64)
+    if len(serials) == 0 or len(item_serials) == 0:
+        return matrix
+    idx = np.searchsorted(item_serials, serials)
+    idx = np.clip(idx, 0, len(item_serials) - 1)
+    known = (item_serials[idx] == serials) & (ages >= 0) & (ages < window_days)
+    np.add.at(matrix, (idx[known], ages[known]), counts[known])
+    return matrix
+
+
+def compute_reorder_points(conn, lead_time_days=None, window_days=None, service_z=None):
+    lead_time_days = lead_time_days or LEAD_TIME_DAYS
+    window_days = max(window_days or WINDOW_DAYS, SHORT_WINDOW_DAYS)
+    service_z = SERVICE_LEVEL_Z if service_z is None else service_z
+
+    item_serials, names, types, available = load_items(conn)
+    serials, ages, counts = load_consumption(conn, window_days)
+    demand = demand_matrix(item_serials, serials, ages, counts, window_days)
+
+    # Moving averages and variability of daily demand, for all items at once
+    short_avg = demand[:, :SHORT_WINDOW_DAYS].mean(axis=1)
+    daily_avg = demand.mean(axis=1)
+    daily_std = demand.std(axis=1)
+
+    lead_time_demand = daily_avg * lead_time_days
+    safety_stock = service_z * daily_std * np.sqrt(lead_time_days)
+    reorder_point = np.ceil(lead_time_demand + safety_stock).astype(np.int64)
+
+    with np.errstate(divide='ignore'):
+        days_of_cover = np.where(daily_avg > 0, available / np.where(daily_avg > 0, daily_avg, 1), np.inf)
+    needs_reorder = (daily_avg > 0) & (available <= reorder_point)
+
+    return {
+        'serial': item_serials,
+        'item_name': names,
+        'item_type': types,
+        'units_available': available,
+        'short_avg': short_avg,
+        'daily_avg': daily_avg,
+        'lead_time_demand': lead_time_demand,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'days_of_cover': days_of_cover,
+        'needs_reorder': needs_reorder,
+        'lead_time_days': lead_time_days,
+        'window_days': window_days,
+    }
+
+
+def reorder_report(conn, **kwargs):
+    result = compute_reorder_points(conn, **kwargs)
+
+    # Items that need reordering first, then the ones that will run out soonest
+    order = np.lexsort((result['days_of_cover'], ~result['needs_reorder']))
+    rows = []
+    for i in order.tolist():
+        cover = result['days_of_cover'][i]
+        rows.append({
+            'serial': result['serial'][i],
+            'item_name': result['item_name'][i],
+            'item_type': result['item_type'][i],
+            'units_available': int(result['units_available'][i]),
+            'short_avg': round(float(result['short_avg'][i]), 2),
+            'daily_avg': round(float(result['daily_avg'][i]), 2),
+            'lead_time_demand': round(float(result['lead_time_demand'][i]), 1),
+            'safety_stock': round(float(result['safety_stock'][i]), 1),
+            'reorder_point': int(result['reorder_point'][i]),
+            'days_of_cover': None if np.isinf(cover) else round(float(cover), 1),
+            'needs_reorder': bool(result['needs_reorder'][i]),
+        })
+    return rows, result['lead_time_days'], result['window_days']
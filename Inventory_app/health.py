@@ -0,0 +1,122 @@
+# Health and readiness probes
+# health.py
+#
+# /healthz only says the process is serving requests. /readyz probes every
+# warehouse: how long getting a pooled connection takes, a SELECT 1, and how
+# long a writer would wait for the write lock (BEGIN IMMEDIATE, rolled back at
+# once, with the budget as its busy timeout). Each timing is checked against its
+# budget. It also reports WAL size, pool saturation, admission gates and the log
+# queue. Over-budget or failing probes make it answer 503; a large WAL or a
+# saturated pool only marks it degraded. Results are reused for CACHE_SECONDS, so
+# a load balancer probing every few seconds costs at most one probe round.
+import os
+import time
+import sqlite3
+import threading
+import database
+import admission
+import logs
+import snapshot
+import warehouses
+
+ACQUIRE_BUDGET_MS = float(os.environ.get('HEALTH_ACQUIRE_BUDGET_MS', 100))
+QUERY_BUDGET_MS = float(os.environ.get('HEALTH_QUERY_BUDGET_MS', 50))
+LOCK_BUDGET_MS = float(os.environ.get('HEALTH_LOCK_BUDGET_MS', 500))
+WAL_BUDGET_MB = float(os.environ.get('HEALTH_WAL_BUDGET_MB', 256))
+PROBE_WRITE_LOCK = os.environ.get('HEALTH_PROBE_WRITE_LOCK', '1') == '1'
+CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', 1))
+
+STARTED = time.time()
+
+_cache = {'at': 0.0, 'result': None}
+_cache_lock = threading.Lock()
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _lock_wait_ms(conn):
+    # Time to take the write lock, or None if it stayed busy for the whole budget
+    conn.execute(f'PRAGMA busy_timeout = {int(LOCK_BUDGET_MS)}')
+    started = time.perf_counter()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        waited = _ms(started)
+        conn.rollback()
+        return waited
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {int(database.BUSY_TIMEOUT_SECONDS * 1000)}')
+
+
+def probe(warehouse):
+    path = warehouses.db_path(warehouse)
+    result = {'problems': [], 'warnings': []}
+    try:
+        started = time.perf_counter()
+        conn = database.get_db_connection(warehouse)
+        result['acquire_ms'] = _ms(started)
+        try:
+            started = time.perf_counter()
+            conn.execute('SELECT 1').fetchone()
+            result['query_ms'] = _ms(started)
+            if PROBE_WRITE_LOCK and conn.dialect == 'sqlite':
+                result['lock_wait_ms'] = _lock_wait_ms(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        result['problems'].append(f'database unavailable: {e}')
+        result['error'] = str(e)
+
+    if result.get('acquire_ms', 0) > ACQUIRE_BUDGET_MS:
+        result['problems'].append(f"connection took {result['acquire_ms']} ms (budget {ACQUIRE_BUDGET_MS:g})")
+    if result.get('query_ms', 0) > QUERY_BUDGET_MS:
+        result['problems'].append(f"SELECT 1 took {result['query_ms']} ms (budget {QUERY_BUDGET_MS:g})")
+    if 'lock_wait_ms' in result and result['lock_wait_ms'] is None:
+        result['problems'].append(f'write lock busy for over {LOCK_BUDGET_MS:g} ms')
+
+    if not warehouses.is_postgres(path):
+        try:
+            wal_bytes = os.path.getsize(path + '-wal')
+        except OSError:
+            wal_bytes = 0
+        result['wal_mb'] = round(wal_bytes / 1024 / 1024, 2)
+        if result['wal_mb'] > WAL_BUDGET_MB:
+            result['warnings'].append(f"WAL is {result['wal_mb']} MB (budget {WAL_BUDGET_MB:g})")
+
+    if 'acquire_ms' not in result:
+        return result
+    pool = database.get_pool(warehouse)
+    with pool.lock:
+        in_use, opened = pool.in_use, pool.opened
+    result['pool'] = {'size': pool.size, 'in_use': in_use, 'opened': opened,
+                      'saturation': round(in_use / pool.size, 2) if pool.size else None}
+    if pool.size and in_use >= pool.size:
+        result['warnings'].append('connection pool saturated')
+    return result
+
+
+def readiness():
+    # Probe results for every warehouse, reused for CACHE_SECONDS
+    with _cache_lock:
+        if _cache['result'] is not None and time.monotonic() - _cache['at'] < CACHE_SECONDS:
+            return _cache['result']
+        probes = warehouses.fan_out(probe)
+        failing = any(p['problems'] for p in probes.values())
+        degraded = any(p['warnings'] for p in probes.values())
+        result = {
+            'status': 'fail' if failing else 'degraded' if degraded else 'ok',
+            'warehouses': probes,
+            'admission': admission.stats(),
+            'snapshots': snapshot.stats(),
+            'logs': logs.stats(),
+            'budgets_ms': {'acquire': ACQUIRE_BUDGET_MS, 'query': QUERY_BUDGET_MS, 'lock': LOCK_BUDGET_MS},
+        }
+        _cache['at'], _cache['result'] = time.monotonic(), result
+        return result
+
+
+def liveness():
+    return {'status': 'ok', 'uptime_seconds': round(time.time() - STARTED)}
@@ -0,0 +1,52 @@
+# Rider and item history lookups
+# history.py
+#
+# Every query here is answered from one of the covering indexes created in
+# database.init_db(), and pages with a keyset ("id < last seen id") instead of
+# OFFSET, so each page costs the same no matter how deep into the history it is.
+# Archived rows (archive.py) are included, so history reaches back past the cutoff.
+import archive
+
+PAGE_SIZE = 50
+
+ALLOCATION_COLUMNS = 'id, date, old_item_serial, new_item_serial, rider_number, rider_name, station'
+RETURN_COLUMNS = 'id, date, item_serial, personnel, status, processed_date, condition_rating'
+
+
+def _page(rows, limit):
+    # Fetch one extra row to know whether an older page exists
+    rows = list(rows)
+    next_before = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_before
+
+
+def _newest(conn, columns, table, conditions, before, limit):
+    # One index-ordered subquery per (source table, condition), merged newest first.
+    # Sources are the hot table and its archive (archive.sources), so paging runs
+    # across both without the caller knowing where a row lives.
+    subqueries, params = [], []
+    for source in archive.sources(conn, table):
+        for condition, value in conditions:
+            subqueries.append(f'''
+                SELECT * FROM (
+                    SELECT {columns} FROM {source}
+                    WHERE {condition} AND id < ?
+                    ORDER BY id DESC LIMIT ?
+                ) AS s{len(subqueries)}''')
+            params += [value, before or 2 ** 63 - 1, limit + 1]
+    rows = conn.execute('\nUNION'.join(subqueries) + '\nORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+    return _page(rows, limit)
+
+
+def rider_allocations(conn, rider_number, before=None, limit=PAGE_SIZE):
+    return _newest(conn, ALLOCATION_COLUMNS, 'allocations', [('rider_number = ?', rider_number)], before, limit)
+
+
+def item_allocations(conn, serial, before=None, limit=PAGE_SIZE):
+    # Allocations that installed this serial and replacements that took it out
+    return _newest(conn, ALLOCATION_COLUMNS, 'allocations',
+                   [('new_item_serial = ?', serial), ('old_item_serial = ?', serial)], before, limit)
+
+
+def item_returns(conn, serial, before=None, limit=PAGE_SIZE):
+    return _newest(conn, RETURN_COLUMNS, 'returns', [('item_serial = ?', serial)], before, limit)
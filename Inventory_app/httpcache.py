@@ -0,0 +1,149 @@
+# HTTP caching and compression
+# httpcache.py
+import os
+import gzip
+import uuid
+import hashlib
+import functools
+from datetime import datetime, timezone
+from flask import request, make_response, g
+import database
+import warehouses
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# Changes on every restart/deploy, so cached pages never outlive a new release
+BOOT_ID = uuid.uuid4().hex[:8]
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'application/javascript',
+                      'text/javascript', 'application/json', 'image/svg+xml'}
+MIN_COMPRESS_SIZE = 500
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_fingerprints = {}
+
+
+def current_etag(version=None, daily=False):
+    version = database.change_version if version is None else version
+    etag = f'{BOOT_ID}-{warehouses.current()}-{version}'
+    # Pages computed against today's date go stale at midnight (UTC) without any write
+    return f'{etag}-{database.utc_today()}' if daily else etag
+
+
+def _last_modified(change_time, daily):
+    last_modified = datetime.fromtimestamp(int(change_time), tz=timezone.utc)
+    if daily:
+        midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        last_modified = max(last_modified, midnight)
+    return last_modified
+
+
+def conditional(view=None, daily=False):
+    # Answer If-None-Match / If-Modified-Since from the in-process change counter
+    # before the view runs, so an unchanged page costs no database work. Use as
+    # @conditional, or @conditional(daily=True) for pages that depend on the date.
+    if view is None:
+        return functools.partial(conditional, daily=daily)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = current_etag(daily=daily)
+        last_modified = _last_modified(database.last_change_time, daily)
+
+        not_modified = False
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and len(warehouses.names()) == 1:
+            # A date cannot say which warehouse the client's copy shows, so with
+            # several warehouses only the ETag (which names it) can give a 304
+            not_modified = last_modified <= request.if_modified_since
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            snapshot = g.pop('read_snapshot', None)
+            if snapshot is not None:
+                # Rendered from a read snapshot: label it with the version it was copied at
+                etag = current_etag(snapshot.change_version, daily)
+                last_modified = _last_modified(snapshot.change_time, daily)
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        # The warehouse cookie or header selects which data is shown
+        response.vary.update(('Cookie', 'X-Warehouse'))
+        return response
+    return wrapper
+
+
+def static_fingerprint(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:10]
+    _fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+def compress_response(response):
+    # Streamed responses (other than file wrappers) must keep flushing as they go
+    if (response.status_code != 200 or (response.is_streamed and not response.direct_passthrough)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        encoding = 'br'
+    elif accept['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    # Static files are served as file wrappers; small enough to read in full
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed body is a different byte sequence than the identity one
+        response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(app.static_folder, values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            # Fingerprinted URLs change whenever the file does, so they can be cached forever
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        return compress_response(response)
@@ -0,0 +1,136 @@
+# Idempotency keys for write routes
+# idempotency.py
+#
+# A client sends the same key with every retry of one logical write, either in an
+# Idempotency-Key header (API clients) or in the hidden idempotency_key form field
+# that script.js fills in once per page load. The first request with a key claims
+# it and runs; its response is stored, and repeats get that stored response back
+# instead of writing again. Keys expire after IDEMPOTENCY_TTL_HOURS.
+import os
+import functools
+from datetime import datetime, timedelta, timezone
+from flask import request, Response, make_response
+import database
+import warehouses
+
+TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+# A key still marked in-flight after this long belongs to a request that died mid-way
+PENDING_TIMEOUT_SECONDS = 60
+MAX_KEY_LENGTH = 200
+MAX_STORED_BODY = 64 * 1024
+
+
+def _timestamp(delta=timedelta()):
+    return (datetime.now(timezone.utc) - delta).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def request_key():
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    return key.strip()[:MAX_KEY_LENGTH] if key and key.strip() else None
+
+
+def claim(conn, key, route):
+    # Returns None when this request now owns the key, else the stored row
+    cursor = conn.execute('''
+        INSERT INTO idempotency_keys (key, route, status, created_at) VALUES (?, ?, 'pending', ?)
+        ON CONFLICT (key) DO NOTHING
+    ''', (key, route, _timestamp()))
+    if cursor.rowcount == 1:
+        conn.commit()
+        return None
+    # Take over a key whose first request never finished
+    cursor = conn.execute('''
+        UPDATE idempotency_keys SET created_at = ?
+        WHERE key = ? AND route = ? AND status = 'pending' AND created_at < ?
+    ''', (_timestamp(), key, route, _timestamp(timedelta(seconds=PENDING_TIMEOUT_SECONDS))))
+    conn.commit()
+    if cursor.rowcount == 1:
+        return None
+    return conn.execute('SELECT * FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+
+
+def store(key, response):
+    body = None
+    if not response.is_streamed and response.content_length is not None and response.content_length <= MAX_STORED_BODY:
+        body = response.get_data(as_text=True)
+    record(key, response.status_code, body, response.content_type, response.headers.get('Location'))
+
+
+def record(key, status_code, body, content_type='application/json', location=None):
+    # Mark a claimed key done with the result repeats should get back
+    conn = database.get_db_connection()
+    try:
+        conn.execute('''
+            UPDATE idempotency_keys SET status = 'done', response_status = ?, location = ?, content_type = ?, body = ?
+            WHERE key = ?
+        ''', (status_code, location, content_type, body, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def release(key):
+    # The write failed and nothing was stored; let the client retry with the same key
+    conn = database.get_db_connection()
+    try:
+        conn.execute('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def replay(row):
+    response = Response(row['body'] or '', status=row['response_status'], content_type=row['content_type'])
+    if row['location']:
+        response.headers['Location'] = row['location']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request_key()
+        if key is None:
+            return view(*args, **kwargs)
+
+        # The claim uses its own connection, returned before the view borrows one
+        conn = database.get_db_connection()
+        try:
+            existing = claim(conn, key, request.path)
+        finally:
+            conn.close()
+
+        if existing is not None:
+            if existing['route'] != request.path:
+                return Response('Idempotency-Key was already used for a different request', status=422)
+            if existing['status'] != 'done':
+                # The first request with this key is still running
+                return Response('A request with this Idempotency-Key is in progress', status=409,
+                                headers={'Retry-After': '1'})
+            return replay(existing)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            release(key)
+            raise
+        store(key, response)
+        return response
+    return wrapper
+
+
+def prune(warehouse):
+    conn = database.get_db_connection(warehouse)
+    try:
+        deleted = conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?',
+                               (_timestamp(timedelta(hours=TTL_HOURS)),)).rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+def prune_all():
+    for name in warehouses.names():
+        prune(name)
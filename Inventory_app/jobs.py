@@ -0,0 +1,296 @@
+# Background jobs
+# jobs.py
+#
+# Heavy operations (recounts, exports) run in a pool of worker processes instead
+# of a request handler. A job is a row in the warehouse's jobs table: the web
+# process inserts it and returns at once, the worker updates its progress and
+# result there, and /jobs reads it back. Cancelling sets a flag that the worker
+# sees at its next progress report.
+#
+# Several web processes may share a warehouse, so each job records the process
+# that owns it, and that process refreshes the job's heartbeat while it is queued
+# or running. Only jobs whose heartbeat has gone stale (their process stopped)
+# are failed by recover().
+import os
+import csv
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+import database
+import warehouses
+import archive
+import repository
+import units
+
+log = logging.getLogger('inventory.jobs')
+
+WORKERS = int(os.environ.get('JOB_WORKERS', 0)) or os.cpu_count() or 2
+EXPORT_DIR = os.path.abspath(os.environ.get('EXPORT_DIR', 'exports'))
+PROGRESS_INTERVAL_SECONDS = 0.5
+BATCH_SIZE = 500
+HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 15))
+STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 120))
+
+# This process as recorded in the jobs it submits; the random part tells a restarted
+# process apart from its predecessor when the pid repeats (pid 1 in a container)
+OWNER = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job:
+    # Handle a task uses to report progress; raises Cancelled once cancel was requested
+    def __init__(self, conn, job_id, params):
+        self.conn = conn
+        self.id = job_id
+        self.params = params
+        self.reported_at = 0
+
+    def progress(self, fraction, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.reported_at < PROGRESS_INTERVAL_SECONDS:
+            return
+        self.reported_at = now
+        self.conn.execute('UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE id = ?',
+                          (round(min(max(fraction, 0), 1), 4), message, database.utc_now(), self.id))
+        self.conn.commit()
+        row = self.conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (self.id,)).fetchone()
+        if row and row['cancel_requested']:
+            raise Cancelled()
+
+
+# Tasks
+
+def recount(job, conn):
+    # Compare conversion kits' installed counts with their allocation rows (hot and
+    # archived); with {"apply": true} the counters are corrected as well
+    apply = str(job.params.get('apply', '')).lower() in ('1', 'true', 'yes', 'on')
+    serials = [row[0] for row in conn.execute(
+        "SELECT serial FROM items WHERE item_type = 'conversion_kit' AND serial IS NOT NULL ORDER BY serial").fetchall()]
+    counted = ' + '.join(f'(SELECT COUNT(*) FROM {source} a WHERE a.new_item_serial = i.serial)'
+                         for source in archive.sources(conn, 'allocations'))
+    mismatches = []
+    for start in range(0, len(serials), BATCH_SIZE):
+        batch = serials[start:start + BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(f'''
+            SELECT i.serial, COALESCE(i.units_imported, 0) AS units_imported,
+                   COALESCE(i.units_installed, 0) AS units_installed, {counted} AS allocated
+            FROM items i WHERE i.serial IN ({placeholders})
+        ''', batch).fetchall()
+        for row in rows:
+            if row['units_installed'] != row['allocated']:
+                mismatches.append({'serial': row['serial'], 'units_installed': row['units_installed'],
+                                   'allocated': row['allocated']})
+                if apply:
+                    conn.execute('''
+                        UPDATE items SET units_installed = ?, units_available = ? WHERE serial = ?
+                    ''', (row['allocated'], max(row['units_imported'] - row['allocated'], 0), row['serial']))
+                    units.resync(conn, row['serial'], row['units_imported'] - row['allocated'])
+        if apply:
+            conn.commit()
+        job.progress((start + len(batch)) / len(serials), f'{start + len(batch)} of {len(serials)} kits checked')
+    return {'checked': len(serials), 'mismatched': len(mismatches), 'applied': apply, 'mismatches': mismatches[:100]}
+
+
+EXPORT_TABLES = ('items', 'allocations', 'returns')
+
+
+def export(job, conn):
+    # Write a table to CSV under EXPORT_DIR ({"table": "allocations"})
+    table = job.params.get('table', 'items')
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'Cannot export {table!r}')
+    total = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f'job-{job.id}-{table}.csv')
+    cursor = conn.execute(f'SELECT * FROM {table} ORDER BY id')
+    written = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            writer.writerows(tuple(row) for row in rows)
+            written += len(rows)
+            job.progress(written / max(total, 1), f'{written} of {total} rows written')
+    job.progress(1, f'{written} rows written', force=True)
+    return {'table': table, 'rows': written, 'file': path}
+
+
+TASKS = {
+    'recount': recount,
+    'export': export,
+}
+
+
+# Worker side
+
+def _run(warehouse, job_id):
+    # Entry point in the worker process. Progress goes through its own connection:
+    # a task holding a read snapshot (e.g. export's cursor) could not also write.
+    token = warehouses.use(warehouse)
+    status_conn = database.get_db_connection(warehouse)
+    conn = database.get_db_connection(warehouse)
+    try:
+        row = status_conn.execute('SELECT kind, params, cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row['cancel_requested']:
+            return
+        status_conn.execute("UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE id = ?",
+                            (database.utc_now(), database.utc_now(), job_id))
+        status_conn.commit()
+        job = Job(status_conn, job_id, json.loads(row['params'] or '{}'))
+        try:
+            result = TASKS[row['kind']](job, conn)
+            status, message = 'done', None
+        except Cancelled:
+            result, status, message = None, 'cancelled', 'Cancelled'
+        except Exception as e:
+            result, status, message = None, 'failed', str(e)
+        conn.rollback()
+        status_conn.execute('''
+            UPDATE jobs SET status = ?, message = COALESCE(?, message), result = ?, finished_at = ?,
+                progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END
+            WHERE id = ?
+        ''', (status, message, json.dumps(result) if result is not None else None, database.utc_now(), status, job_id))
+        status_conn.commit()
+    finally:
+        conn.close()
+        status_conn.close()
+        warehouses.reset(token)
+
+
+# Web side
+
+def executor():
+    # Created on first use; "spawn" so workers never inherit the web process's open connections
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def submit(kind, params=None, warehouse=None):
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    warehouse = warehouse or warehouses.current()
+    conn = database.get_db_connection(warehouse)
+    try:
+        job_id = repository.get_repository(warehouse).insert(conn, '''
+            INSERT INTO jobs (kind, params, status, progress, created_at, owner, heartbeat_at)
+            VALUES (?, ?, 'queued', 0, ?, ?, ?)
+        ''', (kind, json.dumps(params or {}), database.utc_now(), OWNER, database.utc_now()))
+        conn.commit()
+    finally:
+        conn.close()
+    future = executor().submit(_run, warehouse, job_id)
+    future.add_done_callback(lambda f: _finished(warehouse, job_id, f))
+    return job_id
+
+
+def _finished(warehouse, job_id, future):
+    # Writes made in a worker process don't bump this process's change counter
+    database.record_change()
+    if future.exception() is not None:
+        # The worker process died (or the job could not be sent to it)
+        conn = database.get_db_connection(warehouse)
+        try:
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', message = ?, finished_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (f'Worker error: {future.exception()}', database.utc_now(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def get(job_id):
+    conn = database.get_db_connection()
+    try:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return to_dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def recent(limit=50):
+    conn = database.get_db_connection()
+    try:
+        return [to_dict(row) for row in conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))]
+    finally:
+        conn.close()
+
+
+def cancel(job_id):
+    # Queued jobs are cancelled outright; running ones stop at their next progress report
+    conn = database.get_db_connection()
+    try:
+        conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+        conn.execute('''
+            UPDATE jobs SET status = 'cancelled', message = 'Cancelled', finished_at = ?
+            WHERE id = ? AND status = 'queued'
+        ''', (database.utc_now(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def heartbeat(warehouse):
+    # This process is still alive to run the jobs it owns
+    conn = database.get_db_connection(warehouse)
+    try:
+        conn.execute('''
+            UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')
+        ''', (database.utc_now(), OWNER))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def recover(warehouse):
+    # Fail the jobs whose process stopped: another process's queued or running jobs
+    # with no heartbeat for STALE_SECONDS (or none at all, from before owners were
+    # recorded). Jobs of live processes, this one included, are left alone.
+    stale = (datetime.now(timezone.utc) - timedelta(seconds=STALE_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = database.get_db_connection(warehouse)
+    try:
+        conn.execute('''
+            UPDATE jobs SET status = 'failed', message = 'Interrupted: its process stopped', finished_at = ?
+            WHERE status IN ('queued', 'running') AND (owner IS NULL OR owner != ?)
+              AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        ''', (database.utc_now(), OWNER, stale))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def beat_all():
+    # Scheduled in every web process: keep its own jobs' heartbeat fresh, fail orphans
+    for name in warehouses.names():
+        try:
+            heartbeat(name)
+            recover(name)
+        except Exception as e:
+            log.warning('job heartbeat failed', extra={'warehouse': name, 'error': str(e)})
+
+
+def to_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
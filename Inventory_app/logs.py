@@ -0,0 +1,202 @@
+# Structured logging
+# logs.py
+#
+# Every log line is one JSON object on stdout (and LOG_FILE if set). Request
+# threads only put records on a bounded queue; a listener thread formats and
+# writes them, so a slow disk or pipe never adds to response times (when the
+# queue is full, records are dropped and counted instead of waiting). Each
+# request gets an ID (X-Request-ID, or a new one) that is attached to every
+# record logged while it runs, including the SQL statements its connections
+# execute when LOG_SQL=1. One access line per request is logged at the end;
+# high-volume routes are sampled (LOG_SAMPLE), but errors and slow requests
+# are always kept.
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from flask import request, g
+import warehouses
+
+LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('LOG_FILE')
+QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SQL = os.environ.get('LOG_SQL', '0') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('LOG_SLOW_MS', 1000))
+
+# Share of access lines kept per endpoint, e.g. LOG_SAMPLE="static=0,api_dashboard_stats=0.05"
+DEFAULT_SAMPLE_RATES = {'static': 0.01, 'api_dashboard_stats': 0.1, 'api_dashboard_panel': 0.1, 'sync_changes': 0.1,
+                        'healthz': 0.01, 'readyz': 0.01}
+
+
+def load_sample_rates():
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for entry in os.environ.get('LOG_SAMPLE', '').split(','):
+        endpoint, _, rate = entry.strip().partition('=')
+        if endpoint and rate:
+            rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = load_sample_rates()
+
+# Attributes every LogRecord has; anything else was passed with extra= and becomes a JSON field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'request_id', 'warehouse'}
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_sql_count = contextvars.ContextVar('sql_count', default=None)
+
+request_log = logging.getLogger('inventory.request')
+sql_log = logging.getLogger('inventory.sql')
+
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'warehouse', None):
+            entry['warehouse'] = record.warehouse
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the thread that logs, where the request's context is still set
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        if getattr(record, 'warehouse', None) is None and record.request_id:
+            record.warehouse = warehouses.current()
+        return True
+
+
+class RequestSampler(logging.Filter):
+    # Keeps a share of access lines per endpoint; errors and slow requests always pass
+    def filter(self, record):
+        if getattr(record, 'status', 0) >= 500 or getattr(record, 'duration_ms', 0) >= SLOW_REQUEST_MS:
+            return True
+        rate = SAMPLE_RATES.get(getattr(record, 'endpoint', None), 1.0)
+        return rate >= 1 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only what cannot wait for the listener: resolve the message arguments and
+        # render any traceback while they still exist; JSON is built on the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup():
+    # Route the app's loggers through the queue; safe to call more than once
+    global _listener, _handler
+    if _listener is not None:
+        return
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+
+    _handler = NonBlockingQueueHandler(queue.Queue(maxsize=QUEUE_SIZE))
+    _handler.addFilter(ContextFilter())
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)  # flush what is still queued on shutdown
+
+    logger = logging.getLogger('inventory')
+    logger.setLevel(LEVEL)
+    logger.addHandler(_handler)
+    logger.propagate = False
+    request_log.addFilter(RequestSampler())
+    sql_log.setLevel(logging.DEBUG if LOG_SQL else logging.WARNING)
+    # The access lines below replace werkzeug's own, which are written on the request thread
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+
+def trace(conn):
+    # Count (and with LOG_SQL=1, log) the statements a connection runs for the current request
+    if hasattr(conn, 'set_trace_callback'):
+        conn.set_trace_callback(statement)
+
+
+def statement(sql):
+    count = _sql_count.get()
+    if count is None:
+        return  # not inside a request (scheduler, job worker)
+    count[0] += 1
+    if LOG_SQL:
+        sql_log.debug('sql', extra={'sql': sql})
+
+
+def stats():
+    return {'queued': _handler.queue.qsize() if _handler else 0, 'dropped': _handler.dropped if _handler else 0}
+
+
+def init_app(app):
+    setup()
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = (request.headers.get('X-Request-ID') or '')[:64] or uuid.uuid4().hex[:16]
+        g.log_started = time.perf_counter()
+        _request_id.set(g.request_id)
+        _sql_count.set([0])
+
+    @app.after_request
+    def add_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+            g.log_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def log_request(error=None):
+        # Runs once a streamed body has been sent too, so its SQL and time are included
+        if 'log_started' not in g:
+            return
+        request_log.info('request', extra={
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': 500 if error is not None else g.get('log_status', 500),
+            'duration_ms': round((time.perf_counter() - g.log_started) * 1000, 2),
+            'sql_statements': (_sql_count.get() or [0])[0],
+        })
+        _request_id.set(None)
+        _sql_count.set(None)
@@ -0,0 +1,148 @@
+# Scheduled database maintenance
+# maintenance.py
+#
+# Once a day, inside the off-peak MAINTENANCE_WINDOW (UTC hours, e.g. "1-5"), each
+# SQLite warehouse gets PRAGMA optimize, ANALYZE on the tables whose row counts
+# drifted from the planner statistics, and incremental vacuum of free pages left
+# by deletes, then a WAL checkpoint. Every step stops once the run's MAINTENANCE_BUDGET_SECONDS is spent.
+import os
+import time
+from datetime import datetime, timezone
+import logging
+import database
+import warehouses
+
+log = logging.getLogger('inventory.maintenance')
+
+WINDOW = os.environ.get('MAINTENANCE_WINDOW', '1-5')
+BUDGET_SECONDS = float(os.environ.get('MAINTENANCE_BUDGET_SECONDS', 30))
+CHECK_MINUTES = float(os.environ.get('MAINTENANCE_CHECK_MINUTES', 15))
+ANALYZE_DRIFT = 0.1        # re-analyze a table when its row count moved by more than 10%
+ANALYSIS_LIMIT = 1000      # rows sampled per index by ANALYZE (PRAGMA analysis_limit)
+VACUUM_STEP_PAGES = 1000
+
+TABLES = ('items', 'allocations', 'returns', 'stock_thresholds', 'stock_alert_state', 'alert_outbox')
+
+last_results = {}
+
+
+def in_window(hour=None, window=WINDOW):
+    start, _, end = window.partition('-')
+    start, end = int(start), int(end or start)
+    hour = datetime.now(timezone.utc).hour if hour is None else hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # window across midnight, e.g. "22-4"
+
+
+def file_stats(conn, path):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    wal = path + '-wal'
+    return {
+        'bytes': conn.execute('PRAGMA page_count').fetchone()[0] * page_size,
+        'free_bytes': conn.execute('PRAGMA freelist_count').fetchone()[0] * page_size,
+        'wal_bytes': os.path.getsize(wal) if os.path.exists(wal) else 0,
+    }
+
+
+def changed_tables(conn):
+    # Tables with no statistics yet, or whose row count drifted from sqlite_stat1
+    # (the first number of every stat row is the table's row count when analyzed)
+    stats = {}
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        for row in conn.execute('SELECT tbl, stat FROM sqlite_stat1'):
+            stats.setdefault(row[0], int(row[1].split()[0]))
+    changed = []
+    for table in TABLES:
+        rows = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        analyzed = stats.get(table)
+        if analyzed is None:
+            if rows:
+                changed.append(table)
+        elif abs(rows - analyzed) > ANALYZE_DRIFT * max(analyzed, 1):
+            changed.append(table)
+    return changed
+
+
+def incremental_vacuum(conn, deadline=None):
+    # Free pages a step at a time until none are left or the deadline passes.
+    # Only files with auto_vacuum=INCREMENTAL can do this (see archive.vacuum).
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while deadline is None or time.monotonic() < deadline:
+        free_pages = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+        if not free_pages:
+            break
+        # executescript steps the pragma to completion; execute() frees a single page
+        conn.executescript(f'PRAGMA main.incremental_vacuum({VACUUM_STEP_PAGES})')
+        freed += min(free_pages, VACUUM_STEP_PAGES)
+    return freed
+
+
+def run(warehouse, budget_seconds=BUDGET_SECONDS):
+    path = warehouses.db_path(warehouse)
+    if warehouses.is_postgres(path):
+        return {'skipped': 'PostgreSQL warehouse (autovacuum)'}
+
+    started = time.monotonic()
+    deadline = started + budget_seconds
+    timings = {}
+    conn = database.get_db_connection(warehouse)
+    try:
+        before = file_stats(conn, path)
+
+        step = time.monotonic()
+        conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        conn.execute('PRAGMA optimize')
+        timings['optimize'] = time.monotonic() - step
+
+        step = time.monotonic()
+        analyzed = []
+        for table in changed_tables(conn):
+            if time.monotonic() >= deadline:
+                break
+            conn.execute(f'ANALYZE {table}')
+            analyzed.append(table)
+        conn.commit()
+        timings['analyze'] = time.monotonic() - step
+
+        step = time.monotonic()
+        freed = incremental_vacuum(conn, deadline)
+        timings['vacuum'] = time.monotonic() - step
+
+        # Pages freed above only leave the file once the WAL is checkpointed into it
+        step = time.monotonic()
+        checkpoint = tuple(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone())
+        timings['checkpoint'] = time.monotonic() - step
+
+        after = file_stats(conn, path)
+    finally:
+        conn.close()
+
+    result = {
+        'before': before,
+        'after': after,
+        'analyzed': analyzed,
+        'pages_freed': freed,
+        'checkpoint_busy': bool(checkpoint[0]),
+        'timings_ms': {name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+        'seconds': round(time.monotonic() - started, 2),
+        'over_budget': time.monotonic() > deadline,
+    }
+    last_results[warehouse] = dict(result, finished_at=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+    return result
+
+
+def run_due():
+    # Called every CHECK_MINUTES; runs each warehouse at most once per day, off-peak only
+    if not in_window():
+        return
+    today = datetime.now(timezone.utc).date().isoformat()
+    for name in warehouses.names():
+        if last_results.get(name, {}).get('finished_at', '')[:10] == today:
+            continue
+        try:
+            log.info('maintenance finished', extra={'warehouse': name, 'result': run(name)})
+        except Exception as e:
+            log.warning('maintenance failed', extra={'warehouse': name, 'error': str(e)})
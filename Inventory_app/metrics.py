@@ -0,0 +1,37 @@
+# Request latency samples
+# metrics.py
+#
+# app.py records how long each request took; background jobs (backups, maintenance)
+# compare latency percentiles before and while they run to report their impact.
+import os
+import time
+import threading
+from collections import deque
+import numpy as np
+
+SAMPLE_SIZE = int(os.environ.get('LATENCY_SAMPLES', 10000))
+
+_lock = threading.Lock()
+_samples = deque(maxlen=SAMPLE_SIZE)  # (finished at, seconds)
+
+
+def record(seconds):
+    with _lock:
+        _samples.append((time.time(), seconds))
+
+
+def percentile(p, start=None, end=None):
+    # p-th percentile latency in milliseconds of requests finished in [start, end]
+    with _lock:
+        values = [s for t, s in _samples if (start is None or t >= start) and (end is None or t <= end)]
+    if not values:
+        return None
+    return round(float(np.percentile(values, p)) * 1000, 1)
+
+
+def impact(start, end, p=99):
+    # Latency while a job ran compared with an equally long window just before it
+    return {
+        f'p{p}_before_ms': percentile(p, start - (end - start), start),
+        f'p{p}_during_ms': percentile(p, start, end),
+    }
@@ -0,0 +1,130 @@
+# Dashboard panel queries
+# panels.py
+#
+# Shared by the server-rendered dashboard and the /api/dashboard/* endpoints that
+# script.js polls. Recent-activity panels take a "since" cursor (the highest row id
+# the client has seen) so each refresh only transfers rows added after it.
+import alerts
+import database
+
+RECENT_LIMIT = 5
+
+
+def stats(conn):
+    # Calculate accurate totals from database
+    totals_query = conn.execute('''
+        SELECT
+            COALESCE(SUM(CASE WHEN units_imported IS NOT NULL THEN units_imported ELSE 0 END), 0) as total_imported,
+            COALESCE(SUM(CASE WHEN units_installed IS NOT NULL THEN units_installed ELSE 0 END), 0) as total_installed,
+            COALESCE(SUM(CASE WHEN units_available IS NOT NULL THEN units_available ELSE 0 END), 0) as total_available,
+            COUNT(CASE WHEN item_name IS NOT NULL AND item_name != '' THEN 1 END) as total_items
+        FROM items
+        WHERE item_type IN ('conversion_kit', 'spare_part')
+    ''').fetchone()
+
+    # Get additional statistics
+    stats_query = conn.execute('''
+        SELECT
+            COUNT(CASE WHEN item_type = 'conversion_kit' AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as conversion_kits_count,
+            COUNT(CASE WHEN item_type = 'spare_part' AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as spare_parts_count,
+            COUNT(CASE WHEN (units_available IS NULL OR units_available = 0) AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as out_of_stock_count,
+            COUNT(CASE WHEN units_available > 0 AND units_available <= COALESCE(t.low_stock_units, ?) AND item_name IS NOT NULL AND item_name != '' THEN 1 END) as low_stock_count
+        FROM items
+        LEFT JOIN stock_thresholds t ON t.item_serial = items.serial
+        WHERE item_type IN ('conversion_kit', 'spare_part')
+    ''', (alerts.DEFAULT_THRESHOLD,)).fetchone()
+
+    # Get return and allocation counts
+    return_count = conn.execute('SELECT COUNT(*) as count FROM returns').fetchone()['count']
+    allocation_count = conn.execute('SELECT COUNT(*) as count FROM allocations').fetchone()['count']
+    pending_returns = conn.execute("SELECT COUNT(*) as count FROM returns WHERE status = 'pending' OR status IS NULL").fetchone()['count']
+
+    # Calculate stock availability percentage
+    stock_availability = 0
+    if totals_query['total_imported'] > 0:
+        stock_availability = round((totals_query['total_available'] / totals_query['total_imported']) * 100, 1)
+
+    return {
+        'total_imported': totals_query['total_imported'],
+        'total_installed': totals_query['total_installed'],
+        'total_available': totals_query['total_available'],
+        'total_items': totals_query['total_items'],
+        'conversion_kits_count': stats_query['conversion_kits_count'],
+        'spare_parts_count': stats_query['spare_parts_count'],
+        'out_of_stock_count': stats_query['out_of_stock_count'],
+        'low_stock_count': stats_query['low_stock_count'],
+        'return_count': return_count,
+        'allocation_count': allocation_count,
+        'pending_returns': pending_returns,
+        'stock_availability': stock_availability,
+    }
+
+
+def recent_returns(conn, since=0, limit=RECENT_LIMIT):
+    return conn.execute('''
+        SELECT * FROM returns WHERE id > ?
+        ORDER BY date DESC, id DESC LIMIT ?
+    ''', (since, limit)).fetchall()
+
+
+def recent_kit_allocations(conn, since=0, limit=RECENT_LIMIT):
+    return conn.execute('''
+        SELECT a.* FROM allocations a
+        INNER JOIN items i ON a.new_item_serial = i.serial
+        WHERE i.item_type = 'conversion_kit' AND a.id > ?
+        ORDER BY a.date DESC, a.id DESC LIMIT ?
+    ''', (since, limit)).fetchall()
+
+
+def recent_replacements(conn, since=0, limit=RECENT_LIMIT):
+    return conn.execute('''
+        SELECT a.* FROM allocations a
+        LEFT JOIN items i ON a.new_item_serial = i.serial
+        WHERE (i.item_type = 'spare_part' OR i.item_type IS NULL)
+        AND a.old_item_serial IS NOT NULL AND a.id > ?
+        ORDER BY a.date DESC, a.id DESC LIMIT ?
+    ''', (since, limit)).fetchall()
+
+
+def cursor(conn, table):
+    # Highest row id in a table; clients pass it back as "since"
+    return conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+
+
+def warehouse_summary(warehouse):
+    # Stats and per-item stock for one warehouse (run in parallel by warehouses.fan_out)
+    conn = database.get_db_connection(warehouse)
+    summary = stats(conn)
+    items = conn.execute('''
+        SELECT serial, item_name, item_type,
+               COALESCE(units_imported, 0) AS units_imported,
+               COALESCE(units_installed, 0) AS units_installed,
+               COALESCE(units_available, 0) AS units_available
+        FROM items WHERE item_type IN ('conversion_kit', 'spare_part')
+    ''').fetchall()
+    conn.close()
+    summary['items'] = [dict(item) for item in items]
+    return summary
+
+
+def merge_warehouse_summaries(summaries):
+    totals = {}
+    items = {}
+    for warehouse, summary in summaries.items():
+        for key, value in summary.items():
+            if key not in ('items', 'stock_availability'):
+                totals[key] = totals.get(key, 0) + value
+        for item in summary['items']:
+            merged = items.setdefault(item['serial'], {
+                'serial': item['serial'], 'item_name': item['item_name'], 'item_type': item['item_type'],
+                'units_imported': 0, 'units_installed': 0, 'units_available': 0, 'by_warehouse': {},
+            })
+            merged['units_imported'] += item['units_imported']
+            merged['units_installed'] += item['units_installed']
+            merged['units_available'] += item['units_available']
+            merged['by_warehouse'][warehouse] = item['units_available']
+
+    totals['stock_availability'] = 0
+    if totals.get('total_imported', 0) > 0:
+        totals['stock_availability'] = round((totals['total_available'] / totals['total_imported']) * 100, 1)
+    return totals, sorted(items.values(), key=lambda item: item['serial'] or '')
@@ -0,0 +1,133 @@
+# PostgreSQL connections
+# postgres.py
+#
+# Wraps psycopg2 so a PostgreSQL connection can be used where the app expects a
+# sqlite3 connection: execute() with "?" placeholders, rows readable by column
+# name, commit()/close(). close() hands the connection back to the pool.
+import re
+import threading
+import itertools
+import database
+import logs
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.extensions
+    import psycopg2.pool
+except ImportError:  # only needed when a warehouse points at a postgres:// URL
+    psycopg2 = None
+
+ITERSIZE = 500
+_cursor_names = itertools.count(1)
+
+
+# String literals, quoted identifiers, dollar-quoted bodies and comments are copied
+# as they are; only a "?" outside them is a placeholder
+_TOKENS = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|\$(\w*)\$.*?\$\1\$|--[^\n]*|/\*.*?\*/|\?""", re.S)
+
+
+def _placeholder(match):
+    return '%s' if match.group() == '?' else match.group()
+
+
+def translate(sql):
+    # sqlite3 uses "?" placeholders, psycopg2 uses "%s". psycopg2 formats the whole
+    # statement, so every % (LIKE patterns included) is doubled and reaches the server
+    # as a single %; a "?" inside a literal stays a question mark.
+    return _TOKENS.sub(_placeholder, sql.replace('%', '%%'))
+
+
+class PostgresConnection:
+    dialect = 'postgresql'
+
+    def __init__(self, pool, raw):
+        self.pool = pool
+        self.raw = raw
+        self.changed = False
+
+    def execute(self, sql, params=()):
+        logs.statement(sql)
+        cursor = self.raw.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute(translate(sql), tuple(params))
+        if cursor.rowcount > 0 and cursor.description is None:
+            self.changed = True
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        logs.statement(sql)
+        cursor = self.raw.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        if cursor.rowcount != 0:
+            self.changed = True
+        return cursor
+
+    def iterate(self, sql, params=()):
+        # Server-side (named) cursor: rows are fetched ITERSIZE at a time instead of all at once
+        cursor = self.raw.cursor(name=f'listing_{next(_cursor_names)}', cursor_factory=psycopg2.extras.DictCursor)
+        cursor.itersize = ITERSIZE
+        logs.statement(sql)
+        cursor.execute(translate(sql), tuple(params))
+        try:
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def cursor(self):
+        return self
+
+    @property
+    def in_transaction(self):
+        return self.raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.raw.commit()
+        if self.changed:
+            self.changed = False
+            database.record_change()
+
+    def rollback(self):
+        self.raw.rollback()
+        self.changed = False
+
+    def close(self):
+        if self.raw is None:
+            return
+        if self.in_transaction:
+            self.raw.rollback()
+        self.pool.release(self.raw)
+        self.raw = None
+
+
+class PostgresPool:
+    # Same interface as database.ConnectionPool, backed by psycopg2's ThreadedConnectionPool
+    def __init__(self, url, size):
+        if psycopg2 is None:
+            raise RuntimeError('psycopg2 is required for PostgreSQL warehouses (pip install psycopg2-binary)')
+        self.path = url
+        self.size = size
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, size, dsn=url)
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.opened = size
+
+    def acquire(self):
+        # Wait for a free connection instead of failing when the pool is exhausted
+        if not self.slots.acquire(timeout=database.BUSY_TIMEOUT_SECONDS):
+            raise RuntimeError('Timed out waiting for a PostgreSQL connection')
+        try:
+            raw = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use += 1
+        return PostgresConnection(self, raw)
+
+    def release(self, raw):
+        self.pool.putconn(raw)
+        with self.lock:
+            self.in_use -= 1
+        self.slots.release()
@@ -0,0 +1,153 @@
+# Replacement reliability analytics
+# reliability.py
+#
+# A replacement (an allocation of a spare part, recorded by /add_replacement)
+# marks a failure of that part on the rider's bike. Consecutive replacements of
+# the same part for the same rider give the time between failures; grouping
+# those intervals by part, station and rider gives MTBF (mean days between
+# failures) and failure rates. Replacement history (hot and archived) is loaded
+# in one query into column arrays and every table is computed with numpy
+# grouping, not a loop over rows; return condition ratings are averaged over hot
+# and archived returns too. Results are cached per warehouse until a
+# replacement or return is written, here or by another process (invalidate()).
+import threading
+import numpy as np
+import archive
+import coherence
+import warehouses
+
+RATE_DAYS = 30  # failure rates are per this many days
+
+_cache = {}
+_cache_lock = threading.Lock()
+_generations = {}
+
+
+def invalidate(warehouse=None):
+    # Called after writes to replacements or return condition ratings
+    warehouse = warehouse or warehouses.current()
+    with _cache_lock:
+        _generations[warehouse] = _generations.get(warehouse, 0) + 1
+        _cache.pop(warehouse, None)
+
+
+# Writes by other processes (coherence.py) drop the cached report as well
+coherence.on_change(('items', 'allocations', 'returns'), invalidate)
+
+
+def _days(values):
+    # ISO date strings -> day numbers; unparseable dates become NaT
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        days = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[D]')
+        for i, value in enumerate(values):
+            try:
+                days[i] = np.datetime64(value, 'D')
+            except (ValueError, TypeError):
+                pass
+        return days
+
+
+def load_replacements(conn):
+    # One pass over hot and archived replacements, as column arrays
+    union = ' UNION ALL '.join(f'''
+        SELECT a.date, a.new_item_serial, a.rider_number, a.station FROM {source} a
+        INNER JOIN items i ON i.serial = a.new_item_serial
+        WHERE i.item_type = 'spare_part' AND a.old_item_serial IS NOT NULL
+    ''' for source in archive.sources(conn, 'allocations'))
+    rows = conn.execute(union).fetchall()
+    days = _days([row[0] for row in rows])
+    known = ~np.isnat(days)
+    # Fixed-width string columns sort far faster than object arrays
+    columns = [np.array([row[i] or '' for row in rows], dtype=str)[known] for i in (1, 2, 3)]
+    return (days[known], *columns)
+
+
+def factorize(values):
+    # Distinct values (sorted) and each value's index into them
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.int64)
+    return np.unique(values, return_inverse=True)
+
+
+def load_conditions(conn):
+    # Mean condition rating (1-5) of returned units (hot and archived), per item serial
+    union = ' UNION ALL '.join(f'SELECT item_serial, condition_rating FROM {source} WHERE condition_rating IS NOT NULL'
+                               for source in archive.sources(conn, 'returns'))
+    rows = conn.execute(f'''
+        SELECT item_serial, AVG(condition_rating), COUNT(condition_rating) FROM ({union}) r
+        GROUP BY item_serial
+    ''').fetchall()
+    return {row[0]: (round(float(row[1]), 2), row[2]) for row in rows}
+
+
+def intervals(days, part_codes, rider_codes, riders):
+    # Days between consecutive replacements of the same part for the same rider.
+    # Returns the gaps and, for each, the index of the replacement that ended it.
+    if len(days) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order = np.lexsort((days, part_codes, rider_codes))
+    riders_sorted, parts_sorted = rider_codes[order], part_codes[order]
+    same_chain = ((riders_sorted[1:] == riders_sorted[:-1])
+                  & (parts_sorted[1:] == parts_sorted[:-1])
+                  & (riders[order][1:] != ''))
+    gaps = (days[order][1:] - days[order][:-1]).astype(np.int64)
+    return gaps[same_chain], order[1:][same_chain]
+
+
+def group_table(names, codes, ends, gaps):
+    # Failures, intervals, MTBF and failure rate per key, busiest first
+    failures = np.bincount(codes, minlength=len(names))
+    counted = np.bincount(codes[ends], minlength=len(names))
+    total_days = np.bincount(codes[ends], weights=gaps, minlength=len(names))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mtbf = np.where(counted > 0, total_days / np.maximum(counted, 1), np.nan)
+        rate = np.where(mtbf > 0, RATE_DAYS / mtbf, np.nan)
+    rows = []
+    for i in np.lexsort((names, -failures)).tolist():
+        rows.append({
+            'key': str(names[i]),
+            'failures': int(failures[i]),
+            'intervals': int(counted[i]),
+            'mtbf_days': None if np.isnan(mtbf[i]) else round(float(mtbf[i]), 1),
+            'failure_rate': None if np.isnan(rate[i]) else round(float(rate[i]), 3),
+        })
+    return rows
+
+
+def compute(conn):
+    days, parts, riders, stations = load_replacements(conn)
+    part_names, part_codes = factorize(parts)
+    rider_names, rider_codes = factorize(riders)
+    station_names, station_codes = factorize(stations)
+    gaps, ends = intervals(days, part_codes, rider_codes, riders)
+    by_part = group_table(part_names, part_codes, ends, gaps)
+    conditions = load_conditions(conn)
+    for row in by_part:
+        row['condition'], row['returns'] = conditions.get(row['key'], (None, 0))
+    return {
+        'replacements': int(len(days)),
+        'intervals': int(len(gaps)),
+        'mtbf_days': round(float(gaps.mean()), 1) if len(gaps) else None,
+        'rate_days': RATE_DAYS,
+        'by_part': by_part,
+        'by_station': group_table(station_names, station_codes, ends, gaps),
+        'by_rider': group_table(rider_names, rider_codes, ends, gaps),
+    }
+
+
+def report(conn, warehouse=None):
+    # Cached compute(); recomputed after invalidate()
+    warehouse = warehouse or warehouses.current()
+    with _cache_lock:
+        cached = _cache.get(warehouse)
+        generation = _generations.get(warehouse, 0)
+    if cached is not None:
+        return cached
+    result = compute(conn)
+    with _cache_lock:
+        # Keep it only if no write invalidated it while it was computed
+        if _generations.get(warehouse, 0) == generation:
+            _cache[warehouse] = result
+    return result
@@ -0,0 +1,632 @@
+# Storage backends
+# repository.py
+#
+# Routes go through a Repository instead of writing SQL against sqlite3 directly.
+# SQLiteRepository serves warehouses stored in SQLite files and PostgresRepository
+# the ones configured with a postgres:// URL (WAREHOUSES or DATABASE_URL). The
+# queries are shared; the subclasses only differ where the dialects do.
+from contextlib import contextmanager
+import database
+import alerts
+import reliability
+import units
+import warehouses
+
+
+class InsufficientStock(Exception):
+    # Raised by allocate_kit when a component runs short; nothing was written
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__('Not enough stock: ' + (', '.join(
+            f"{s['item_serial']} (need {s['needed']}, have {s['available']})" for s in shortages) or 'please retry'))
+
+
+class Repository:
+    dialect = None
+
+    def __init__(self, warehouse=None):
+        self.warehouse = warehouse or warehouses.current()
+
+    @contextmanager
+    def connect(self):
+        conn = database.get_db_connection(self.warehouse)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # Dialect hooks
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    def insert(self, conn, sql, params):
+        # Run an INSERT and return the new row id
+        raise NotImplementedError
+
+    def iterate(self, conn, sql, params=()):
+        # Rows of a (possibly large) listing query, without loading them all at once
+        raise NotImplementedError
+
+    def stream(self, sql, params=()):
+        # Lazy rows for a streamed page. The connection is taken on the first row and
+        # goes back to the pool when the iteration ends or the generator is closed
+        # (e.g. the client disconnected mid-page).
+        conn = database.get_db_connection(self.warehouse)
+        try:
+            yield from self.iterate(conn, sql, params)
+        finally:
+            conn.close()
+
+    def count(self, sql, params=()):
+        with self.connect() as conn:
+            return conn.execute(sql, params).fetchone()[0]
+
+    # Items
+
+    def list_items(self, item_type, order_by_serial=False):
+        order = ' ORDER BY serial' if order_by_serial else ''
+        with self.connect() as conn:
+            return list(self.iterate(conn, 'SELECT * FROM items WHERE item_type = ?' + order, (item_type,)))
+
+    def get_item(self, serial):
+        with self.connect() as conn:
+            return conn.execute('SELECT * FROM items WHERE serial = ?', (serial,)).fetchone()
+
+    def add_item(self, serial, item_name, item_type, admin='', units_imported=0, units_installed=0, units_available=0):
+        # Returns False when the serial number already exists
+        with self.connect() as conn:
+            cursor = conn.execute('''
+                INSERT INTO items (serial, item_name, item_type, admin, created_at, units_imported, units_installed, units_available)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (serial) DO NOTHING
+            ''', (serial, item_name, item_type, admin, database.utc_today(),
+                  units_imported, units_installed, units_available))
+            added = cursor.rowcount == 1
+            if added:
+                units.track(conn, serial, units_imported, units_available)
+            conn.commit()
+            return added
+
+    def update_item(self, item_id, serial, item_name, item_type, admin, created_at,
+                    units_imported, units_installed, units_available):
+        # Returns the item's type before the update (used to pick the page to go back to)
+        with self.connect() as conn:
+            item = conn.execute('SELECT serial, item_type FROM items WHERE id = ?', (item_id,)).fetchone()
+            if item is None:
+                # Nothing to update; above all, leave the batch that has `serial` alone
+                return None
+            conn.execute('''
+                UPDATE items SET serial=?, item_name=?, item_type=?, admin=?, created_at=?,
+                units_imported=?, units_installed=?, units_available=? WHERE id=?
+            ''', (serial, item_name, item_type, admin, created_at, units_imported,
+                  units_installed, units_available, item_id))
+            if item['serial']:
+                units.rename(conn, item['serial'], serial)
+            units.resize(conn, serial, units_imported)
+            units.resync(conn, serial, units_available)
+            alerts.evaluate(conn, [serial])
+            conn.commit()
+            return item['item_type']
+
+    def delete_item(self, item_id):
+        with self.connect() as conn:
+            item = conn.execute('SELECT serial, item_type FROM items WHERE id = ?', (item_id,)).fetchone()
+            conn.execute('DELETE FROM items WHERE id = ?', (item_id,))
+            if item is not None:
+                units.forget(conn, item['serial'])
+            conn.commit()
+            return item['item_type'] if item else None
+
+    # Allocations
+
+    KIT_ALLOCATIONS = '''
+        FROM allocations a
+        INNER JOIN items i ON a.new_item_serial = i.serial
+        WHERE i.item_type = 'conversion_kit'
+    '''
+    REPLACEMENTS = 'FROM allocations WHERE old_item_serial IS NOT NULL'
+
+    def list_kit_allocations(self):
+        return list(self.stream_kit_allocations())
+
+    def stream_kit_allocations(self):
+        return self.stream('SELECT a.* ' + self.KIT_ALLOCATIONS + ' ORDER BY a.date DESC')
+
+    def count_kit_allocations(self):
+        return self.count('SELECT COUNT(*) ' + self.KIT_ALLOCATIONS)
+
+    def list_replacements(self):
+        return list(self.stream_replacements())
+
+    def stream_replacements(self):
+        return self.stream('SELECT * ' + self.REPLACEMENTS)
+
+    def count_replacements(self):
+        return self.count('SELECT COUNT(*) ' + self.REPLACEMENTS)
+
+    def record_allocation(self, date, old_item_serial, new_item_serial, rider_number, rider_name, station):
+        # Allocation row, stock movement and any low-stock alert commit together
+        with self.connect() as conn:
+            allocation_id = self.insert(conn, '''
+                INSERT INTO allocations (date, old_item_serial, new_item_serial, rider_number, rider_name, station)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (date, old_item_serial, new_item_serial, rider_number, rider_name, station))
+            cursor = conn.execute('''
+                UPDATE items
+                SET units_installed = COALESCE(units_installed, 0) + 1,
+                    units_available = COALESCE(units_available, 0) - 1
+                WHERE serial = ? AND units_available > 0
+            ''', (new_item_serial,))
+            if cursor.rowcount == 1:
+                # The lowest free unit of the batch goes to this rider
+                taken = units.take(conn, new_item_serial)
+                if taken:
+                    conn.execute('UPDATE allocations SET unit_number = ? WHERE id = ?', (taken[0], allocation_id))
+            alerts.evaluate(conn, [new_item_serial])
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+            return allocation_id
+
+    def record_replacement(self, date, old_item_serial, new_item_serial, rider_number, rider_name,
+                           released_to, link, station):
+        with self.connect() as conn:
+            replacement_id = self.insert(conn, '''
+                INSERT INTO allocations (date, old_item_serial, new_item_serial, rider_number, rider_name, released_to, link, station)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (date, old_item_serial, new_item_serial, rider_number, rider_name, released_to, link, station))
+            alerts.evaluate(conn, [new_item_serial])
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+            return replacement_id
+
+    def update_replacement(self, replacement_id, date, old_item_serial, new_item_serial,
+                           rider_name, rider_number, station):
+        with self.connect() as conn:
+            conn.execute('''
+                UPDATE allocations SET date = ?, old_item_serial = ?, new_item_serial = ?,
+                rider_name = ?, rider_number = ?, station = ? WHERE id = ?
+            ''', (date, old_item_serial, new_item_serial, rider_name, rider_number, station, replacement_id))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+
+    def delete_allocation(self, allocation_id):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM allocations WHERE id = ?', (allocation_id,))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+
+    # Kits (bills of materials)
+
+    MAX_KIT_BIKES = 500
+
+    def list_kit_definitions(self):
+        # Kits with their components and each component's available stock
+        with self.connect() as conn:
+            kits = [dict(row, components=[]) for row in conn.execute('SELECT * FROM kit_definitions ORDER BY name')]
+            by_id = {kit['id']: kit for kit in kits}
+            for row in conn.execute('''
+                SELECT c.kit_id, c.item_serial, c.quantity, i.item_name, COALESCE(i.units_available, 0) AS units_available
+                FROM kit_components c LEFT JOIN items i ON i.serial = c.item_serial
+                ORDER BY c.kit_id, c.item_serial
+            '''):
+                if row['kit_id'] in by_id:
+                    by_id[row['kit_id']]['components'].append(dict(row))
+            for kit in kits:
+                # Whole kits the current stock covers
+                kit['buildable'] = min((max(c['units_available'], 0) // max(c['quantity'], 1)
+                                        for c in kit['components']), default=0)
+            return kits
+
+    def save_kit_definition(self, name, components, description=''):
+        # components maps item serial -> units per kit and replaces the kit's current list
+        with self.connect() as conn:
+            conn.execute('''
+                INSERT INTO kit_definitions (name, description) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET description = excluded.description
+            ''', (name, description))
+            kit_id = conn.execute('SELECT id FROM kit_definitions WHERE name = ?', (name,)).fetchone()[0]
+            conn.execute('DELETE FROM kit_components WHERE kit_id = ?', (kit_id,))
+            conn.executemany('INSERT INTO kit_components (kit_id, item_serial, quantity) VALUES (?, ?, ?)',
+                             [(kit_id, serial, int(quantity)) for serial, quantity in components.items()])
+            conn.commit()
+            return kit_id
+
+    def allocate_kit(self, kit_id, bikes):
+        # Install every component of a kit on each of `bikes` (dicts with date,
+        # old_item_serial (the plate), rider_number, rider_name and station) in one
+        # transaction. A single conditional UPDATE takes the stock of all components;
+        # unless it matched every component, nothing is written and InsufficientStock
+        # lists what is short. Each unit gets an allocation row, as /add_allocation
+        # would have written, numbered from the batch's free units. Returns
+        # {item_serial: units taken}.
+        count = len(bikes)
+        rows = [(bike.get('date') or database.utc_today(), bike.get('old_item_serial'), bike.get('rider_number'),
+                 bike['rider_name'], bike.get('station', '')) for bike in bikes]
+        with self.connect() as conn:
+            components = {row['item_serial']: row['quantity'] for row in conn.execute(
+                'SELECT item_serial, quantity FROM kit_components WHERE kit_id = ?', (kit_id,))}
+            if not components:
+                raise LookupError(f'No kit definition {kit_id}')
+
+            updated = conn.execute('''
+                UPDATE items
+                SET units_installed = COALESCE(units_installed, 0) + c.quantity * ?,
+                    units_available = units_available - c.quantity * ?
+                FROM kit_components c
+                WHERE c.kit_id = ? AND items.serial = c.item_serial AND items.units_available >= c.quantity * ?
+            ''', (count, count, kit_id, count)).rowcount
+            if updated != len(components):
+                conn.rollback()
+                raise InsufficientStock([dict(row) for row in conn.execute('''
+                    SELECT c.item_serial, c.quantity * ? AS needed, COALESCE(i.units_available, 0) AS available
+                    FROM kit_components c LEFT JOIN items i ON i.serial = c.item_serial
+                    WHERE c.kit_id = ? AND COALESCE(i.units_available, 0) < c.quantity * ?
+                    ORDER BY c.item_serial
+                ''', (count, kit_id, count))])
+
+            # One row per unit, each with the unit number it took from the batch's free ranges
+            allocations = []
+            for serial, quantity in sorted(components.items()):
+                taken = iter(units.take(conn, serial, quantity * count))
+                for date, plate, rider_number, rider_name, station in rows:
+                    for _ in range(quantity):
+                        allocations.append((date, plate, serial, rider_number, rider_name, station, next(taken, None)))
+            conn.executemany('''
+                INSERT INTO allocations (date, old_item_serial, new_item_serial, rider_number, rider_name, station, unit_number)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', allocations)
+            alerts.evaluate(conn, list(components))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+            return {serial: quantity * count for serial, quantity in components.items()}
+
+    # Returns
+
+    def list_returns(self):
+        return list(self.stream_returns())
+
+    def stream_returns(self):
+        return self.stream('SELECT * FROM returns ORDER BY date DESC')
+
+    def return_stats(self):
+        # Figures for the returns page's analytics panel, without loading the rows
+        with self.connect() as conn:
+            stats = conn.execute('''
+                SELECT COUNT(*) AS total,
+                       COUNT(DISTINCT personnel) AS personnel,
+                       COUNT(DISTINCT item_serial) AS items,
+                       COALESCE(SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END), 0) AS pending
+                FROM returns
+            ''').fetchone()
+            recent = conn.execute('SELECT * FROM returns ORDER BY date DESC, id DESC LIMIT 5').fetchall()
+            return dict(stats, recent=recent)
+
+    def add_return(self, date, item_serial, personnel, status='pending', notes='', condition_rating=5,
+                   unit_number=None):
+        with self.connect() as conn:
+            return_id = self.insert(conn, '''
+                INSERT INTO returns (date, item_serial, personnel, status, notes, condition_rating, unit_number)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (date, item_serial, personnel, status, notes, condition_rating, unit_number))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+            return return_id
+
+    def update_return(self, return_id, date, item_serial, personnel, status, notes):
+        with self.connect() as conn:
+            conn.execute('''
+                UPDATE returns SET date = ?, item_serial = ?, personnel = ?, status = ?, notes = ? WHERE id = ?
+            ''', (date, item_serial, personnel, status, notes, return_id))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+
+    def update_return_status(self, return_id, status, notes):
+        with self.connect() as conn:
+            conn.execute('UPDATE returns SET status = ?, notes = ? WHERE id = ?', (status, notes, return_id))
+            conn.commit()
+
+    def delete_return(self, return_id):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM returns WHERE id = ?', (return_id,))
+            conn.commit()
+            reliability.invalidate(self.warehouse)
+
+    def process_return(self, return_id):
+        # Mark a pending return processed and put the unit back into available stock.
+        # The status change is conditional, so a double click or a retried request can
+        # only restore the unit once. Returns the return row, or None if there is no
+        # pending return with this id.
+        with self.connect() as conn:
+            return_item = conn.execute('''
+                UPDATE returns SET status = 'processed', processed_date = ?
+                WHERE id = ? AND (status = 'pending' OR status IS NULL)
+                RETURNING *
+            ''', (database.utc_today(), return_id)).fetchone()
+            if return_item is None:
+                conn.rollback()
+                return None
+            conn.execute('''
+                UPDATE items
+                SET units_available = COALESCE(units_available, 0) + 1,
+                    units_installed = CASE
+                        WHEN COALESCE(units_installed, 0) > 0 THEN COALESCE(units_installed, 0) - 1
+                        ELSE 0
+                    END
+                WHERE serial = ?
+            ''', (return_item['item_serial'],))
+            units.release(conn, return_item['item_serial'], return_item['unit_number'])
+            alerts.evaluate(conn, [return_item['item_serial']])
+            conn.commit()
+            return return_item
+
+
+    # Filters for process_returns, by form field
+    RETURN_FILTERS = {
+        'item_serial': 'item_serial = ?',
+        'personnel': 'personnel = ?',
+        'date_from': 'date >= ?',
+        'date_to': 'date <= ?',
+    }
+    BULK_BATCH_SIZE = 500
+
+    def process_returns(self, return_ids=None, filters=None):
+        # Process many pending returns in one transaction. The returns are picked by id,
+        # or else by RETURN_FILTERS (no filters = every pending return). One UPDATE per
+        # batch marks them processed and hands back the rows it changed; the units then
+        # go back into stock with one UPDATE per batch of serials, and into the free
+        # unit ranges with units.release_many.
+        # Returns {item_serial: units restored}.
+        pending = "(status = 'pending' OR status IS NULL)"
+        if return_ids is not None:
+            ids = sorted({int(return_id) for return_id in return_ids})
+            scopes = [(f"id IN ({','.join('?' * len(batch))})", batch)
+                      for batch in (ids[start:start + self.BULK_BATCH_SIZE]
+                                    for start in range(0, len(ids), self.BULK_BATCH_SIZE))]
+        else:
+            filters = {name: value for name, value in (filters or {}).items() if value and name in self.RETURN_FILTERS}
+            scopes = [(' AND '.join([self.RETURN_FILTERS[name] for name in filters] or ['1 = 1']), list(filters.values()))]
+
+        restored, released = {}, {}
+        with self.connect() as conn:
+            for condition, params in scopes:
+                rows = conn.execute(f'''
+                    UPDATE returns SET status = 'processed', processed_date = ?
+                    WHERE {pending} AND {condition}
+                    RETURNING item_serial, unit_number
+                ''', [database.utc_today()] + list(params)).fetchall()
+                for row in rows:
+                    restored[row['item_serial']] = restored.get(row['item_serial'], 0) + 1
+                    released.setdefault(row['item_serial'], []).append(row['unit_number'])
+            units.release_many(conn, released)
+
+            serials = list(restored)
+            for start in range(0, len(serials), self.BULK_BATCH_SIZE):
+                batch = serials[start:start + self.BULK_BATCH_SIZE]
+                values = ', '.join(['(?, ?)'] * len(batch))
+                conn.execute(f'''
+                    WITH restored (serial, units) AS (VALUES {values})
+                    UPDATE items
+                    SET units_available = COALESCE(units_available, 0) + restored.units,
+                        units_installed = CASE
+                            WHEN COALESCE(units_installed, 0) > restored.units THEN COALESCE(units_installed, 0) - restored.units
+                            ELSE 0
+                        END
+                    FROM restored WHERE items.serial = restored.serial
+                ''', [value for serial in batch for value in (serial, restored[serial])])
+            alerts.evaluate(conn, serials)
+            conn.commit()
+        return restored
+
+
+class SQLiteRepository(Repository):
+    dialect = 'sqlite'
+
+    def init_schema(self):
+        database.init_db(self.warehouse)
+
+    def insert(self, conn, sql, params):
+        return conn.execute(sql, params).lastrowid
+
+    def iterate(self, conn, sql, params=()):
+        # sqlite3 cursors already step through rows lazily
+        return conn.execute(sql, params)
+
+
+class PostgresRepository(Repository):
+    dialect = 'postgresql'
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS items (
+            id SERIAL PRIMARY KEY,
+            serial TEXT UNIQUE,
+            item_name TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            admin TEXT,
+            created_at TEXT,
+            units_imported INTEGER DEFAULT 0,
+            units_installed INTEGER DEFAULT 0,
+            units_available INTEGER DEFAULT 0
+        )''',
+        # No foreign keys: SQLite never enforced them and returns may name unknown serials
+        '''CREATE TABLE IF NOT EXISTS allocations (
+            id SERIAL PRIMARY KEY,
+            date TEXT,
+            item_id INTEGER,
+            old_item_serial TEXT,
+            new_item_serial TEXT,
+            rider_number TEXT,
+            rider_name TEXT,
+            released_to TEXT,
+            link TEXT,
+            station TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS returns (
+            id SERIAL PRIMARY KEY,
+            date TEXT,
+            item_serial TEXT,
+            personnel TEXT,
+            status TEXT DEFAULT 'pending',
+            notes TEXT,
+            processed_date TEXT,
+            condition_rating INTEGER DEFAULT 5
+        )''',
+        '''CREATE TABLE IF NOT EXISTS stock_thresholds (
+            item_serial TEXT PRIMARY KEY,
+            low_stock_units INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS stock_alert_state (
+            item_serial TEXT PRIMARY KEY,
+            level TEXT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS alert_outbox (
+            id SERIAL PRIMARY KEY,
+            created_at TEXT,
+            item_serial TEXT,
+            level TEXT,
+            units_available INTEGER,
+            threshold INTEGER,
+            delivered_at TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_alert_outbox_pending ON alert_outbox (id) WHERE delivered_at IS NULL',
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            route TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            response_status INTEGER,
+            location TEXT,
+            content_type TEXT,
+            body TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)',
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            owner TEXT,
+            heartbeat_at TEXT
+        )''',
+        'ALTER TABLE jobs ADD COLUMN IF NOT EXISTS owner TEXT',
+        'ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TEXT',
+        '''CREATE TABLE IF NOT EXISTS kit_definitions (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS kit_components (
+            kit_id INTEGER NOT NULL REFERENCES kit_definitions (id),
+            item_serial TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (kit_id, item_serial)
+        )''',
+        'ALTER TABLE allocations ADD COLUMN IF NOT EXISTS unit_number INTEGER',
+        'ALTER TABLE returns ADD COLUMN IF NOT EXISTS unit_number INTEGER',
+        '''CREATE TABLE IF NOT EXISTS unit_batches (
+            item_serial TEXT PRIMARY KEY,
+            unit_count INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS unit_ranges (
+            item_serial TEXT NOT NULL,
+            first_unit INTEGER NOT NULL,
+            last_unit INTEGER NOT NULL,
+            PRIMARY KEY (item_serial, first_unit)
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_unit_ranges_last ON unit_ranges (item_serial, last_unit)',
+        'CREATE INDEX IF NOT EXISTS idx_allocations_unit ON allocations (new_item_serial, unit_number)',
+        '''INSERT INTO unit_ranges (item_serial, first_unit, last_unit)
+           SELECT serial, units_imported - LEAST(units_available, units_imported) + 1, units_imported FROM items
+           WHERE serial IS NOT NULL AND units_available > 0 AND units_imported > 0
+             AND serial NOT IN (SELECT item_serial FROM unit_batches)''',
+        '''INSERT INTO unit_batches (item_serial, unit_count)
+           SELECT serial, GREATEST(COALESCE(units_imported, 0), 0) FROM items
+           WHERE serial IS NOT NULL AND serial NOT IN (SELECT item_serial FROM unit_batches)''',
+        # Delta sync: one sequence for every tracked table
+        'CREATE SEQUENCE IF NOT EXISTS sync_clock_seq',
+        '''CREATE TABLE IF NOT EXISTS sync_tombstones (
+            version BIGINT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            row_key TEXT
+        )''',
+        # Writers stamp rows under an advisory lock, so versions commit in the order they
+        # were drawn and sync.current_version never sees a number whose row is still in flight
+        '''CREATE OR REPLACE FUNCTION sync_stamp() RETURNS trigger AS $$
+           BEGIN
+               PERFORM pg_advisory_xact_lock(hashtext('sync_clock'));
+               NEW.row_version := nextval('sync_clock_seq');
+               RETURN NEW;
+           END $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION sync_tombstone() RETURNS trigger AS $$
+           BEGIN
+               PERFORM pg_advisory_xact_lock(hashtext('sync_clock'));
+               INSERT INTO sync_tombstones (version, table_name, row_id, row_key)
+               VALUES (nextval('sync_clock_seq'), TG_TABLE_NAME, OLD.id, to_jsonb(OLD) ->> 'serial');
+               RETURN OLD;
+           END $$ LANGUAGE plpgsql''',
+    ] + [statement for table in database.SYNC_TABLES for statement in (
+        f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version BIGINT',
+        f'CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table} (row_version)',
+        f'DROP TRIGGER IF EXISTS sync_{table}_stamp ON {table}',
+        f'CREATE TRIGGER sync_{table}_stamp BEFORE INSERT OR UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION sync_stamp()',
+        f'DROP TRIGGER IF EXISTS sync_{table}_delete ON {table}',
+        f'CREATE TRIGGER sync_{table}_delete AFTER DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION sync_tombstone()',
+        # Rows from before tracking (the trigger stamps each one)
+        f'UPDATE {table} SET row_version = 0 WHERE row_version IS NULL',
+    )] + [
+        # Per-table write generations for cache coherence (coherence.py); one bump per statement
+        '''CREATE TABLE IF NOT EXISTS table_generations (
+            table_name TEXT PRIMARY KEY,
+            generation BIGINT NOT NULL DEFAULT 0
+        )''',
+        '''CREATE OR REPLACE FUNCTION bump_generation() RETURNS trigger AS $$
+           BEGIN
+               UPDATE table_generations SET generation = generation + 1 WHERE table_name = TG_TABLE_NAME;
+               RETURN NULL;
+           END $$ LANGUAGE plpgsql''',
+    ] + [statement for table in database.GENERATION_TABLES for statement in (
+        f"INSERT INTO table_generations (table_name) VALUES ('{table}') ON CONFLICT DO NOTHING",
+        f'DROP TRIGGER IF EXISTS generation_{table} ON {table}',
+        f'''CREATE TRIGGER generation_{table} AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_generation()''',
+    )] + [
+        '''CREATE INDEX IF NOT EXISTS idx_allocations_rider
+           ON allocations (rider_number, id) INCLUDE (date, old_item_serial, new_item_serial, rider_name, station)''',
+        '''CREATE INDEX IF NOT EXISTS idx_allocations_new_serial
+           ON allocations (new_item_serial, id) INCLUDE (date, old_item_serial, rider_number, rider_name, station)''',
+        '''CREATE INDEX IF NOT EXISTS idx_allocations_old_serial
+           ON allocations (old_item_serial, id) INCLUDE (date, new_item_serial, rider_number, rider_name, station)''',
+        '''CREATE INDEX IF NOT EXISTS idx_returns_serial
+           ON returns (item_serial, id) INCLUDE (date, personnel, status, processed_date, condition_rating)''',
+        'CREATE INDEX IF NOT EXISTS idx_allocations_date_serial ON allocations (date, new_item_serial)',
+    ]
+
+    def init_schema(self):
+        # Tables only; the spreadsheet sample data is for local SQLite installs
+        with self.connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+
+    def insert(self, conn, sql, params):
+        return conn.execute(sql + ' RETURNING id', params).fetchone()[0]
+
+    def iterate(self, conn, sql, params=()):
+        # Server-side cursor, fetched in batches
+        return conn.iterate(sql, params)
+
+
+def get_repository(warehouse=None):
+    if warehouses.is_postgres(warehouses.db_path(warehouse)):
+        return PostgresRepository(warehouse)
+    return SQLiteRepository(warehouse)
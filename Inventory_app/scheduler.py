@@ -0,0 +1,74 @@
+# Background schedules
+# scheduler.py
+#
+# Schedules that must run once per deployment (archiving, backups, maintenance)
+# are started through when_leader(): only the web process holding an exclusive
+# lock on SCHEDULER_LOCK runs them. The lock is a file lock, so it covers the
+# processes of one host (or of a shared volume); the others retry and take over
+# when the holder exits.
+import os
+import time
+import threading
+import logging
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process counts as the only one
+    fcntl = None
+
+log = logging.getLogger('inventory.scheduler')
+
+LOCK_PATH = os.environ.get('SCHEDULER_LOCK', 'scheduler.lock')
+LOCK_RETRY_SECONDS = float(os.environ.get('SCHEDULER_LOCK_RETRY', 30))
+
+_threads = {}
+_lock_file = None
+
+
+def every(name, seconds, fn, env=None, initial_delay=0):
+    # Run fn() every `seconds` in a daemon thread. Setting the `env` variable to
+    # anything but 1 turns the schedule off (e.g. BACKUPS=0).
+    if name in _threads or (env and os.environ.get(env, '1') != '1'):
+        return
+
+    def loop():
+        time.sleep(initial_delay)
+        while True:
+            try:
+                fn()
+            except Exception as e:
+                log.warning('scheduled task failed', extra={'task': name, 'error': str(e)}, exc_info=True)
+            time.sleep(seconds)
+
+    _threads[name] = threading.Thread(target=loop, name=name, daemon=True)
+    _threads[name].start()
+
+
+def try_lock(path=None):
+    # The open lock file if this process now holds the exclusive lock, else None
+    lock_file = open(path or LOCK_PATH, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def is_leader():
+    return _lock_file is not None
+
+
+def when_leader(start):
+    # Call start() once this process holds the scheduler lock (kept until it exits)
+    def attempt():
+        global _lock_file
+        if _lock_file is None:
+            _lock_file = try_lock()
+            if _lock_file is not None:
+                log.info('scheduler lock taken', extra={'pid': os.getpid(), 'lock': LOCK_PATH})
+                start()
+
+    attempt()
+    if _lock_file is None:
+        every('scheduler-lock', LOCK_RETRY_SECONDS, attempt, initial_delay=LOCK_RETRY_SECONDS)
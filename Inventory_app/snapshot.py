@@ -0,0 +1,154 @@
+# Read snapshots for reporting pages
+# snapshot.py
+#
+# With READ_SNAPSHOT=1 a background thread copies each SQLite warehouse into an
+# in-memory database with the backup API every SNAPSHOT_INTERVAL seconds, and the
+# dashboards query that copy instead of the file. The copy is one read snapshot of
+# the WAL, which writers never wait on, and reporting load then never touches the
+# file's locks or page cache. A new copy is built beside the old one and swapped
+# in; readers still on the old copy finish there and it is freed when they close.
+# get_read_connection() falls back to the live file whenever the copy is older
+# than the staleness the caller accepts (SNAPSHOT_MAX_STALENESS by default), and
+# PostgreSQL warehouses always read live.
+import os
+import time
+import sqlite3
+import itertools
+import threading
+from flask import g, has_request_context
+import database
+import logs
+import scheduler
+import warehouses
+
+ENABLED = os.environ.get('READ_SNAPSHOT', '0') == '1'
+INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_INTERVAL', 2))
+MAX_STALENESS_SECONDS = float(os.environ.get('SNAPSHOT_MAX_STALENESS', 10))
+
+_current = {}
+_lock = threading.Lock()
+_sources = {}
+_names = itertools.count(1)
+
+
+class Snapshot:
+    # One in-memory copy of a warehouse. Hands out read-only connections to it the
+    # way database.ConnectionPool does, so conn.close() brings them back here.
+    def __init__(self, warehouse, holder, uri, version, change_version, change_time):
+        self.warehouse = warehouse
+        self.holder = holder  # keeps the shared in-memory database alive
+        self.uri = uri
+        self.data_version = version
+        self.taken_at = time.monotonic()
+        self.change_version = change_version
+        self.change_time = change_time
+        self.lock = threading.Lock()
+        self.idle = []
+        self.in_use = 0
+        self.retired = False
+
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def acquire(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+            self.in_use += 1
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, factory=database.TrackedConnection, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA query_only = 1')
+            conn.pool = self
+            logs.trace(conn)
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        with self.lock:
+            self.in_use -= 1
+            if self.retired:
+                return False
+            self.idle.append(conn)
+            return True
+
+    def retire(self):
+        # Replaced by a newer copy: close idle readers now, busy ones when they are released
+        with self.lock:
+            self.retired = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+        self.holder.close()
+
+
+def _source(warehouse):
+    # Long-lived connection per warehouse; its data_version shows whether anything was committed since the last copy
+    if warehouse not in _sources:
+        _sources[warehouse] = sqlite3.connect(warehouses.db_path(warehouse), check_same_thread=False,
+                                              timeout=database.BUSY_TIMEOUT_SECONDS)
+    return _sources[warehouse]
+
+
+def refresh(warehouse):
+    # Take a new copy if the file changed since the last one; returns the current snapshot
+    # Validators are read first, so a page never claims to be newer than its data
+    change_version, change_time = database.change_version, database.last_change_time
+    source = _source(warehouse)
+    version = source.execute('PRAGMA data_version').fetchone()[0]
+    previous = _current.get(warehouse)
+    if previous is not None and previous.data_version == version:
+        # Still identical to the file
+        previous.taken_at = time.monotonic()
+        previous.change_version, previous.change_time = change_version, change_time
+        return previous
+
+    uri = f'file:snapshot-{warehouse}-{next(_names)}?mode=memory&cache=shared'
+    holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    try:
+        source.backup(holder)
+    except Exception:
+        holder.close()
+        raise
+    snapshot = Snapshot(warehouse, holder, uri, version, change_version, change_time)
+    with _lock:
+        _current[warehouse] = snapshot
+    if previous is not None:
+        previous.retire()
+    return snapshot
+
+
+def refresh_all():
+    for warehouse in warehouses.names():
+        if not warehouses.is_postgres(warehouses.db_path(warehouse)):
+            refresh(warehouse)
+
+
+def get_read_connection(warehouse=None, max_staleness=None):
+    # A connection for read-only queries: the in-memory copy when it is fresh enough, the live database otherwise
+    warehouse = warehouse or warehouses.current()
+    max_staleness = MAX_STALENESS_SECONDS if max_staleness is None else max_staleness
+    with _lock:
+        snapshot = _current.get(warehouse) if ENABLED else None
+    if snapshot is None or snapshot.age() > max_staleness:
+        return database.get_db_connection(warehouse)
+    conn = snapshot.acquire()
+    if snapshot.retired:
+        # Swapped out between the lookup and the acquire; its holder may already be closed
+        conn.close()
+        return database.get_db_connection(warehouse)
+    if has_request_context():
+        # httpcache labels the response with the copy's version, not the live one
+        g.read_snapshot = snapshot
+    return conn
+
+
+def start():
+    if ENABLED:
+        scheduler.every('read-snapshot', INTERVAL_SECONDS, refresh_all)
+
+
+def stats():
+    with _lock:
+        current = dict(_current)
+    return {name: {'age_seconds': round(snapshot.age(), 3), 'readers': snapshot.in_use}
+            for name, snapshot in current.items()}
@@ -0,0 +1,147 @@
+# Delta sync for offline devices
+# sync.py
+#
+# Items, allocations and returns carry a row_version stamped by triggers from one
+# clock per warehouse (see database.init_db), and deletes leave a tombstone with
+# its own version. A tablet keeps the last version it saw: GET /sync?since=N
+# returns only what changed after N, a page at a time, and the version to ask
+# from next. Writes recorded offline come back in one POST /sync batch, each
+# operation with its own idempotency key so a re-sent batch is applied once.
+# Rows moved to the archive (archive.py) leave the hot tables and so show up as
+# deletions, which keeps a device's copy to the live data.
+import os
+import json
+import database
+import events
+import idempotency
+import repository
+
+PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+MAX_PAGE_SIZE = 5000
+MAX_BATCH = int(os.environ.get('SYNC_MAX_BATCH', 200))
+
+
+def current_version(conn):
+    if conn.dialect == 'postgresql':
+        # Writers hold the advisory lock until they commit; with it shared, every
+        # version up to the sequence's last value belongs to a committed row
+        conn.execute("SELECT pg_advisory_xact_lock_shared(hashtext('sync_clock'))")
+        row = conn.execute('SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM sync_clock_seq').fetchone()
+        conn.commit()
+        return row[0]
+    return conn.execute('SELECT version FROM sync_clock WHERE id = 1').fetchone()[0]
+
+
+def changes(conn, since=0, limit=PAGE_SIZE):
+    # The `limit` lowest-versioned changes after `since`, oldest first
+    version = current_version(conn)
+    entries = []
+    for table in database.SYNC_TABLES:
+        rows = conn.execute(f'''
+            SELECT * FROM {table} WHERE row_version > ? AND row_version <= ? ORDER BY row_version LIMIT ?
+        ''', (since, version, limit + 1))
+        entries.extend((row['row_version'], table, dict(row)) for row in rows)
+    rows = conn.execute('''
+        SELECT * FROM sync_tombstones WHERE version > ? AND version <= ? ORDER BY version LIMIT ?
+    ''', (since, version, limit + 1))
+    entries.extend((row['version'], 'deleted', {'table': row['table_name'], 'id': row['row_id'],
+                                                'key': row['row_key'], 'version': row['version']})
+                   for row in rows)
+    entries.sort(key=lambda entry: entry[0])
+
+    more = len(entries) > limit
+    page = entries[:limit]
+    result = {table: [] for table in database.SYNC_TABLES}
+    result['deleted'] = []
+    for _, kind, row in page:
+        result[kind].append(row)
+    return {'since': since, 'version': page[-1][0] if more else version, 'more': more, 'changes': result}
+
+
+# Offline writes: each operation maps onto the same repository call as its form route
+
+def _allocation(repo, data):
+    allocation_id = repo.record_allocation(data['date'], data.get('old_item_serial'), data['new_item_serial'],
+                                           data['rider_number'], data['rider_name'], data.get('station', ''))
+    events.publish('allocation', {'id': allocation_id, 'kind': 'allocation', 'new_item_serial': data['new_item_serial'],
+                                  'rider_name': data['rider_name'], 'station': data.get('station', '')})
+    events.publish_item(repo.get_item(data['new_item_serial']))
+    return {'id': allocation_id}
+
+
+def _replacement(repo, data):
+    replacement_id = repo.record_replacement(data['date'], data['old_item_serial'], data['new_item_serial'],
+                                             data['rider_number'], data['rider_name'], data.get('released_to', ''),
+                                             data.get('link', ''), data.get('station', ''))
+    events.publish('allocation', {'id': replacement_id, 'kind': 'replacement',
+                                  'old_item_serial': data['old_item_serial'], 'new_item_serial': data['new_item_serial'],
+                                  'rider_name': data['rider_name'], 'station': data.get('station', '')})
+    events.publish_item(repo.get_item(data['new_item_serial']))
+    return {'id': replacement_id}
+
+
+def _return(repo, data):
+    return_id = repo.add_return(data['date'], data['item_serial'], data['personnel'], data.get('status', 'pending'),
+                                data.get('notes', ''), data.get('condition_rating', 5), data.get('unit_number'))
+    events.publish('return', {'id': return_id, 'item_serial': data['item_serial'],
+                              'personnel': data['personnel'], 'status': data.get('status', 'pending')})
+    return {'id': return_id}
+
+
+def _process_return(repo, data):
+    return_item = repo.process_return(int(data['id']))
+    if return_item is None:
+        raise LookupError(f"No pending return {data['id']}")
+    events.publish('return', {'id': return_item['id'], 'item_serial': return_item['item_serial'], 'status': 'processed'})
+    events.publish_item(repo.get_item(return_item['item_serial']))
+    return {'id': return_item['id']}
+
+
+OPERATIONS = {
+    'allocation': _allocation,
+    'replacement': _replacement,
+    'return': _return,
+    'process_return': _process_return,
+}
+
+
+def apply_operation(repo, operation):
+    # {"key": "...", "op": "allocation", "data": {...}} -> {"key", "status", ...}
+    if not isinstance(operation, dict):
+        return {'key': None, 'status': 'error', 'error': 'Expected an object'}
+    key = str(operation.get('key') or '').strip()[:idempotency.MAX_KEY_LENGTH]
+    op = operation.get('op')
+    if not key:
+        return {'key': None, 'status': 'error', 'error': 'Every operation needs a key'}
+    if op not in OPERATIONS:
+        return {'key': key, 'status': 'error', 'error': f'Unknown operation {op!r}'}
+
+    route = '/sync/' + op
+    with repo.connect() as conn:
+        existing = idempotency.claim(conn, key, route)
+    if existing is not None:
+        if existing['route'] != route:
+            return {'key': key, 'status': 'error', 'error': 'Key was already used for a different operation'}
+        if existing['status'] != 'done':
+            return {'key': key, 'status': 'in_progress'}
+        return dict(json.loads(existing['body'] or '{}'), key=key, status='replayed')
+
+    try:
+        result = OPERATIONS[op](repo, operation.get('data') or {})
+    except (KeyError, ValueError, TypeError, LookupError) as e:
+        # Nothing was written; the device may fix the operation and send it again
+        idempotency.release(key)
+        message = f'Missing field {e}' if isinstance(e, KeyError) else str(e)
+        return {'key': key, 'status': 'error', 'error': message}
+    except Exception:
+        idempotency.release(key)
+        raise
+    idempotency.record(key, 200, json.dumps(result))
+    return dict(result, key=key, status='applied')
+
+
+def upload(operations):
+    # Operations are applied in the order the device recorded them, each in its own
+    # transaction; a failed one is reported and does not stop the rest
+    repo = repository.get_repository()
+    return [apply_operation(repo, operation) for operation in operations]
@@ -0,0 +1,104 @@
+# Test setup
+# tests/conftest.py
+#
+# The app reads its configuration from the environment when it is imported, so it
+# is set here first. Every run gets a fresh SQLite file and, when TEST_DATABASE_URL
+# points at a PostgreSQL server, a fresh database on it too. Both are warehouses of
+# the one app, and the `backend` fixture picks one per test the way a request
+# does (X-Warehouse), so the same tests run against each backend:
+#   TEST_DATABASE_URL=postgresql://postgres@localhost/postgres python -m pytest -q
+import os
+import sys
+import uuid
+import tempfile
+from urllib.parse import urlsplit, urlunsplit
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+_tmp = tempfile.mkdtemp(prefix='inventory-tests-')
+_pg_admin_url = os.environ.get('TEST_DATABASE_URL', '')
+_pg_database = f'inventory_test_{uuid.uuid4().hex[:8]}'
+_pg_url = None
+
+
+def _create_pg_database():
+    # A throwaway database next to the one TEST_DATABASE_URL names; None if there is no server
+    if not _pg_admin_url:
+        return None
+    try:
+        import psycopg2
+        conn = psycopg2.connect(_pg_admin_url)
+    except Exception as e:
+        print(f'PostgreSQL tests skipped: {e}')
+        return None
+    conn.autocommit = True
+    conn.cursor().execute(f'CREATE DATABASE {_pg_database}')
+    conn.close()
+    parts = urlsplit(_pg_admin_url)
+    return urlunsplit(parts._replace(path='/' + _pg_database))
+
+
+_pg_url = _create_pg_database()
+BACKENDS = {'sqlite': os.path.join(_tmp, 'inventory.db')}
+if _pg_url:
+    BACKENDS['postgres'] = _pg_url
+
+os.environ.update({
+    'WAREHOUSES': ','.join(f'{name}={path}' for name, path in BACKENDS.items()),
+    'DEFAULT_WAREHOUSE': 'sqlite',
+    'BACKUP_DIR': os.path.join(_tmp, 'backups'),
+    'SCHEDULER_LOCK': os.path.join(_tmp, 'scheduler.lock'),
+    'ARCHIVER': '0',
+    'BACKUPS': '0',
+    'MAINTENANCE': '0',
+    'ALERT_DISPATCHER': '0',
+    'LOG_LEVEL': 'WARNING',
+    # Stress tests queue many writers at once; none of them should be shed
+    'ADMISSION_WRITE_QUEUE': '1000',
+    'ADMISSION_WRITE_WAIT': '60',
+})
+os.chdir(APP_DIR)
+
+import app as app_module  # noqa: E402
+import repository  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if _pg_url:
+        import psycopg2
+        conn = psycopg2.connect(_pg_admin_url)
+        conn.autocommit = True
+        conn.cursor().execute(f'DROP DATABASE IF EXISTS {_pg_database} WITH (FORCE)')
+        conn.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def backend(request):
+    if request.param not in BACKENDS:
+        pytest.skip('PostgreSQL not configured (set TEST_DATABASE_URL)')
+    return request.param
+
+
+@pytest.fixture
+def repo(backend):
+    return repository.get_repository(backend)
+
+
+@pytest.fixture
+def client(backend):
+    client = app_module.app.test_client()
+    client.environ_base['HTTP_X_WAREHOUSE'] = backend
+    return client
+
+
+@pytest.fixture
+def new_item(repo):
+    # Adds a spare part with a serial no other test uses; returns the serial
+    def make(units=10, available=None, item_type='spare_part'):
+        serial = 'T' + uuid.uuid4().hex[:10].upper()
+        repo.add_item(serial, f'Test part {serial}', item_type, 'tests', units, 0,
+                      units if available is None else available)
+        return serial
+    return make
@@ -0,0 +1,41 @@
+# Saturated read/write budgets turn requests away at once with 503 + Retry-After
+import admission
+
+
+def _full_gate(name):
+    gate = admission.Gate(name, 1, 0, 0.01)
+    assert gate.enter()
+    return gate
+
+
+def test_gate_sheds_past_its_queue_and_deadline():
+    gate = admission.Gate('test', 1, 1, 0.05)
+    assert gate.enter()
+    assert not gate.enter()  # waited in the queue past its deadline
+    gate.leave()
+    assert gate.enter()
+    assert gate.stats() == {'concurrency': 1, 'in_flight': 1, 'waiting': 0, 'admitted': 2, 'shed': 1}
+
+    no_queue = admission.Gate('test', 1, 0, 5)
+    assert no_queue.enter()
+    assert not no_queue.enter()  # queue full: turned away without waiting
+
+
+def test_full_write_budget_sheds_writes_only(backend, client, repo, new_item, monkeypatch):
+    serial = new_item()
+    monkeypatch.setitem(admission.write_gates, backend, _full_gate('write:' + backend))
+    response = client.post('/add_return', data={'date': '2024-05-02', 'item_serial': serial, 'personnel': 'Ada'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(admission.RETRY_AFTER_SECONDS)
+    with repo.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM returns WHERE item_serial = ?', (serial,)).fetchone()[0] == 0
+    # GET routes that write are budgeted as writes too; plain reads are not
+    assert client.get('/process_return/1').status_code == 503
+    assert client.get('/spare_parts').status_code == 200
+
+
+def test_full_read_budget_sheds_reads_but_not_probes(client, monkeypatch):
+    monkeypatch.setattr(admission, 'read_gate', _full_gate('read'))
+    response = client.get('/spare_parts')
+    assert response.status_code == 503 and 'Retry-After' in response.headers
+    assert client.get('/healthz').status_code == 200
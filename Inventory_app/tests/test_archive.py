@@ -0,0 +1,43 @@
+# Archived rows still count: in stock counters (even after a restart) and in analytics
+import uuid
+import archive
+import database
+import reliability
+import repository
+
+
+def _counters(repo, serial):
+    item = repo.get_item(serial)
+    return item['units_installed'], item['units_available']
+
+
+def test_restart_after_archiving_keeps_kit_counters():
+    repo = repository.get_repository('sqlite')
+    serial = '15092503'  # a sample kit, recounted by the seed data
+    for _ in range(10):
+        repo.record_allocation('2023-03-01', 'PLATE1', serial, '0801', 'Ada', 'Yaba')
+    before = _counters(repo, serial)
+
+    assert archive.run('sqlite')['allocations'] >= 10
+    with repo.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM allocations WHERE date = '2023-03-01'").fetchone()[0] == 0
+    database.init_db('sqlite')
+    assert _counters(repo, serial) == before
+
+
+def test_condition_ratings_include_archived_returns():
+    repo = repository.get_repository('sqlite')
+    serial = 'R' + uuid.uuid4().hex[:10].upper()
+    repo.add_item(serial, f'Rated part {serial}', 'spare_part', 'tests', 2, 0, 2)
+    with repo.connect() as conn:
+        archive.attach(conn)
+        conn.execute('''
+            INSERT INTO archive.returns (date, item_serial, personnel, status, condition_rating)
+            VALUES ('2020-01-01', ?, 'Ada', 'processed', 1)
+        ''', (serial,))
+        conn.execute('''
+            INSERT INTO returns (date, item_serial, personnel, status, condition_rating)
+            VALUES ('2024-05-01', ?, 'Ada', 'pending', 4)
+        ''', (serial,))
+        conn.commit()
+        assert reliability.load_conditions(conn)[serial] == (2.5, 2)
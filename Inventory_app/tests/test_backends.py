@@ -0,0 +1,145 @@
+# One suite for both storage backends: every test runs against SQLite and, when
+# TEST_DATABASE_URL is set, PostgreSQL (see conftest.py)
+import pytest
+import database
+import postgres
+import reliability
+import repository
+import sync
+import units
+
+
+def test_translate_leaves_literals_alone():
+    sql = "SELECT * FROM t WHERE a = ? AND b LIKE 'x?%' AND c = \"q?\" -- why?\nAND d = ?"
+    assert postgres.translate(sql) == "SELECT * FROM t WHERE a = %s AND b LIKE 'x?%%' AND c = \"q?\" -- why?\nAND d = %s"
+    assert postgres.translate("SELECT 'it''s ?', ?") == "SELECT 'it''s ?', %s"
+
+
+def test_literals_with_placeholder_characters(repo, new_item):
+    serial = new_item()
+    with repo.connect() as conn:
+        row = conn.execute("SELECT '?' AS mark, COUNT(*) AS n FROM items WHERE item_name LIKE 'Test part%' AND serial = ?",
+                           (serial,)).fetchone()
+    assert (row['mark'], row['n']) == ('?', 1)
+
+
+def test_add_item_once(repo, new_item):
+    serial = new_item(units=5)
+    assert not repo.add_item(serial, 'again', 'spare_part')
+    item = repo.get_item(serial)
+    assert (item['units_imported'], item['units_available']) == (5, 5)
+
+
+def test_allocation_takes_stock_and_a_unit(repo, new_item):
+    serial = new_item(units=3)
+    allocation_id = repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    assert repo.get_item(serial)['units_available'] == 2
+    with repo.connect() as conn:
+        assert units.summary(conn, serial)['free_ranges'] == [[2, 3]]
+        holder = units.holder(conn, serial, 1)
+    assert holder['state'] == 'allocated' and holder['allocation']['id'] == allocation_id
+
+
+def test_allocation_without_stock_changes_nothing(repo, new_item):
+    serial = new_item(units=1, available=0)
+    repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    assert repo.get_item(serial)['units_available'] == 0
+
+
+def test_process_return_restores_once(repo, new_item):
+    serial = new_item(units=2)
+    repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    return_id = repo.add_return('2024-05-02', serial, 'Ada', unit_number=1)
+    assert repo.process_return(return_id)['item_serial'] == serial
+    assert repo.process_return(return_id) is None
+    assert repo.get_item(serial)['units_available'] == 2
+    with repo.connect() as conn:
+        assert units.summary(conn, serial)['free_ranges'] == [[1, 2]]
+
+
+def test_process_returns_in_bulk(repo, new_item):
+    first, second = new_item(units=5), new_item(units=5)
+    for serial in (first, first, first, second):
+        repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    ids = [repo.add_return('2024-05-02', serial, 'Ada') for serial in (first, first, second)]
+    assert repo.process_returns(ids + [ids[0]]) == {first: 2, second: 1}
+    assert repo.process_returns(ids) == {}
+    assert repo.get_item(first)['units_available'] == 4
+    assert repo.get_item(second)['units_available'] == 5
+    with repo.connect() as conn:
+        assert units.summary(conn, first)['free_ranges'] == [[1, 2], [4, 5]]
+        assert units.summary(conn, second)['free_ranges'] == [[1, 5]]
+
+
+def test_allocate_kit_all_or_nothing(repo, new_item):
+    frame, motor = new_item(units=4), new_item(units=1)
+    kit_id = repo.save_kit_definition(f'Kit {frame}', {frame: 2, motor: 1})
+    bike = {'date': '2024-05-01', 'old_item_serial': 'PLATE1', 'rider_number': '0801', 'rider_name': 'Ada'}
+    with pytest.raises(repository.InsufficientStock) as shortage:
+        repo.allocate_kit(kit_id, [bike, bike])
+    assert [s['item_serial'] for s in shortage.value.shortages] == [motor]
+    assert repo.get_item(frame)['units_available'] == 4
+
+    assert repo.allocate_kit(kit_id, [bike]) == {frame: 2, motor: 1}
+    assert repo.get_item(frame)['units_available'] == 2
+    assert repo.get_item(motor)['units_available'] == 0
+
+
+def test_allocate_kit_refreshes_reliability(backend, repo, new_item):
+    part = new_item(units=4)
+    kit_id = repo.save_kit_definition(f'Kit {part}', {part: 1})
+    with repo.connect() as conn:
+        before = reliability.report(conn, backend)['replacements']
+    bike = {'date': '2024-05-01', 'old_item_serial': 'PLATE1', 'rider_number': '0801', 'rider_name': 'Ada'}
+    repo.allocate_kit(kit_id, [bike, bike])
+    with repo.connect() as conn:
+        assert reliability.report(conn, backend)['replacements'] == before + 2
+
+
+def test_listings_stream_and_count(repo, new_item):
+    serial = new_item(units=5)
+    before = repo.count_replacements()
+    repo.record_replacement('2024-05-01', 'OLD1', serial, '0801', 'Ada', 'store', '', 'Yaba')
+    assert repo.count_replacements() == before + 1
+    assert any(row['new_item_serial'] == serial for row in repo.stream_replacements())
+
+
+def test_sync_reports_changes_after_a_version(repo, new_item):
+    with repo.connect() as conn:
+        since = sync.current_version(conn)
+    serial = new_item(units=1)
+    return_id = repo.add_return('2024-05-02', serial, 'Ada')
+    repo.delete_return(return_id)
+    with repo.connect() as conn:
+        page = sync.changes(conn, since)
+    assert [row['serial'] for row in page['changes']['items']] == [serial]
+    assert [row['id'] for row in page['changes']['deleted']] == [return_id]
+    assert page['version'] > since and not page['more']
+
+
+@pytest.mark.parametrize('path', ['/', '/conversion_kits', '/spare_parts', '/returns', '/reorder', '/reliability',
+                                  '/readyz', '/sync?since=0'])
+def test_pages(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, response.get_data(as_text=True)[:500]
+    response.get_data()
+
+
+def test_form_allocation_and_return(client, repo, new_item):
+    serial = new_item(units=2)
+    response = client.post('/add_allocation', data={'date': '2024-05-01', 'old_item_serial': 'PLATE1',
+                                                    'new_item_serial': serial, 'rider_number': '0801',
+                                                    'rider_name': 'Ada', 'station': 'Yaba'})
+    assert response.status_code == 302
+    assert repo.get_item(serial)['units_available'] == 1
+    client.post('/add_return', data={'date': '2024-05-02', 'item_serial': serial, 'personnel': 'Ada'})
+    with repo.connect() as conn:
+        return_id = conn.execute('SELECT id FROM returns WHERE item_serial = ?', (serial,)).fetchone()[0]
+    assert client.get(f'/process_return/{return_id}').status_code == 302
+    assert repo.get_item(serial)['units_available'] == 2
+
+
+def test_change_counter_moves_on_commit(repo, new_item):
+    before = database.change_version
+    new_item()
+    assert database.change_version > before
@@ -0,0 +1,63 @@
+# Backups carry the warehouse's archive file along with the hot database
+import os
+import sqlite3
+import uuid
+import archive
+import backup
+import database
+import warehouses
+
+
+def _archived_marker(path, marker):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM allocations WHERE rider_name = ?', (marker,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_and_restore_include_the_archive():
+    marker = 'backup-' + uuid.uuid4().hex[:8]
+    conn = database.get_db_connection('sqlite')
+    try:
+        archive.attach(conn)
+        conn.execute("INSERT INTO archive.allocations (date, new_item_serial, rider_name) VALUES ('2020-01-01', 'OLD', ?)",
+                     (marker,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    result = backup.run('sqlite')
+    assert result['archive_file'] == archive.archive_path(result['file'])
+    assert backup.backup_files('sqlite')[-1] == result['file']
+    assert backup.verify(result['archive_file']) == 'ok'
+    assert _archived_marker(result['archive_file'], marker) == 1
+
+    live_archive = archive.archive_path(warehouses.db_path('sqlite'))
+    conn = database.get_db_connection('sqlite')
+    try:
+        archive.attach(conn)
+        conn.execute('DELETE FROM archive.allocations WHERE rider_name = ?', (marker,))
+        conn.commit()
+    finally:
+        conn.close()
+    assert _archived_marker(live_archive, marker) == 0
+    backup.restore('sqlite', result['file'])
+    assert _archived_marker(live_archive, marker) == 1
+
+    removed = backup.prune('sqlite', keep=0)
+    assert result['file'] in removed and result['archive_file'] in removed
+    assert not os.path.exists(result['archive_file'])
+
+
+def test_backup_files_belong_to_one_warehouse(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'BACKUP_DIR', str(tmp_path))
+    names = ['lagos-20240101-000000.db', 'lagos-20240101-000000_archive.db',
+             'lagos-island-20240101-000000.db', 'lagos-island-20240101-000000_archive.db', 'lagos-notes.db']
+    for name in names:
+        (tmp_path / name).write_bytes(b'')
+    assert backup.backup_files('lagos') == [str(tmp_path / 'lagos-20240101-000000.db')]
+    assert backup.backup_files('lagos-island') == [str(tmp_path / 'lagos-island-20240101-000000.db')]
+
+    backup.prune('lagos', keep=0)
+    assert sorted(os.listdir(tmp_path)) == sorted(names[2:])
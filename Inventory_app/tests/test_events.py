@@ -0,0 +1,15 @@
+# Each open event stream holds a server thread, so subscribers are capped
+import events
+
+
+def test_event_streams_are_capped(client, monkeypatch):
+    monkeypatch.setattr(events, 'MAX_SUBSCRIBERS', 2)
+    monkeypatch.setattr(events, 'subscriber_count', 2)
+    response = client.get('/events')
+    assert response.status_code == 503 and response.headers['Retry-After'] == str(events.RETRY_AFTER_SECONDS)
+
+    monkeypatch.setattr(events, 'subscriber_count', 1)
+    response = client.get('/events', buffered=False)
+    assert response.status_code == 200
+    assert next(iter(response.response)).startswith(b'retry:')
+    response.close()
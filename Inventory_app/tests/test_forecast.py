@@ -0,0 +1,22 @@
+# Reorder forecasts must credit each allocation to its own item, whatever order
+# the database sorts serials in
+import uuid
+from datetime import datetime, timezone
+import forecast
+
+
+def test_demand_goes_to_the_right_item(repo):
+    tag = uuid.uuid4().hex[:6].upper()
+    # Case, digits and punctuation that collations order differently
+    serials = [f'a1{tag}', f'B2{tag}', f'_x{tag}', f'b-3{tag}', f'Z9{tag}']
+    today = datetime.now(timezone.utc).date().isoformat()
+    for allocations, serial in enumerate(serials, start=1):
+        repo.add_item(serial, f'Forecast {serial}', 'spare_part', 'tests', 20, 0, 20)
+        for _ in range(allocations):
+            repo.record_allocation(today, None, serial, '0801', 'Ada', 'Yaba')
+
+    with repo.connect() as conn:
+        rows, _, window_days = forecast.reorder_report(conn, window_days=10)
+    daily_avg = {row['serial']: row['daily_avg'] for row in rows}
+    assert window_days == 10
+    assert [daily_avg[serial] for serial in serials] == [0.1, 0.2, 0.3, 0.4, 0.5]
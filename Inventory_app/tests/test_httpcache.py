@@ -0,0 +1,34 @@
+# Conditional GETs: a 304 only for a copy of the same warehouse, and pages that
+# depend on the date change their validator at midnight
+import database
+import warehouses
+
+FAR_FUTURE = 'Fri, 01 Jan 2100 00:00:00 GMT'
+
+
+def test_etag_revalidates_within_a_warehouse(backend, client):
+    etag = client.get('/spare_parts').headers['ETag']
+    assert f'-{backend}-' in etag
+    assert client.get('/spare_parts', headers={'If-None-Match': etag}).status_code == 304
+    other = etag.replace(f'-{backend}-', '-elsewhere-')
+    assert client.get('/spare_parts', headers={'If-None-Match': other}).status_code == 200
+
+
+def test_if_modified_since_needs_a_single_warehouse(client, monkeypatch):
+    monkeypatch.setattr(warehouses, 'names', lambda: ['north', 'south'])
+    response = client.get('/spare_parts', headers={'If-Modified-Since': FAR_FUTURE})
+    assert response.status_code == 200
+    assert {'Cookie', 'X-Warehouse'} <= set(response.vary)
+
+    monkeypatch.setattr(warehouses, 'names', lambda: ['only'])
+    assert client.get('/spare_parts', headers={'If-Modified-Since': FAR_FUTURE}).status_code == 304
+
+
+def test_reorder_validator_changes_with_the_date(client, monkeypatch):
+    reorder = client.get('/reorder').headers['ETag']
+    spare_parts = client.get('/spare_parts').headers['ETag']
+    assert client.get('/reorder', headers={'If-None-Match': reorder}).status_code == 304
+
+    monkeypatch.setattr(database, 'utc_today', lambda: '2999-12-31')
+    assert client.get('/reorder', headers={'If-None-Match': reorder}).status_code == 200
+    assert client.get('/spare_parts', headers={'If-None-Match': spare_parts}).status_code == 304
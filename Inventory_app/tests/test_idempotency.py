@@ -0,0 +1,50 @@
+# A write resent with the same idempotency key gets the stored response back and
+# is not written twice
+import uuid
+
+
+def _key():
+    return uuid.uuid4().hex
+
+
+def _pending(repo, serial):
+    with repo.connect() as conn:
+        return conn.execute("SELECT COUNT(*) FROM returns WHERE item_serial = ? AND status = 'pending'",
+                            (serial,)).fetchone()[0]
+
+
+def test_resubmitted_form_is_written_once(client, repo, new_item):
+    serial = new_item(units=2)
+    form = {'date': '2024-05-02', 'item_serial': serial, 'personnel': 'Ada', 'idempotency_key': _key()}
+    first = client.post('/add_return', data=form)
+    again = client.post('/add_return', data=form)
+    assert first.status_code == again.status_code == 302
+    assert again.headers['Location'] == first.headers['Location']
+    assert again.headers['Idempotent-Replayed'] == 'true' and 'Idempotent-Replayed' not in first.headers
+    assert _pending(repo, serial) == 1
+
+
+def test_resubmitted_bulk_processing_is_replayed(client, repo, new_item):
+    serial = new_item(units=5)
+    for _ in range(2):
+        repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+        repo.add_return('2024-05-02', serial, 'Ada')
+    form = {'scope': 'filter', 'item_serial': serial, 'idempotency_key': _key()}
+    headers = {'Accept': 'application/json'}
+    first = client.post('/process_returns', data=form, headers=headers)
+    assert first.get_json() == {'processed': 2, 'items': {serial: 2}}
+
+    # A return that arrives later must not be swept up by the resubmitted form
+    repo.add_return('2024-05-03', serial, 'Ada')
+    again = client.post('/process_returns', data=form, headers=headers)
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.get_json() == first.get_json()
+    assert _pending(repo, serial) == 1
+    assert repo.get_item(serial)['units_available'] == 5
+
+
+def test_key_reused_on_another_route_is_refused(client, new_item):
+    key = _key()
+    client.post('/add_return', data={'date': '2024-05-02', 'item_serial': new_item(), 'personnel': 'Ada',
+                                      'idempotency_key': key})
+    assert client.post('/process_returns', data={'idempotency_key': key}).status_code == 422
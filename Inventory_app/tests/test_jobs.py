@@ -0,0 +1,46 @@
+# Several web processes can share a warehouse: recovery must only fail jobs whose
+# process stopped, and only one process may run the shared schedules
+import jobs
+import scheduler
+
+
+def _add_job(repo, owner, heartbeat_at):
+    with repo.connect() as conn:
+        job_id = repo.insert(conn, '''
+            INSERT INTO jobs (kind, params, status, progress, created_at, owner, heartbeat_at)
+            VALUES ('export', '{}', 'running', 0, ?, ?, ?)
+        ''', ('2024-05-01 00:00:00', owner, heartbeat_at))
+        conn.commit()
+    return job_id
+
+
+def _status(repo, job_id):
+    with repo.connect() as conn:
+        return conn.execute('SELECT status, heartbeat_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def test_recover_fails_only_jobs_with_a_stale_heartbeat(backend, repo):
+    now = '9999-01-01 00:00:00'  # never stale
+    live = _add_job(repo, 'other-host:42:abc', now)
+    orphaned = _add_job(repo, 'other-host:43:def', '2000-01-01 00:00:00')
+    legacy = _add_job(repo, None, None)
+    own = _add_job(repo, jobs.OWNER, '2000-01-01 00:00:00')
+
+    jobs.recover(backend)
+    assert [_status(repo, job_id)['status'] for job_id in (live, orphaned, legacy, own)] == \
+        ['running', 'failed', 'failed', 'running']
+
+    jobs.heartbeat(backend)
+    assert _status(repo, own)['heartbeat_at'] > '2000-01-01 00:00:00'
+    assert _status(repo, live)['heartbeat_at'] == now
+
+
+def test_scheduler_lock_has_one_holder(tmp_path):
+    path = str(tmp_path / 'scheduler.lock')
+    first = scheduler.try_lock(path)
+    assert first is not None
+    assert scheduler.try_lock(path) is None
+    first.close()
+    second = scheduler.try_lock(path)
+    assert second is not None
+    second.close()
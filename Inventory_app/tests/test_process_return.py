@@ -0,0 +1,41 @@
+# Concurrent clients processing the same return must restore its unit exactly once
+import threading
+import pytest
+import app as app_module
+import units
+
+CLIENTS = 40
+
+
+@pytest.mark.parametrize('unit_number', [None, 1])
+def test_concurrent_process_return_restores_once(backend, repo, new_item, unit_number):
+    serial = new_item(units=3)
+    repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    return_id = repo.add_return('2024-05-02', serial, 'Ada', unit_number=unit_number)
+    with repo.connect() as conn:
+        free_before = units.summary(conn, serial)['available']
+    available_before = repo.get_item(serial)['units_available']
+
+    start = threading.Barrier(CLIENTS)
+    statuses = []
+
+    def hit():
+        client = app_module.app.test_client()
+        client.environ_base['HTTP_X_WAREHOUSE'] = backend
+        start.wait()
+        statuses.append(client.get(f'/process_return/{return_id}').status_code)
+
+    threads = [threading.Thread(target=hit) for _ in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [302] * CLIENTS
+    assert repo.get_item(serial)['units_available'] == available_before + 1
+    with repo.connect() as conn:
+        summary = units.summary(conn, serial)
+        status = conn.execute('SELECT status FROM returns WHERE id = ?', (return_id,)).fetchone()[0]
+    assert summary['available'] == free_before + 1
+    assert summary['free_ranges'] == [[1, 3]]
+    assert status == 'processed'
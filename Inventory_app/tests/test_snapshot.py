@@ -0,0 +1,60 @@
+# Dashboards read an in-memory copy of the SQLite file (READ_SNAPSHOT=1); a write
+# shows up there once the copy is refreshed, and never sends readers to a stale one
+import uuid
+import pytest
+import app as app_module
+import repository
+import snapshot
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(snapshot, 'ENABLED', True)
+    return repository.get_repository('sqlite')
+
+
+def _has(conn, serial):
+    try:
+        return conn.execute('SELECT COUNT(*) FROM items WHERE serial = ?', (serial,)).fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_refresh_picks_up_a_write(enabled):
+    repo = enabled
+    first = snapshot.refresh('sqlite')
+    assert snapshot.refresh('sqlite') is first  # nothing committed since
+
+    reader = snapshot.get_read_connection('sqlite')
+    assert reader.pool is first
+    serial = 'S' + uuid.uuid4().hex[:10].upper()
+    repo.add_item(serial, 'Snapshot part', 'spare_part', 'tests', 1, 0, 1)
+    assert not _has(snapshot.get_read_connection('sqlite'), serial)
+
+    second = snapshot.refresh('sqlite')
+    assert second is not first and first.retired
+    assert _has(snapshot.get_read_connection('sqlite'), serial)
+    # A reader still on the replaced copy finishes there
+    assert not _has(reader, serial)
+
+
+def test_stale_or_disabled_snapshot_reads_live(enabled, monkeypatch):
+    snap = snapshot.refresh('sqlite')
+    assert snapshot.get_read_connection('sqlite', max_staleness=-1).pool is not snap
+    monkeypatch.setattr(snapshot, 'ENABLED', False)
+    conn = snapshot.get_read_connection('sqlite')
+    assert conn.pool is not snap
+    conn.close()
+
+
+def test_dashboard_serves_the_refreshed_copy(enabled):
+    repo = enabled
+    snapshot.refresh('sqlite')
+    client = app_module.app.test_client()
+    client.environ_base['HTTP_X_WAREHOUSE'] = 'sqlite'
+    serial = 'S' + uuid.uuid4().hex[:10].upper()
+    name = f'Snapshot part {serial}'
+    repo.add_item(serial, name, 'spare_part', 'tests', 3, 0, 3)
+    assert name not in client.get('/').get_data(as_text=True)
+    snapshot.refresh('sqlite')
+    assert name in client.get('/').get_data(as_text=True)
@@ -0,0 +1,66 @@
+# Offline devices: batched uploads are applied once, and downloads page through
+# every change after a version, deletions included
+import uuid
+import sync
+
+
+def _version(repo):
+    with repo.connect() as conn:
+        return sync.current_version(conn)
+
+
+def _op(op, **data):
+    return {'key': uuid.uuid4().hex, 'op': op, 'data': data}
+
+
+def test_upload_applies_each_operation_once(client, repo, new_item):
+    serial = new_item(units=3)
+    batch = [
+        _op('allocation', date='2024-05-01', new_item_serial=serial, rider_number='0801', rider_name='Ada'),
+        _op('return', date='2024-05-02', item_serial=serial, personnel='Ada'),
+        _op('allocation', date='2024-05-01', new_item_serial=serial),  # no rider
+        _op('teleport'),
+    ]
+    results = client.post('/sync', json={'operations': batch}).get_json()['results']
+    assert [r['status'] for r in results] == ['applied', 'applied', 'error', 'error']
+    assert results[2]['error'] == "Missing field 'rider_number'"
+    assert repo.get_item(serial)['units_available'] == 2
+
+    again = client.post('/sync', json={'operations': batch}).get_json()['results']
+    assert [r['status'] for r in again] == ['replayed', 'replayed', 'error', 'error']
+    assert [r['id'] for r in again[:2]] == [r['id'] for r in results[:2]]
+    assert repo.get_item(serial)['units_available'] == 2
+
+
+def test_upload_rejects_malformed_batches(client, monkeypatch):
+    assert client.post('/sync', json={'operations': {}}).status_code == 400
+    monkeypatch.setattr(sync, 'MAX_BATCH', 1)
+    assert client.post('/sync', json={'operations': [_op('teleport'), _op('teleport')]}).status_code == 413
+
+
+def test_download_pages_through_changes_and_deletions(client, repo, new_item):
+    since = _version(repo)
+    serial = new_item(units=2)
+    allocation_id = repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    kept = repo.add_return('2024-05-02', serial, 'Ada')
+    deleted = repo.add_return('2024-05-02', serial, 'Ada')
+    repo.delete_return(deleted)
+
+    full = client.get(f'/sync?since={since}').get_json()
+    assert not full['more'] and full['version'] == _version(repo)
+    assert [row['id'] for row in full['changes']['allocations']] == [allocation_id]
+    assert [row['id'] for row in full['changes']['returns']] == [kept]
+    assert [(row['table'], row['id']) for row in full['changes']['deleted']] == [('returns', deleted)]
+    assert serial in [row['serial'] for row in full['changes']['items']]
+
+    # One change per page, resuming from each page's version, adds up to the same
+    pages, version, more = [], since, True
+    while more:
+        page = client.get(f'/sync?since={version}&limit=1').get_json()
+        pages.append(page)
+        version, more = page['version'], page['more']
+    assert version == full['version']
+    for table, rows in full['changes'].items():
+        assert [row for page in pages for row in page['changes'][table]] == rows
+
+    assert client.get(f"/sync?since={full['version']}").get_json()['changes']['returns'] == []
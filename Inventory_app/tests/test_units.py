@@ -0,0 +1,87 @@
+# Unit tracking must follow the items row when its serial or counters are edited
+from types import SimpleNamespace
+import jobs
+import units
+
+
+def _edit(repo, serial, new_serial=None, imported=None, available=None):
+    item = repo.get_item(serial)
+    repo.update_item(item['id'], new_serial or serial, item['item_name'], item['item_type'], item['admin'],
+                     item['created_at'], item['units_imported'] if imported is None else imported,
+                     item['units_installed'], item['units_available'] if available is None else available)
+
+
+def _free_ranges(repo, serial):
+    with repo.connect() as conn:
+        summary = units.summary(conn, serial)
+    return summary and summary['free_ranges']
+
+
+def test_rename_moves_the_batch(client, repo, new_item):
+    serial = new_item(units=4)
+    repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    _edit(repo, serial, new_serial=serial + 'R')
+    assert _free_ranges(repo, serial) is None
+    assert _free_ranges(repo, serial + 'R') == [[2, 4]]
+    response = client.get(f'/units/{serial}R')
+    assert response.status_code == 200 and response.get_json()['unit_count'] == 4
+
+
+def test_updating_a_missing_item_leaves_units_alone(repo, new_item):
+    serial = new_item(units=4)
+    assert repo.update_item(10 ** 9, serial, 'Ghost', 'spare_part', '', '', 9, 0, 1) is None
+    assert repo.get_item(serial)['units_imported'] == 4
+    assert _free_ranges(repo, serial) == [[1, 4]]
+
+
+def test_editing_the_counter_resyncs_free_units(repo, new_item):
+    serial = new_item(units=6)
+    for _ in range(3):
+        repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    repo.process_return(repo.add_return('2024-05-02', serial, 'Ada', unit_number=2))
+    assert _free_ranges(repo, serial) == [[2, 2], [4, 6]]
+
+    _edit(repo, serial, available=6)
+    assert _free_ranges(repo, serial) == [[1, 6]]
+    _edit(repo, serial, available=2)
+    assert _free_ranges(repo, serial) == [[5, 6]]
+    _edit(repo, serial, imported=8, available=1)
+    assert _free_ranges(repo, serial) == [[8, 8]]
+
+
+def test_recount_resyncs_free_units(repo, new_item):
+    serial = new_item(units=5, item_type='conversion_kit')
+    with repo.connect() as conn:
+        # Allocations that never went through the app, e.g. an import
+        for _ in range(2):
+            conn.execute('INSERT INTO allocations (date, new_item_serial, rider_name) VALUES (?, ?, ?)',
+                         ('2024-05-01', serial, 'Ada'))
+        conn.commit()
+        job = SimpleNamespace(params={'apply': True}, progress=lambda *args, **kwargs: None)
+        jobs.recount(job, conn)
+    assert repo.get_item(serial)['units_available'] == 3
+    assert _free_ranges(repo, serial) == [[3, 5]]
+
+
+def test_bulk_release_matches_one_at_a_time(repo, new_item):
+    # 20 units, every one taken, then the odd ones and 10..12 returned one by one
+    serials = [new_item(units=20, available=0) for _ in range(2)]
+    requests = [4, 8, 8, 9, 14, 25, None, None, None, None]
+    with repo.connect() as conn:
+        for serial in serials:
+            units.release_many(conn, {serial: list(range(1, 21, 2)) + [10, 11, 12]})
+        for unit in requests:
+            units.release(conn, serials[0], unit)
+        released = units.release_many(conn, {serials[1]: requests, 'UNTRACKED': [1]})
+        conn.commit()
+    assert released == {serials[1]: [2, 4, 6, 8, 14, 16, 18]}
+    assert _free_ranges(repo, serials[1]) == _free_ranges(repo, serials[0]) == [[1, 19]]
+
+
+def test_bulk_returns_release_their_units(repo, new_item):
+    serial = new_item(units=6)
+    for _ in range(6):
+        repo.record_allocation('2024-05-01', None, serial, '0801', 'Ada', 'Yaba')
+    ids = [repo.add_return('2024-05-02', serial, 'Ada', unit_number=unit) for unit in (2, 3, 5, None)]
+    assert repo.process_returns(ids) == {serial: 4}
+    assert _free_ranges(repo, serial) == [[1, 3], [5, 5]]
@@ -0,0 +1,302 @@
+# Per-unit tracking with serial ranges
+# units.py
+#
+# An items row is a batch of identical units, numbered 1..unit_count. Instead of a
+# row per unit, unit_ranges keeps the batch's AVAILABLE units as run-length ranges
+# (first_unit..last_unit), so a batch of a million untouched units is one row and
+# the table only grows with fragmentation from out-of-order returns. A unit that is
+# not in a free range is out; the allocation row that took it records its
+# unit_number, which answers "who has unit X" with one index lookup.
+#
+# Every function runs inside the caller's write transaction, next to the stock
+# change it mirrors. Items without a unit_batches row are simply not tracked.
+import bisect
+import archive
+
+RANGE_LIMIT = 100  # free ranges listed by summary()
+BATCH_SIZE = 500  # serials read, and ranges written, per statement by release_many()
+
+
+def _for_update(conn):
+    # PostgreSQL writers must lock the range they are about to cut; SQLite already holds the write lock
+    return ' FOR UPDATE' if conn.dialect == 'postgresql' else ''
+
+
+def unit_count(conn, serial):
+    row = conn.execute('SELECT unit_count FROM unit_batches WHERE item_serial = ?', (serial,)).fetchone()
+    return row[0] if row else None
+
+
+def track(conn, serial, count, available):
+    # Start numbering a batch: the top `available` units are free, the rest are
+    # taken as out (issued before tracking, holder unknown)
+    count = max(int(count or 0), 0)
+    available = min(max(int(available or 0), 0), count)
+    conn.execute('''
+        INSERT INTO unit_batches (item_serial, unit_count) VALUES (?, ?)
+        ON CONFLICT (item_serial) DO NOTHING
+    ''', (serial, count))
+    if available:
+        conn.execute('''
+            INSERT INTO unit_ranges (item_serial, first_unit, last_unit) VALUES (?, ?, ?)
+            ON CONFLICT (item_serial, first_unit) DO NOTHING
+        ''', (serial, count - available + 1, count))
+
+
+def forget(conn, serial):
+    conn.execute('DELETE FROM unit_ranges WHERE item_serial = ?', (serial,))
+    conn.execute('DELETE FROM unit_batches WHERE item_serial = ?', (serial,))
+
+
+def rename(conn, old_serial, new_serial):
+    # The item's serial changed: its batch and free ranges follow it
+    if old_serial == new_serial:
+        return
+    conn.execute('UPDATE unit_batches SET item_serial = ? WHERE item_serial = ?', (new_serial, old_serial))
+    conn.execute('UPDATE unit_ranges SET item_serial = ? WHERE item_serial = ?', (new_serial, old_serial))
+
+
+def resize(conn, serial, count):
+    # The batch's imported count changed: new units arrive free, removed ones leave the ranges
+    current = unit_count(conn, serial)
+    count = max(int(count or 0), 0)
+    if current is None or current == count:
+        return
+    if count > current:
+        release_range(conn, serial, current + 1, count)
+    else:
+        conn.execute('DELETE FROM unit_ranges WHERE item_serial = ? AND first_unit > ?', (serial, count))
+        conn.execute('UPDATE unit_ranges SET last_unit = ? WHERE item_serial = ? AND last_unit > ?',
+                     (count, serial, count))
+    conn.execute('UPDATE unit_batches SET unit_count = ? WHERE item_serial = ?', (count, serial))
+
+
+def next_available(conn, serial):
+    row = conn.execute('''
+        SELECT first_unit FROM unit_ranges WHERE item_serial = ? ORDER BY first_unit LIMIT 1
+    ''', (serial,)).fetchone()
+    return row[0] if row else None
+
+
+def take(conn, serial, count=1):
+    # Take the `count` lowest available units and return their numbers (fewer if
+    # the free ranges run out, none for untracked items)
+    taken = []
+    while len(taken) < count:
+        row = conn.execute('''
+            SELECT first_unit, last_unit FROM unit_ranges WHERE item_serial = ? ORDER BY first_unit LIMIT 1
+        ''' + _for_update(conn), (serial,)).fetchone()
+        if row is None:
+            break
+        first, last = row['first_unit'], row['last_unit']
+        end = min(last, first + count - len(taken) - 1)
+        taken.extend(range(first, end + 1))
+        if end == last:
+            conn.execute('DELETE FROM unit_ranges WHERE item_serial = ? AND first_unit = ?', (serial, first))
+        else:
+            conn.execute('UPDATE unit_ranges SET first_unit = ? WHERE item_serial = ? AND first_unit = ?',
+                         (end + 1, serial, first))
+    return taken
+
+
+def _containing(conn, serial, unit):
+    # The free range holding `unit`, if any
+    row = conn.execute('''
+        SELECT first_unit, last_unit FROM unit_ranges
+        WHERE item_serial = ? AND first_unit <= ? ORDER BY first_unit DESC LIMIT 1
+    ''', (serial, unit)).fetchone()
+    return row if row is not None and row['last_unit'] >= unit else None
+
+
+def release_range(conn, serial, first, last):
+    # Put units first..last (all currently out) back, merging with the neighbouring ranges
+    before = conn.execute('SELECT first_unit FROM unit_ranges WHERE item_serial = ? AND last_unit = ?',
+                          (serial, first - 1)).fetchone()
+    after = conn.execute('SELECT last_unit FROM unit_ranges WHERE item_serial = ? AND first_unit = ?',
+                         (serial, last + 1)).fetchone()
+    if after is not None:
+        conn.execute('DELETE FROM unit_ranges WHERE item_serial = ? AND first_unit = ?', (serial, last + 1))
+        last = after[0]
+    if before is not None:
+        conn.execute('UPDATE unit_ranges SET last_unit = ? WHERE item_serial = ? AND first_unit = ?',
+                     (last, serial, before[0]))
+    else:
+        conn.execute('INSERT INTO unit_ranges (item_serial, first_unit, last_unit) VALUES (?, ?, ?)',
+                     (serial, first, last))
+
+
+def release(conn, serial, unit=None):
+    # Return one unit to the free ranges. Without a unit number (returns that did not
+    # record one) the lowest unit that is out goes back. Returns the unit released,
+    # or None if the item is untracked or the unit is not out.
+    count = unit_count(conn, serial)
+    if count is None:
+        return None
+    if unit is None:
+        first = conn.execute('''
+            SELECT first_unit, last_unit FROM unit_ranges WHERE item_serial = ? ORDER BY first_unit LIMIT 1
+        ''', (serial,)).fetchone()
+        unit = 1 if first is None or first['first_unit'] > 1 else first['last_unit'] + 1
+    if not 1 <= unit <= count or _containing(conn, serial, unit) is not None:
+        return None
+    release_range(conn, serial, unit, unit)
+    return unit
+
+
+def resync(conn, serial, available):
+    # The stock counter was set directly (an edit or a recount): make the free ranges
+    # add up to it again. Extra free units are taken from the bottom, like take();
+    # missing ones come back lowest first, like release() without a unit number.
+    count = unit_count(conn, serial)
+    if count is None:
+        return
+    target = min(max(int(available or 0), 0), count)
+    free = conn.execute('SELECT COALESCE(SUM(last_unit - first_unit + 1), 0) FROM unit_ranges WHERE item_serial = ?',
+                        (serial,)).fetchone()[0]
+    if free > target:
+        take(conn, serial, free - target)
+        return
+    missing = target - free
+    ranges = conn.execute('''
+        SELECT first_unit, last_unit FROM unit_ranges WHERE item_serial = ? ORDER BY first_unit
+    ''', (serial,)).fetchall()
+    gap_start = 1
+    for first, last in [(row['first_unit'], row['last_unit']) for row in ranges] + [(count + 1, count)]:
+        if missing <= 0:
+            break
+        if first > gap_start:
+            end = min(first - 1, gap_start + missing - 1)
+            release_range(conn, serial, gap_start, end)
+            missing -= end - gap_start + 1
+        gap_start = last + 1
+
+
+def _units_to_release(ranges, count, requested):
+    # Which of `requested` (unit numbers, None = any) release() would put back, as a
+    # sorted list: numbered units that are out, then the lowest other units that are out
+    firsts = [first for first, _ in ranges]
+
+    def is_free(unit):
+        i = bisect.bisect_right(firsts, unit) - 1
+        return i >= 0 and ranges[i][1] >= unit
+
+    chosen = {unit for unit in requested if unit is not None and 1 <= unit <= count and not is_free(unit)}
+    wanted = sum(1 for unit in requested if unit is None)
+    gap_start = 1
+    for first, last in ranges + [(count + 1, count)]:
+        unit = gap_start
+        while wanted and unit < first:
+            if unit not in chosen:
+                chosen.add(unit)
+                wanted -= 1
+            unit += 1
+        if not wanted:
+            break
+        gap_start = last + 1
+    return sorted(chosen)
+
+
+def _merge(ranges, released):
+    # Free ranges to delete and insert so `released` (sorted, all out) joins them
+    runs = []
+    for unit in released:
+        if runs and runs[-1][1] == unit - 1:
+            runs[-1][1] = unit
+        else:
+            runs.append([unit, unit])
+    by_last = {last: (first, last) for first, last in ranges}
+    by_first = {first: (first, last) for first, last in ranges}
+    touched = set()
+    for first, last in runs:
+        for neighbour in (by_last.get(first - 1), by_first.get(last + 1)):
+            if neighbour is not None:
+                touched.add(neighbour)
+    merged = []
+    for first, last in sorted(list(touched) + [tuple(run) for run in runs]):
+        if merged and merged[-1][1] == first - 1:
+            merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return [first for first, _ in touched], merged
+
+
+def release_many(conn, requests):
+    # Set-based release() for bulk returns: {serial: [unit number or None, ...]}.
+    # Reads the batches and free ranges of BATCH_SIZE serials at a time, works out the
+    # merged ranges in Python, then writes them with one DELETE and one INSERT per
+    # batch. Returns {serial: [units released]}.
+    serials = list(requests)
+    removed, added, released = [], [], {}
+    for start in range(0, len(serials), BATCH_SIZE):
+        batch = serials[start:start + BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        counts = {row[0]: row[1] for row in conn.execute(
+            f'SELECT item_serial, unit_count FROM unit_batches WHERE item_serial IN ({placeholders})', batch)}
+        ranges = {}
+        for row in conn.execute(f'''
+            SELECT item_serial, first_unit, last_unit FROM unit_ranges
+            WHERE item_serial IN ({placeholders}) ORDER BY item_serial, first_unit
+        ''' + _for_update(conn), batch):
+            ranges.setdefault(row[0], []).append((row[1], row[2]))
+        for serial in batch:
+            if serial not in counts:
+                continue
+            picked = _units_to_release(ranges.get(serial, []), counts[serial], requests[serial])
+            if picked:
+                old, new = _merge(ranges.get(serial, []), picked)
+                removed.extend((serial, first) for first in old)
+                added.extend((serial, first, last) for first, last in new)
+                released[serial] = picked
+    for start in range(0, len(removed), BATCH_SIZE):
+        batch = removed[start:start + BATCH_SIZE]
+        conn.execute(f'''
+            DELETE FROM unit_ranges WHERE (item_serial, first_unit) IN (VALUES {', '.join(['(?, ?)'] * len(batch))})
+        ''', [value for pair in batch for value in pair])
+    for start in range(0, len(added), BATCH_SIZE):
+        batch = added[start:start + BATCH_SIZE]
+        conn.execute(f'''
+            INSERT INTO unit_ranges (item_serial, first_unit, last_unit) VALUES {', '.join(['(?, ?, ?)'] * len(batch))}
+        ''', [value for row in batch for value in row])
+    return released
+
+
+def holder(conn, serial, unit):
+    # Who has unit `unit` of batch `serial`: {'state': 'available' | 'allocated' | 'unknown', ...}
+    count = unit_count(conn, serial)
+    if count is None or not 1 <= unit <= count:
+        return None
+    result = {'item_serial': serial, 'unit': unit}
+    if _containing(conn, serial, unit) is not None:
+        return dict(result, state='available')
+    latest = None
+    for source in archive.sources(conn, 'allocations'):
+        row = conn.execute(f'''
+            SELECT id, date, rider_number, rider_name, station, old_item_serial FROM {source}
+            WHERE new_item_serial = ? AND unit_number = ? ORDER BY id DESC LIMIT 1
+        ''', (serial, unit)).fetchone()
+        if row is not None and (latest is None or row['id'] > latest['id']):
+            latest = row
+    if latest is None:
+        # Out since before unit tracking started
+        return dict(result, state='unknown')
+    return dict(result, state='allocated', allocation=dict(latest))
+
+
+def summary(conn, serial):
+    count = unit_count(conn, serial)
+    if count is None:
+        return None
+    ranges = conn.execute('''
+        SELECT first_unit, last_unit FROM unit_ranges WHERE item_serial = ? ORDER BY first_unit LIMIT ?
+    ''', (serial, RANGE_LIMIT)).fetchall()
+    totals = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(last_unit - first_unit + 1), 0) FROM unit_ranges WHERE item_serial = ?
+    ''', (serial,)).fetchone()
+    return {
+        'item_serial': serial,
+        'unit_count': count,
+        'available': totals[1],
+        'range_count': totals[0],
+        'next_available': ranges[0]['first_unit'] if ranges else None,
+        'free_ranges': [[row['first_unit'], row['last_unit']] for row in ranges],
+    }